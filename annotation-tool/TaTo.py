@@ -13,6 +13,10 @@ from vcd4parser import DMDVcdHandler
 # Import local class to get tato configuration and paths
 from setUp import ConfigTato
 
+# Import the functions of DEx (exploreMaterial-tool/video_index.py) to seek with the video keyframe index
+sys.path.append(str(Path(__file__).resolve().parent.parent / "exploreMaterial-tool"))
+from video_index import loadIndex, seekFrame
+
 
 # ----TaTo----
 # Written by Paola Cañas and Juan Diego Ortega with <3
@@ -1672,6 +1676,8 @@ def showMosaic(mosaicVideo, annotations, validations):
     count = 0
     # @next_frame: True if the next frame that will be show is next in video, False otherwise
     next_frame = False
+    # @mosaicPosition: frame that mosaicVideo will read next, None if unknown
+    mosaicPosition = None
     # @applyLevels: True if all levels of annotation has been modifyed by level of actions
     applyLevels = False
     # @firstMove: True to move the windows at specific positions. To do it just once
@@ -1722,10 +1728,11 @@ def showMosaic(mosaicVideo, annotations, validations):
                     # If we don't have to update the frame, use the previous image
                     # or capture first image if it is the first time
                     if last_frame != count or first:
-                        # if is not the next frame, then set the desired frame
-                        if not next_frame:
-                            mosaicVideo.set(cv2.CAP_PROP_POS_FRAMES, count)
+                        # if is not the next frame or the video is not there (e.g. after the viewer), then set the desired frame
+                        if not next_frame or mosaicPosition != count:
+                            mosaicPosition = seekFrame(mosaicVideo, mosaicPosition, count, mosaicKeyframes)
                         retMosaic, frameMosaic = mosaicVideo.read()
+                        mosaicPosition = count + 1 if retMosaic else None
 
                 if first:
                     frameInfo = frameMosaic[108: 62 + 100,
@@ -1954,6 +1961,8 @@ def showMosaic(mosaicVideo, annotations, validations):
                     count = showLiveAnnotationsGeneral(
                         count, mosaicVideo, annotations, validations, mode
                     )
+                # The viewer moved mosaicVideo: its position is no longer known
+                mosaicPosition = None
 
             # press [p] to open Instructions window
             elif key == ord("p") or key == ord("P"):
@@ -2095,6 +2104,8 @@ def showGeneralVideo(mosaicVideo, annotations, validations):
     count = 0
     # @next_frame: True if the next frame that will be show is next in video, False otherwise
     next_frame = False
+    # @mosaicPosition: frame that mosaicVideo will read next, None if unknown
+    mosaicPosition = None
     # @applyLevels: True if all levels of annotation has been modifyed by level of actions
     applyLevels = False
     # @firstMove: True to move the windows at specific positions. To do it just once
@@ -2145,10 +2156,11 @@ def showGeneralVideo(mosaicVideo, annotations, validations):
                     # If we don't have to update the frame, use the previous image
                     # or capture first image if it is the first time
                     if last_frame != count or first:
-                        # if is not the next frame, then set the desired frame
-                        if not next_frame:
-                            mosaicVideo.set(cv2.CAP_PROP_POS_FRAMES, count)
+                        # if is not the next frame or the video is not there (e.g. after the viewer), then set the desired frame
+                        if not next_frame or mosaicPosition != count:
+                            mosaicPosition = seekFrame(mosaicVideo, mosaicPosition, count, mosaicKeyframes)
                         retMosaic, frameMosaic = mosaicVideo.read()
+                        mosaicPosition = count + 1 if retMosaic else None
 
                 if first:
                     frameInfo = frameMosaic[108: 62 + 100,
@@ -2348,6 +2360,8 @@ def showGeneralVideo(mosaicVideo, annotations, validations):
                     count = showLiveAnnotationsGeneral(
                         count, mosaicVideo, annotations, validations, mode
                     )
+                # The viewer moved mosaicVideo: its position is no longer known
+                mosaicPosition = None
             # press [p] to open Instructions window
             elif key == ord("p") or key == ord("P"):
                 showInstructionsWindow()
@@ -2640,8 +2654,16 @@ if setUpManager._dataset_dmd:
     total_height = height
     total_width = w2 + shrinkdim[0]
 
+# @mosaicIndex: keyframe index of the mosaic video (made with video_index.py of DEx), None if it is not indexed
+mosaicIndex = loadIndex(setUpManager._video_file_path)
+# @mosaicKeyframes: keyframes to seek straight to the GOP of a frame, None to let OpenCV seek
+mosaicKeyframes = mosaicIndex["keyframes"] if mosaicIndex else None
+
 # @frameNumber: total number of frames. -1 for showing frames position starting from 0
-frameNumber = int(mosaicVideo.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+if mosaicIndex:
+    frameNumber = mosaicIndex["frames"] - 1
+else:
+    frameNumber = int(mosaicVideo.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
 # @first: control variable to extract the videos offset info from mosaic frame once
 first = True
 # @frameInfo: shifts info rectangle from mosaicVideo
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Generator of a synthetic DMD: a folder with the structure, videos and OpenLABEL files of the DMD
+# (dmd/<group>/<subject>/<session>/...) to measure the tools without the real dataset.
+# Each distraction session has rgb and ir face, body and hands videos (mp4, h264), 16 bit depth videos
+# (avi, ffv1, one frame shorter like in the DMD) and the rgb mosaic video (avi) used by TaTo.
+# The streams start at different frames of the mosaic, with frame_shift values like the ones of the DMD.
+# The OpenLABEL is written by TaTo (annotation-tool/vcd4parser.py) from annotation vectors with intervals
+# of driver actions and their related gaze, hands, objects and talking labels.
+# Run it as: python make_fixture.py <output folder> [--frames N] [--size WxH] [--gop N] ...
+
+fps = 29.76
+repoPath = Path(__file__).resolve().parents[1]
+tatoPath = repoPath / "annotation-tool"
+
+# Driver actions of each distraction session (s1: attm, s2: atts, s3: reach, s4: attc), by driver_actions label id
+sessionActions = {
+    "s1": [1, 2, 3, 4, 5, 6, 8, 9],
+    "s2": [1, 2, 3, 4, 5, 6, 8, 9],
+    "s3": [7, 10, 11, 12],
+    "s4": [1, 2, 5, 6, 9, 13],
+}
+# Labels related to each driver action: [objects_in_scene, hands_using_wheel, gaze_on_road, talking]
+# with the label ids of the distraction config of TaTo (annotation-tool/config_distraction.json). 99: no label
+actionLabels = {
+    1: [0, 2, 1, 99],   # texting_right: cellphone, only_left, not_looking_road
+    2: [0, 2, 0, 0],    # phonecall_right: cellphone, only_left, looking_road, talking
+    3: [0, 1, 1, 99],   # texting_left: cellphone, only_right, not_looking_road
+    4: [0, 1, 0, 0],    # phonecall_left: cellphone, only_right, looking_road, talking
+    5: [99, 2, 1, 99],  # radio
+    6: [2, 2, 0, 99],   # drinking: bottle
+    7: [99, 2, 1, 99],  # reach_side
+    8: [1, 3, 1, 99],   # hair_and_makeup: hair_comb, none
+    9: [99, 0, 1, 0],   # talking_to_passenger
+    10: [99, 2, 1, 99], # reach_backseat
+    11: [99, 2, 0, 99], # change_gear (and hand_on_gear)
+    12: [99, 0, 0, 99], # standstill_or_waiting
+    13: [99, 0, 0, 99], # unclassified
+}
+# Levels of the distraction config
+occlusionLevel, gazeLevel, talkingLevel, wheelLevel, gearLevel, objectLevel, actionLevel = range(7)
+streams = ["face", "body", "hands"]
+
+
+# Function to get a ConfigTato (annotation-tool/setUp.py) of the mosaic @videoPath and the OpenLABEL @vcdPath
+# without asking for them in the console, to build TaTo OpenLABEL handlers outside the tool.
+# Handlers read config_statics.json from the working directory, so they must be built in annotation-tool
+def getTatoSetUp(videoPath, vcdPath, group, subject, session, timestamp, annotationMode="distraction"):
+    if str(tatoPath) not in sys.path:
+        sys.path.insert(0, str(tatoPath))
+    from setUp import ConfigTato
+    setUp = ConfigTato.__new__(ConfigTato)
+    setUp._annotation_mode = annotationMode
+    setUp._config_json = str(tatoPath / "config.json")
+    setUp._annConfig_file_path = tatoPath / ("config_" + annotationMode + ".json")
+    setUp._dataset_dmd = True
+    setUp._external_struct = True
+    setUp._video_file_path = Path(videoPath)
+    setUp._vcd_file_path = Path(vcdPath)
+    setUp._group, setUp._subject, setUp._session = group, subject, session
+    setUp._date = timestamp.split("T")[0]
+    setUp._timestamp = timestamp
+    setUp._stream = "mosaic"
+    setUp._channel = "rgb"
+    return setUp
+
+
+# Function to write the @frames (generator of BGR images of @width x @height) in @path with ffmpeg
+# @codec: "libx264" for rgb and ir, "ffv1" for 16 bit depth (frames are then uint16 gray images)
+# @gop: frames between keyframes
+def writeVideo(path, frames, width, height, gop, codec="libx264"):
+    depth = codec == "ffv1"
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo",
+               "-pix_fmt", "gray16le" if depth else "bgr24", "-s", "%dx%d" % (width, height), "-r", str(fps),
+               "-i", "-", "-c:v", codec, "-g", str(gop)]
+    if depth:
+        command += ["-pix_fmt", "gray16le"]
+    else:
+        command += ["-pix_fmt", "yuv420p", "-preset", "ultrafast", "-bf", "2"]
+    process = subprocess.Popen(command + [str(path)], stdin=subprocess.PIPE)
+    try:
+        for image in frames:
+            process.stdin.write(image.tobytes())
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError("WARNING: video %s could not be written" % path)
+
+
+# Generator of @count synthetic frames of @width x @height: a moving gradient with the frame number written on it,
+# so each frame is different and encoders do real work. @seed changes the colors of each video
+def makeFrames(count, width, height, seed, depth=False):
+    x = np.arange(width, dtype=np.uint16)[None, :] * 256 // width
+    y = np.arange(height, dtype=np.uint16)[:, None] * 128 // height
+    gradient = x + y
+    for frame in range(count):
+        if depth:
+            image = ((gradient * 16 + frame * 13 + seed * 101) & 4095) + 500
+        else:
+            gray = (gradient + frame * 3 + seed * 37).astype(np.uint8)
+            image = np.dstack([gray, gray + np.uint8(85 + seed * 10), np.uint8(255) - gray + np.uint8(seed * 20)])
+        # OpenCV only draws text in 8 bit images
+        text = np.zeros((height, width), dtype=np.uint8)
+        cv2.putText(text, str(frame), (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, height / 150,
+                    255, max(1, height // 100))
+        image[text > 0] = 60000 if depth else 255
+        yield image
+
+
+# Function to get the annotation and validation vectors of a session of @frames mosaic frames
+# @starts: mosaic frame where each stream starts, @lengths: frames of each stream
+# Driver actions alternate safe_drive with actions of @session, with lognormal durations around 3 s,
+# and the gaze, hands, objects and talking levels follow the action. Levels of frames without their stream are NAN
+def makeAnnotations(frames, session, starts, lengths, camera_dependencies, rng):
+    annotations = np.zeros((frames, 7), dtype=int)
+    annotations[:, [talkingLevel, gearLevel, objectLevel, occlusionLevel]] = 99
+    # 1: manual, 2: interval
+    validations = np.ones((frames, 7), dtype=int)
+
+    frame = int(rng.integers(0, 3 * fps))
+    while frame < frames:
+        # safe_drive between actions
+        frame += int(rng.uniform(2, 8) * fps)
+        if frame >= frames:
+            break
+        action = int(rng.choice(sessionActions.get(session, sessionActions["s1"])))
+        end = min(frames, frame + max(10, int(rng.lognormal(np.log(3 * fps), 0.5))))
+        objects, wheel, gaze, talking = actionLabels[action]
+        annotations[frame:end, actionLevel] = action
+        annotations[frame:end, objectLevel] = objects
+        annotations[frame:end, wheelLevel] = wheel
+        annotations[frame:end, gazeLevel] = gaze
+        annotations[frame:end, talkingLevel] = talking
+        if action == 11:
+            annotations[frame:end, gearLevel] = 0
+        if rng.random() < 0.2:
+            validations[frame:end, :] = 2
+        frame = end
+    # Short glances away from the road and occlusions of a camera
+    for _ in range(frames // int(10 * fps)):
+        start = int(rng.integers(0, frames))
+        annotations[start:start + int(rng.integers(5, 20)), gazeLevel] = 1
+    for _ in range(frames // int(60 * fps) + 1):
+        start = int(rng.integers(0, frames))
+        annotations[start:start + int(rng.integers(10, 30)), occlusionLevel] = int(rng.integers(0, 3))
+
+    for stream in streams:
+        streamEnd = starts[stream] + lengths[stream]
+        for level in camera_dependencies[stream]:
+            annotations[:starts[stream], level] = 100
+            annotations[streamEnd:, level] = 100
+    return annotations, validations
+
+
+# Function to write a synthetic session in @root/<group>/<subject>/<session> with a mosaic of @frames frames
+# Returns the path of its OpenLABEL
+def makeSession(root, group, subject, session, timestamp, frames, width, height, gop, rng):
+    sessionPath = Path(root) / group / subject / session
+    sessionPath.mkdir(parents=True, exist_ok=True)
+    base = "%s_%s_%s_%s" % (group, subject, session, timestamp)
+
+    # Mosaic frame where each stream starts: one stream starts at 0 and the others up to 1.5 s later
+    starts = {stream: int(rng.integers(0, int(1.5 * fps))) for stream in streams}
+    first = min(starts.values())
+    starts = {stream: start - first for stream, start in starts.items()}
+    lengths = {stream: frames - starts[stream] - int(rng.integers(0, 5)) for stream in streams}
+
+    for count, stream in enumerate(streams):
+        for channelCount, channel in enumerate(["rgb", "ir"]):
+            writeVideo(sessionPath / ("%s_%s_%s.mp4" % (base, channel, stream)),
+                       makeFrames(lengths[stream], width, height, count * 2 + channelCount), width, height, gop)
+        # Depth videos of the DMD miss their last frame
+        writeVideo(sessionPath / ("%s_depth_%s.avi" % (base, stream)),
+                   makeFrames(lengths[stream] - 1, width, height, count, depth=True), width, height, gop, "ffv1")
+    mosaicPath = sessionPath / (base + "_rgb_mosaic.avi")
+    writeVideo(mosaicPath, makeFrames(frames, width, height, 7), width, height, gop)
+
+    # OpenLABEL written by TaTo
+    vcdPath = sessionPath / (base + "_rgb_ann_distraction.json")
+    if vcdPath.exists():
+        os.remove(str(vcdPath))
+    setUp = getTatoSetUp(mosaicPath, vcdPath, group, subject, session, timestamp)
+    workingPath = os.getcwd()
+    os.chdir(str(tatoPath))
+    try:
+        from vcd4parser import DMDVcdHandler
+        vcdHandler = DMDVcdHandler(setUp)
+        annotations, validations = makeAnnotations(frames, session, starts, lengths,
+                                                   vcdHandler._camera_dependencies, rng)
+        # Stream frame = mosaic frame - start: body and hands shifts are relative to face
+        vcdHandler.set_shifts(body_face_shift=starts["body"] - starts["face"],
+                              hands_face_shift=starts["hands"] - starts["face"])
+        intrinsics = np.zeros(12).tolist()
+        recordTime = timestamp.replace(";", ":")
+        statics = [{"val": int(rng.integers(20, 60))}, {"val": "Female" if rng.random() < 0.5 else "Male"},
+                   {"val": bool(rng.random() < 0.3)}, {"val": "Everyday"}, {"val": "More than 3 years"},
+                   {"val": "Sunny"}, {"val": "Car Moving"}, {"val": 1}]
+        metadata = [[lengths["face"], intrinsics], [recordTime, lengths["body"], intrinsics],
+                    [lengths["hands"], intrinsics]]
+        vcdHandler.update_save_vcd(annotations, validations, statics, metadata)
+    finally:
+        os.chdir(workingPath)
+    return vcdPath
+
+
+# Function to write a synthetic DMD in @root with @groups groups of @subjects subjects with the distraction
+# @sessions, each with a mosaic of @frames frames of @width x @height and a keyframe every @gop frames
+# Returns the list of OpenLABEL paths
+def makeFixture(root, groups=1, subjects=1, sessions=("s1",), frames=900, width=640, height=360, gop=30, seed=0):
+    rng = np.random.default_rng(seed)
+    root = Path(root).resolve()
+    vcdPaths = []
+    for groupCount in range(groups):
+        group = "g" + "ABCDEF"[groupCount % 6]
+        for subjectCount in range(subjects):
+            subject = str(groupCount * subjects + subjectCount + 1)
+            for sessionCount, session in enumerate(sessions):
+                timestamp = "2019-03-%02dT09;%02d;15+01;00" % (8 + subjectCount % 20, 10 + sessionCount * 5)
+                print("Writing %s %s %s" % (group, subject, session))
+                vcdPaths.append(makeSession(root, group, subject, session, timestamp, frames, width, height, gop, rng))
+    return vcdPaths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic DMD with videos and OpenLABEL files")
+    parser.add_argument("output", help="folder of the synthetic dmd")
+    parser.add_argument("--groups", type=int, default=1)
+    parser.add_argument("--subjects", type=int, default=1, help="subjects per group")
+    parser.add_argument("--sessions", default="s1", help="comma separated distraction sessions: s1,s2,s3,s4")
+    parser.add_argument("--frames", type=int, default=900, help="frames of the mosaic of each session")
+    parser.add_argument("--size", default="640x360", help="size of the videos, WxH")
+    parser.add_argument("--gop", type=int, default=30, help="frames between keyframes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    width, height = [int(value) for value in args.size.split("x")]
+    makeFixture(args.output, args.groups, args.subjects, args.sessions.split(","), args.frames, width, height,
+                args.gop, args.seed)
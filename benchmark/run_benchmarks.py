@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from make_fixture import makeFixture, getTatoSetUp, repoPath, tatoPath
+
+# Benchmarks of DEx (exploreMaterial-tool) and TaTo (annotation-tool) on a synthetic DMD made by make_fixture.py.
+# Each benchmark runs in its own process, because both tools have modules with the same names, and is repeated
+# @repeat times. The best time of each benchmark is compared with the baseline stored in baselines.json:
+# slower than the baseline by more than @tolerance is a regression and the script exits with code 1.
+# Baselines depend on the machine: store the ones of your machine with --save before changing the code.
+# Run it as: python run_benchmarks.py [--fixture folder] [--repeat N] [--tolerance 0.25] [--save]
+
+dexPath = repoPath / "exploreMaterial-tool"
+baselinesPath = Path(__file__).resolve().parent / "baselines.json"
+# Settings of the synthetic DMD of the benchmarks (arguments of makeFixture)
+fixtureSettings = {"groups": 1, "subjects": 1, "sessions": ["s1", "s3"], "frames": 900,
+                   "width": 640, "height": 360, "gop": 30, "seed": 0}
+# DEx settings of the export benchmarks
+exportSettings = {"streams": ["face", "body"], "annotations": ["driver_actions/safe_drive", "driver_actions/texting_right",
+                  "driver_actions/phonecall_right", "driver_actions/radio", "driver_actions/drinking",
+                  "driver_actions/reach_side", "driver_actions/change_gear"],
+                  "write": True, "size": [224, 224], "intervalChunk": 0, "ignoreSmall": False, "asc": True,
+                  "resume": False}
+
+
+# Function to get the OpenLABEL files of the synthetic DMD in @fixturePath, making it if it does not exist
+def getFixture(fixturePath):
+    fixturePath = Path(fixturePath).resolve()
+    settingsPath = fixturePath / "fixture.json"
+    if settingsPath.exists():
+        with open(str(settingsPath)) as settingsFile:
+            if json.load(settingsFile) != fixtureSettings:
+                print("WARNING: the fixture in %s was made with other settings, times are not comparable "
+                      "with the baselines" % fixturePath)
+    else:
+        print("Writing the synthetic DMD in %s" % fixturePath)
+        makeFixture(fixturePath, **fixtureSettings)
+        with open(str(settingsPath), "w") as settingsFile:
+            json.dump(fixtureSettings, settingsFile)
+    return sorted(str(path) for path in fixturePath.glob("*/*/*/*.json"))
+
+
+# Functions of the benchmarks: each one prepares what is not measured and returns the function to measure.
+# @vcdPaths: OpenLABEL files of the fixture, @fixturePath: root of the fixture, @workPath: empty folder to write in
+
+def benchOpenlabelLoad(vcdPaths, fixturePath, workPath):
+    from vcd4reader import VcdDMDHandler
+
+    def run():
+        for vcdPath in vcdPaths:
+            VcdDMDHandler(vcd_file=Path(vcdPath))
+    return run
+
+
+def benchStatistics(vcdPaths, fixturePath, workPath):
+    from statistics import get_statistics
+    count = [0]
+
+    def run():
+        count[0] += 1
+        for vcdPath in vcdPaths:
+            get_statistics(vcdPath, os.path.join(workPath, "statistics_%d.txt" % count[0]))
+    return run
+
+
+# Function to get a benchmark of exportClass with the DEx @settings added to exportSettings
+def getExportBenchmark(settings):
+    def bench(vcdPaths, fixturePath, workPath):
+        from accessDMDAnn import exportClass
+        with open(os.path.join(workPath, "config_DEx.json"), "w") as configFile:
+            json.dump(dict(exportSettings, **settings), configFile)
+        count = [0]
+
+        def run():
+            count[0] += 1
+            for vcdPath in vcdPaths:
+                exportClass(vcdPath, str(fixturePath), os.path.join(workPath, "export_%d" % count[0]))
+        return run
+    return bench
+
+
+# Function to get the TaTo OpenLABEL handlers of @vcdPaths, loaded like TaTo does
+def getTatoHandlers(vcdPaths):
+    from vcd4parser import DMDVcdHandler
+    handlers = []
+    workingPath = os.getcwd()
+    os.chdir(str(tatoPath))
+    try:
+        for vcdPath in vcdPaths:
+            vcdPath = Path(vcdPath)
+            group, subject, session = vcdPath.parts[-4:-1]
+            base = vcdPath.name.split("_rgb_ann")[0]
+            mosaicPath = vcdPath.parent / (base + "_rgb_mosaic.avi")
+            handlers.append(DMDVcdHandler(getTatoSetUp(mosaicPath, vcdPath, group, subject, session,
+                                                       base.split("_")[3])))
+    finally:
+        os.chdir(workingPath)
+    return handlers
+
+
+def benchTatoAnnotationVectors(vcdPaths, fixturePath, workPath):
+    handlers = getTatoHandlers(vcdPaths)
+
+    def run():
+        for handler in handlers:
+            handler.get_annotation_vectors()
+    return run
+
+
+def benchTatoUpdateVcd(vcdPaths, fixturePath, workPath):
+    handlers = getTatoHandlers(vcdPaths)
+    vectors = [handler.get_annotation_vectors() for handler in handlers]
+
+    def run():
+        for handler, (annotations, validations) in zip(handlers, vectors):
+            handler.update_vcd(annotations, validations)
+    return run
+
+
+# Benchmarks: name: [tool folder, function]
+benchmarks = {
+    "openlabel_load": [dexPath, benchOpenlabelLoad],
+    "statistics": [dexPath, benchStatistics],
+    "export_images": [dexPath, getExportBenchmark({"material": ["image"], "channels": ["rgb"]})],
+    "export_videos": [dexPath, getExportBenchmark({"material": ["video"], "channels": ["rgb"]})],
+    "export_depth": [dexPath, getExportBenchmark({"material": ["image", "video"], "channels": ["depth"]})],
+    "tato_annotation_vectors": [tatoPath, benchTatoAnnotationVectors],
+    "tato_update_vcd": [tatoPath, benchTatoUpdateVcd],
+}
+
+
+# Function run in the process of the benchmark @name: prints the seconds of each of the @repeat runs as json
+def runBenchmark(name, fixturePath, repeat):
+    toolPath, bench = benchmarks[name]
+    sys.path.insert(0, str(toolPath))
+    # statistics.py of DEx replaces the standard module imported by this script
+    sys.modules.pop("statistics", None)
+    vcdPaths = sorted(str(path) for path in Path(fixturePath).glob("*/*/*/*.json"))
+    workPath = tempfile.mkdtemp(prefix="dmd_bench_")
+    workingPath = os.getcwd()
+    os.chdir(workPath)
+    try:
+        run = bench(vcdPaths, fixturePath, workPath)
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+    finally:
+        os.chdir(workingPath)
+        shutil.rmtree(workPath, ignore_errors=True)
+    print(json.dumps({"seconds": seconds}))
+
+
+# Function to run the benchmarks @names, each in its own process, and compare them with the baselines
+# Returns the dict of results: {name: {"best", "median", "baseline", "change", "status"}}
+def runBenchmarks(names, fixturePath, repeat, tolerance, verbose=False):
+    baselines = {}
+    if baselinesPath.exists():
+        with open(str(baselinesPath)) as baselinesFile:
+            baselines = json.load(baselinesFile)
+        if baselines.get("fixture") != fixtureSettings:
+            print("WARNING: the baselines were stored with another fixture, they are not compared")
+            baselines = {}
+    results = {}
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), "--case", name, "--fixture", str(fixturePath),
+                   "--repeat", str(repeat)]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        if verbose or process.returncode != 0:
+            print(process.stdout)
+        if process.returncode != 0:
+            print("WARNING: benchmark %s failed" % name)
+            results[name] = {"best": None, "median": None, "baseline": None, "change": None, "status": "FAILED"}
+            continue
+        seconds = json.loads(process.stdout.strip().splitlines()[-1])["seconds"]
+        result = {"best": min(seconds), "median": statistics.median(seconds),
+                  "baseline": baselines.get("benchmarks", {}).get(name), "change": None, "status": "new"}
+        if result["baseline"]:
+            result["change"] = result["best"] / result["baseline"] - 1
+            if result["change"] > tolerance:
+                result["status"] = "REGRESSION"
+            elif result["change"] < -tolerance:
+                result["status"] = "faster"
+            else:
+                result["status"] = "ok"
+        results[name] = result
+        printResult(name, result)
+    return results
+
+
+def printResult(name, result):
+    if result["best"] is None:
+        print("%-24s %s" % (name, result["status"]))
+        return
+    baseline = "%8.3f s" % result["baseline"] if result["baseline"] else "%10s" % "-"
+    change = "%+6.1f %%" % (result["change"] * 100) if result["change"] is not None else ""
+    print("%-24s best %8.3f s  median %8.3f s  baseline %s  %8s  %s" % (name, result["best"], result["median"],
+                                                                        baseline, change, result["status"]))
+
+
+# Function to store the best times of @results as the new baselines
+def saveBaselines(results):
+    baselines = {"fixture": fixtureSettings, "machine": {"platform": platform.platform(),
+                                                         "processor": platform.processor(),
+                                                         "cpus": os.cpu_count(),
+                                                         "python": platform.python_version()},
+                 "date": time.strftime("%Y-%m-%d"),
+                 "benchmarks": {name: round(result["best"], 4) for name, result in results.items()
+                                if result["best"] is not None}}
+    with open(str(baselinesPath), "w") as baselinesFile:
+        json.dump(baselines, baselinesFile, indent=1)
+    print("Baselines saved in", baselinesPath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of DEx and TaTo on a synthetic DMD")
+    parser.add_argument("--fixture", default=os.path.join(tempfile.gettempdir(), "dmd_bench_fixture"),
+                        help="folder of the synthetic dmd, made if it does not exist")
+    parser.add_argument("--benchmarks", default=",".join(benchmarks),
+                        help="comma separated benchmarks: " + ", ".join(benchmarks))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the benchmarks")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        runBenchmark(args.case, args.fixture, args.repeat)
+    else:
+        getFixture(args.fixture)
+        results = runBenchmarks(args.benchmarks.split(","), args.fixture, args.repeat, args.tolerance, args.verbose)
+        if args.save:
+            saveBaselines(results)
+        elif any(result["status"] in ["REGRESSION", "FAILED"] for result in results.values()):
+            sys.exit(1)
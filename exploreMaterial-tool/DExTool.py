@@ -3,27 +3,22 @@
 import glob
 import os
 import re
+import time
 from pathlib import Path
 from accessDMDAnn import exportClass
 from group_split_material import splitClass, groupClass
 from statistics import get_statistics
-
-print("Welcome :)")
-opt = int(input("What do you whish to do?:  export material for training:[0]  group exported material by classes:[1]  create train and test split:[2]  get statistics:[3] : "))
-
-if opt == 0:
-    # export material for training
-    print("To change export settings go to config_DEx.json and change control variables.")
-    destination_path = input("Enter destination path: ")
-    selec = input("How do you want to read annotations, by: Group:[g]  Sessions:[f]  One OpenLABEL:[v] : ")
-
-    if selec == "g":
-        #By group
-        folder_path = input("Enter DMD group's path (../dmd/g#): ")
-        #e.g /home/pncanas/Desktop/consumption/dmd/gA
-        selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
-
-        subject_paths = glob.glob(folder_path + '/*')
+from parallel_export import exportAnnotations, getWorkers
+from video_index import indexVideos
+from plan_export import planAnnotations
+from export_stats import writeRunReport, getReportPath
+
+# Function to list the OpenLABEL files of the selected session (or all sessions if "0") inside DMD groups @group_paths
+def getAnnotationPaths(group_paths, selec_session):
+    annotation_paths = []
+    for group in group_paths:
+        print(group)
+        subject_paths = glob.glob(group + '/*')
         subject_paths.sort()
 
         for subject in subject_paths:
@@ -34,29 +29,118 @@ if opt == 0:
             for session in session_path:
                 if "s"+str(selec_session) in session or selec_session == "0":
                     print(session)
-                    annotation_paths = glob.glob(session + '/*.json')
-                    annotation_paths.sort()
+                    session_annotations = glob.glob(session + '/*.json')
+                    session_annotations.sort()
+                    annotation_paths += session_annotations
+    return annotation_paths
+
+
+# Guard needed by the export worker processes, which import this module
+if __name__ == "__main__":
+    print("Welcome :)")
+    opt = int(input("What do you whish to do?:  export material for training:[0]  group exported material by classes:[1]  create train and test split:[2]  get statistics:[3]  index videos:[4]  plan export:[5] : "))
+
+    if opt == 0:
+        # export material for training
+        print("To change export settings go to config_DEx.json and change control variables.")
+        destination_path = input("Enter destination path: ")
+        selec = input("How do you want to read annotations, by: Group:[g]  Sessions:[f]  One OpenLABEL:[v] : ")
+
+        if selec == "g":
+            #By group
+            folder_path = input("Enter DMD group's path (../dmd/g#): ")
+            #e.g /home/pncanas/Desktop/consumption/dmd/gA
+            selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
+
+            annotation_paths = getAnnotationPaths([folder_path], selec_session)
+            exportAnnotations(annotation_paths, destination_path, getWorkers())
+
+            print("Oki :) ----------------------------------------")
+
+        elif selec == "f":
+            #By session
+            folder_path = input("Enter root dmd folder path(../dmd): ")
+            #e.g /home/pncanas/Desktop/dmd/
+            selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
+
+            group_paths = glob.glob(folder_path + '/*')
+            group_paths.sort()
+            annotation_paths = getAnnotationPaths(group_paths, selec_session)
+            exportAnnotations(annotation_paths, destination_path, getWorkers())
+
+            print("Oki :) ----------------------------------------")
+
+        elif selec == "v":
+
+            vcd_path = input("Paste the OpenLABEL file path (..._ann.json): ")
+            # e.g: /Desktop/consumption/dmd/gA/1/s2/gA_1_s2_2019-03-08T09;21;03+01;00_rgb_ann.json
+            regex_internal = '(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_(?P<session>[a-z]{1,})_'\
+                    '(?P<date>(?P<month>0[1-9]|1[012])-(?P<day>0[1-9]|[12][0-9]|3[01]))'
+            regex_external = '(?P<group>g[A-z]{1,})_(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_'\
+                '(?P<session>s[1-9]{1,})_(?P<timestamp>(?P<date>(?P<year>\d{4})-(?P<month>0[1-9]|1[012])-'\
+                    '(?P<day>0[1-9]|[12][0-9]|3[01]))T(?P<time>(?P<hour>\d{1,2});(?P<minute>\d{1,2});'\
+                        '(?P<second>\d{1,2}))\+\d{1,2};\d{1,2})_(?P<channel>rgb|depth|ir)_(?P<stream>ann)'
+            regex_internal = re.compile(regex_internal)
+            regex_external = re.compile(regex_external)
+            match_internal = regex_internal.search(str(vcd_path))
+            match_external = regex_external.search(str(vcd_path))
+
+            if match_internal or match_external:
+                #dmd annotation
+                dmd_folder=Path(vcd_path).parents[3]
+                datasetDMD = True
+            else:
+                #not a dmd annotation
+                dmd_folder=Path(vcd_path).parents[1]
+                datasetDMD = False
+
+            start = time.time()
+            export = exportClass(vcd_path,str(dmd_folder),destination_path, datasetDMD)
+            writeRunReport({vcd_path: export.stats.getReport()}, getReportPath(destination_path), time.time() - start)
+
+            print("Oki :) ----------------------------------------")       
 
-                    for annotation in annotation_paths:
-                        print(annotation)
-                        dmd_folder=Path(annotation).parents[3]
-                        
-                        exportClass(annotation,str(dmd_folder),destination_path)
-
-                        print("Oki :) ----------------------------------------")
+        else:
+            print("__Please, select a valid option__")
 
-    elif selec == "f":
-        #By session
-        folder_path = input("Enter root dmd folder path(../dmd): ")
-        #e.g /home/pncanas/Desktop/dmd/
-        selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
 
-        group_paths = glob.glob(folder_path + '/*')
-        group_paths.sort()
+    elif opt == 1:
+        # group exported material by classes
+        material_path = input("Enter exported DMD material path (inside must be sessions folders(s#) e.g:../dmd_rgb/): ")
+        groupClass(material_path)
 
-        for group in group_paths:
-            print(group)
-            subject_paths = glob.glob(group + '/*')
+        print("Oki :) ----------------------------------------")
+     
+    elif opt == 2:
+        # create train and test split
+        print("This function only works with dmd material structure when exporting with DEx tool.")
+        material_path = input("Enter exported material path (inside must be classes folders e.g.: /safe_driving/*.jpg): ")
+        destination_path = input("Enter destination path (a new folder to store train and test splits): ")
+        test_proportion = input("Enter test proportion for split [0-1] (e.g. 0.20): ")  
+
+        splitClass(material_path,destination_path,test_proportion)
+
+        print("Oki :) ----------------------------------------")
+
+    elif opt == 3:
+        # Get statistics
+        print("This function only works with dmd material structure when exporting with DEx tool.")
+        destination_path = input("Enter filename for a report file (e.g. report.txt): ")
+        selec = input("How do you want to read annotations, by: Group:[g]  Sessions:[f]  One OpenLABEL:[v] : ")
+    
+        #Delete destination_path to avoid redundancies
+        if os.path.exists(destination_path.replace(".txt","-actions.txt")):
+            os.remove(destination_path.replace(".txt","-actions.txt"))
+        if os.path.exists(destination_path.replace(".txt","-frames.txt")):
+            os.remove(destination_path.replace(".txt","-frames.txt"))
+
+        if selec == "g":
+            #By group
+            folder_path = input("Enter DMD group's path (../dmd/g#): ")
+            #e.g /home/pncanas/Desktop/consumption/dmd/gA
+            selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
+
+            subject_paths = glob.glob(folder_path + '/*')
             subject_paths.sort()
 
             for subject in subject_paths:
@@ -69,163 +153,94 @@ if opt == 0:
                         print(session)
                         annotation_paths = glob.glob(session + '/*.json')
                         annotation_paths.sort()
-
                         for annotation in annotation_paths:
                             print(annotation)
-                            dmd_folder=Path(annotation).parents[3]
-
-                            exportClass(annotation,str(dmd_folder),destination_path)
+                        
+                            get_statistics(annotation,destination_path)
 
                             print("Oki :) ----------------------------------------")
 
-    elif selec == "v":
-
-        vcd_path = input("Paste the OpenLABEL file path (..._ann.json): ")
-        # e.g: /Desktop/consumption/dmd/gA/1/s2/gA_1_s2_2019-03-08T09;21;03+01;00_rgb_ann.json
-        regex_internal = '(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_(?P<session>[a-z]{1,})_'\
-                '(?P<date>(?P<month>0[1-9]|1[012])-(?P<day>0[1-9]|[12][0-9]|3[01]))'
-        regex_external = '(?P<group>g[A-z]{1,})_(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_'\
-            '(?P<session>s[1-9]{1,})_(?P<timestamp>(?P<date>(?P<year>\d{4})-(?P<month>0[1-9]|1[012])-'\
-                '(?P<day>0[1-9]|[12][0-9]|3[01]))T(?P<time>(?P<hour>\d{1,2});(?P<minute>\d{1,2});'\
-                    '(?P<second>\d{1,2}))\+\d{1,2};\d{1,2})_(?P<channel>rgb|depth|ir)_(?P<stream>ann)'
-        regex_internal = re.compile(regex_internal)
-        regex_external = re.compile(regex_external)
-        match_internal = regex_internal.search(str(vcd_path))
-        match_external = regex_external.search(str(vcd_path))
-
-        if match_internal or match_external:
-            #dmd annotation
-            dmd_folder=Path(vcd_path).parents[3]
-            datasetDMD = True
-        else:
-            #not a dmd annotation
-            dmd_folder=Path(vcd_path).parents[1]
-            datasetDMD = False
+        elif selec == "f":
+            #By session
+            folder_path = input("Enter root dmd folder path(../dmd): ")
+            #e.g /home/pncanas/Desktop/dmd/
+            selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
 
-        exportClass(vcd_path,str(dmd_folder),destination_path, datasetDMD)
+            group_paths = glob.glob(folder_path + '/*')
+            group_paths.sort()
 
-        print("Oki :) ----------------------------------------")       
+            for group in group_paths:
+                print(group)
+                subject_paths = glob.glob(group + '/*')
+                subject_paths.sort()
 
-    else:
-        print("__Please, select a valid option__")
+                for subject in subject_paths:
+                    print(subject)
+                    session_path = glob.glob(subject + '/*')
+                    session_path.sort()
 
+                    for session in session_path:
+                        if "s"+str(selec_session) in session or selec_session == "0":
+                            print(session)
+                            annotation_paths = glob.glob(session + '/*.json')
+                            annotation_paths.sort()
 
-elif opt == 1:
-    # group exported material by classes
-    material_path = input("Enter exported DMD material path (inside must be sessions folders(s#) e.g:../dmd_rgb/): ")
-    groupClass(material_path)
-
-    print("Oki :) ----------------------------------------")
-     
-elif opt == 2:
-    # create train and test split
-    print("This function only works with dmd material structure when exporting with DEx tool.")
-    material_path = input("Enter exported material path (inside must be classes folders e.g.: /safe_driving/*.jpg): ")
-    destination_path = input("Enter destination path (a new folder to store train and test splits): ")
-    test_proportion = input("Enter test proportion for split [0-1] (e.g. 0.20): ")  
-
-    splitClass(material_path,destination_path,test_proportion)
-
-    print("Oki :) ----------------------------------------")
-
-elif opt == 3:
-    # Get statistics
-    print("This function only works with dmd material structure when exporting with DEx tool.")
-    destination_path = input("Enter filename for a report file (e.g. report.txt): ")
-    selec = input("How do you want to read annotations, by: Group:[g]  Sessions:[f]  One OpenLABEL:[v] : ")
-    
-    #Delete destination_path to avoid redundancies
-    if os.path.exists(destination_path.replace(".txt","-actions.txt")):
-        os.remove(destination_path.replace(".txt","-actions.txt"))
-    if os.path.exists(destination_path.replace(".txt","-frames.txt")):
-        os.remove(destination_path.replace(".txt","-frames.txt"))
-
-    if selec == "g":
-        #By group
-        folder_path = input("Enter DMD group's path (../dmd/g#): ")
-        #e.g /home/pncanas/Desktop/consumption/dmd/gA
-        selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
-
-        subject_paths = glob.glob(folder_path + '/*')
-        subject_paths.sort()
+                            for annotation in annotation_paths:
+                                print(annotation)
+                                dmd_folder=Path(annotation).parents[3]
 
-        for subject in subject_paths:
-            print(subject)
-            session_path = glob.glob(subject + '/*')
-            session_path.sort()
+                                get_statistics(annotation,destination_path)
+                            
+                                print("Oki :) ----------------------------------------")
+
+        elif selec == "v":
+
+            vcd_path = input("Paste the OpenLABEL file path (..._ann.json): ")
+            # e.g: /Desktop/consumption/dmd/gA/1/s2/gA_1_s2_2019-03-08T09;21;03+01;00_rgb_ann.json
+            regex_internal = '(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_(?P<session>[a-z]{1,})_'\
+                    '(?P<date>(?P<month>0[1-9]|1[012])-(?P<day>0[1-9]|[12][0-9]|3[01]))'
+            regex_external = '(?P<group>g[A-z]{1,})_(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_'\
+                '(?P<session>s[1-9]{1,})_(?P<timestamp>(?P<date>(?P<year>\d{4})-(?P<month>0[1-9]|1[012])-'\
+                    '(?P<day>0[1-9]|[12][0-9]|3[01]))T(?P<time>(?P<hour>\d{1,2});(?P<minute>\d{1,2});'\
+                        '(?P<second>\d{1,2}))\+\d{1,2};\d{1,2})_(?P<channel>rgb|depth|ir)_(?P<stream>ann)'
+            regex_internal = re.compile(regex_internal)
+            regex_external = re.compile(regex_external)
+            match_internal = regex_internal.search(str(vcd_path))
+            match_external = regex_external.search(str(vcd_path))
+
+            if match_internal or match_external:
+                #dmd annotation
+                dmd_folder=Path(vcd_path).parents[3]
+            else:
+                #not a dmd annotation
+                dmd_folder=Path(vcd_path).parents[1]
+
+            get_statistics(vcd_path,destination_path)
+
+            print("Oki :) ----------------------------------------")       
 
-            for session in session_path:
-                if "s"+str(selec_session) in session or selec_session == "0":
-                    print(session)
-                    annotation_paths = glob.glob(session + '/*.json')
-                    annotation_paths.sort()
-                    for annotation in annotation_paths:
-                        print(annotation)
-                        
-                        get_statistics(annotation,destination_path)
+        else:
+            print("__Please, select a valid option__")
+    elif opt == 4:
+        # Build keyframe index of videos
+        folder_path = input("Enter the dmd folder (or video) to index: ")
+        indexVideos(folder_path)
 
-                        print("Oki :) ----------------------------------------")
+        print("Oki :) ----------------------------------------")
 
-    elif selec == "f":
-        #By session
+    elif opt == 5:
+        # Plan the export without opening videos
+        print("To change export settings go to config_DEx.json and change control variables.")
         folder_path = input("Enter root dmd folder path(../dmd): ")
-        #e.g /home/pncanas/Desktop/dmd/
-        selec_session = input("Enter the session you wish to export in this group:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
+        selec_session = input("Enter the session you wish to plan:  all:[0]  S1:[1]  S2:[2]  S3[3]  S4[4] S5[5] S6[6] : ")
+        plan_name = input("Enter the name of the plan files (e.g. export_plan, writes export_plan.json and export_plan.csv): ")
 
         group_paths = glob.glob(folder_path + '/*')
         group_paths.sort()
+        annotation_paths = getAnnotationPaths(group_paths, selec_session)
+        planAnnotations(annotation_paths, plan_name)
 
-        for group in group_paths:
-            print(group)
-            subject_paths = glob.glob(group + '/*')
-            subject_paths.sort()
-
-            for subject in subject_paths:
-                print(subject)
-                session_path = glob.glob(subject + '/*')
-                session_path.sort()
-
-                for session in session_path:
-                    if "s"+str(selec_session) in session or selec_session == "0":
-                        print(session)
-                        annotation_paths = glob.glob(session + '/*.json')
-                        annotation_paths.sort()
-
-                        for annotation in annotation_paths:
-                            print(annotation)
-                            dmd_folder=Path(annotation).parents[3]
-
-                            get_statistics(annotation,destination_path)
-                            
-                            print("Oki :) ----------------------------------------")
-
-    elif selec == "v":
-
-        vcd_path = input("Paste the OpenLABEL file path (..._ann.json): ")
-        # e.g: /Desktop/consumption/dmd/gA/1/s2/gA_1_s2_2019-03-08T09;21;03+01;00_rgb_ann.json
-        regex_internal = '(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_(?P<session>[a-z]{1,})_'\
-                '(?P<date>(?P<month>0[1-9]|1[012])-(?P<day>0[1-9]|[12][0-9]|3[01]))'
-        regex_external = '(?P<group>g[A-z]{1,})_(?P<subject>[1-9]|[1-2][0-9]|[3][0-7])_'\
-            '(?P<session>s[1-9]{1,})_(?P<timestamp>(?P<date>(?P<year>\d{4})-(?P<month>0[1-9]|1[012])-'\
-                '(?P<day>0[1-9]|[12][0-9]|3[01]))T(?P<time>(?P<hour>\d{1,2});(?P<minute>\d{1,2});'\
-                    '(?P<second>\d{1,2}))\+\d{1,2};\d{1,2})_(?P<channel>rgb|depth|ir)_(?P<stream>ann)'
-        regex_internal = re.compile(regex_internal)
-        regex_external = re.compile(regex_external)
-        match_internal = regex_internal.search(str(vcd_path))
-        match_external = regex_external.search(str(vcd_path))
-
-        if match_internal or match_external:
-            #dmd annotation
-            dmd_folder=Path(vcd_path).parents[3]
-        else:
-            #not a dmd annotation
-            dmd_folder=Path(vcd_path).parents[1]
-
-        get_statistics(vcd_path,destination_path)
-
-        print("Oki :) ----------------------------------------")       
+        print("Oki :) ----------------------------------------")
 
     else:
-        print("__Please, select a valid option__")
-else:
-    print("__Please, put a valid option.__")
+        print("__Please, put a valid option.__")
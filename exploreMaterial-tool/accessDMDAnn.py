@@ -7,14 +7,30 @@ import numpy as np
 import math
 import time
 import json
+import tempfile
+import copy
+import csv
+import random
+import multiprocessing
 
 # Import local class to parse OpenLABEL content
 from vcd4reader import VcdHandler
 from vcd4reader import VcdDMDHandler
+# Import local classes to write exported clips
+from export_writers import ImageWriter, VideoWriter, WriterPool, MemoryBudget, TensorShard, writeDepthVideoClips
+from export_writers import TarShardWriter, TarImageWriter, TarVideoWriter, ThreadedVideoWriter, videoCodecs
+from export_writers import probeStreamCopy, writeStreamCopyClip, getClipFrames
+from video_readers import DepthReader, FfmpegReader, ThreadedReader, loadCropRoi
+from video_index import loadIndex, buildIndex, SeekPolicy, getKeyframeBefore, ProbeCache, probeVideo, probeCacheName
+from export_manifest import ExportManifest
+from export_stats import ExportStats
 
 import ffmpeg
 # Written by Paola Cañas and David Galvañ with <3
 
+# Name of the label of the clips exported in frameCentric mode, with the frames of all the annotations
+frameCentricLabel = "frames"
+
 # Python and Opencv script to prepare/export material of DMD for training.
 # Reads annotations in OpenLABEL and the 3 stream videos.
 # To change export settings, go to __init__ and change control variables.
@@ -23,13 +39,15 @@ import ffmpeg
 # -----
 class exportClass():
 
-    def __init__(self, vcdFile, rootDmd, destinationPath, datasetDMD=True):
+    # @planOnly: True to only plan the clips (self.exportPlan) from the OpenLABEL, without opening any video nor writing
+    def __init__(self, vcdFile, rootDmd, destinationPath, datasetDMD=True, planOnly=False):
         # ------ GLOBAL VARIABLES ------
         # - Args -
         self.vcdFile = vcdFile
         self.rootDmd = rootDmd+"/"
         self.destinationPath = destinationPath
         self.datasetDMD = datasetDMD
+        self.planOnly = planOnly
 
         if self.datasetDMD:
 
@@ -63,6 +81,36 @@ class exportClass():
             self.actionList.append("objects_in_scene/"+object)
             
         self.frameNum = 0
+        # @self.exportPlan: list of video plans made by planExport()
+        self.exportPlan = []
+        # @self.writerPool: threads writing images during export, None to write them in the decoding thread
+        self.writerPool = None
+        # @self.videoWriters: ThreadedVideoWriter of the video clips still being encoded
+        self.videoWriters = []
+        # @self.memoryBudget: MemoryBudget of the frames in flight between decoding, encoding and writing
+        self.memoryBudget = None
+        # @self.tensorShards: tensor shards of the video being exported, by shard name
+        self.tensorShards = {}
+        # @self.tarWriter: tar shards where images and videos are written if @self.tarShards, None otherwise
+        self.tarWriter = None
+        # @self.manifest: manifest of the exported clips if @self.resume, None otherwise
+        self.manifest = None
+        # @self.viewCount: number of streams side by side in the exported frames
+        self.viewCount = 1
+        # @self.outputListing: names of the files of each destination folder, to check outputs without a stat per file
+        self.outputListing = {}
+        # @self.videoProbes: ProbeCache of the stream videos if @self.probeCache, None otherwise
+        self.videoProbes = None
+        # @self.seekCosts: [grab cost, seek cost] of the SeekPolicy of each stream video path, measured once per video
+        self.seekCosts = {}
+        # @self.streamVideos: path and frame count of the stream video of each (channel, stream), by getStreamVideo()
+        self.streamVideos = {}
+        # @self.videoCrops: CropRoi of each stream video path (None if it is not cropped), by getStreamVideo()
+        self.videoCrops = {}
+        # @self.channelCrops: CropRoi of each channel of the video plan being exported, to know the size of its frames
+        self.channelCrops = {}
+        # @self.stats: timers and counters of each stage of the export, per video and label (export_stats.py)
+        self.stats = ExportStats()
 
 
         # -- CONTROL VARIABLES --
@@ -72,7 +120,9 @@ class exportClass():
         This values are assigned in config_access.json
 
         @material: list of data format you wish to export.
-        Possible values: "image","video"
+        "tensor" writes all the frames of a label and session in one memory-mapped .npy array (N x H x W x C)
+        with an index of mosaic frame numbers and interval ids
+        Possible values: "image","video","tensor"
 
         @streams: list of camera names to export material from.
         Possible values: "face", "body", "hands", "general"
@@ -93,6 +143,15 @@ class exportClass():
         Optional args:
 
         @size: size of the final output (images or videos). Set it as "original" or a tuple with a smaller size than the original (width, height). e.g.(224,224).
+
+        @crop: region of the frames exported of each stream, cropped before resizing to @size (with "original", the output
+        has the size of the region). A dict of {stream: ROI}, where the stream can also be of only one session,
+        "<group>/<subject>/<session>/<stream>" (e.g. "gA/1/s1/face"), which is used before the one of the stream.
+        The ROI is [x, y, width, height] in pixels of the stream video, or "sidecar" to read a ROI for each stream frame
+        from <stream video>.roi.json: {"<stream frame>": [x, y, width, height]}, frames without ROI take the one before them.
+        ROIs of different sizes need a @size. Static ROIs are cropped by ffmpeg in the "ffmpeg" @decodeBackend and in
+        depth videos, which are cropped with the ROI of the first frame of each clip
+        Possible values: Dict of stream: [x, y, width, height] or "sidecar"
         
         @intervalChunk: size of divisions you wish to do to the frame intervals (in case you want videos of x frames each)
         Possible values: Number greater than 1
@@ -103,6 +162,115 @@ class exportClass():
         @asc: When cutting interval chunks, the value should be true to create the intervals going in ascendant order (in a video of 105 frames taking chunks of 50 frames DEx creates 
         [0-49, 50-99, 100-104] intervals). The value should be false to go in descendent order (With the 105 frames video taking chunks of 50 frames the intervals created will be 
         [55-104, 5-54, 0-4]). Possible values: True or False
+
+        @encodeWorkers: number of threads encoding and writing images while the next frames are decoded. 0 to write them in the decoding thread
+        Possible values: Number greater or equal to 0
+
+        @encodeQueue: maximum number of images waiting to be written. When it is full, decoding waits for the encoding threads
+        Possible values: Number greater than 0
+
+        @videoCodec: codec of the exported videos. "xvid" is the smallest; "mjpg" (intra-only), "ffv1" and "hfyu" (lossless
+        and intra-only) are bigger but any frame can be read without decoding the previous ones, for fast random access when training.
+        Videos have the frame rate of the stream video and, with @encodeWorkers greater than 0, each one is encoded in its own
+        thread while the next frames are decoded, with up to @encodeQueue frames waiting
+        Possible values: "xvid", "mjpg", "ffv1", "hfyu"
+
+        @streamCopy: Flag to cut the rgb and ir videos without decoding them when @size is "original": whole GOPs are copied
+        as they are and only the partial GOPs at the edges of each clip are re-encoded (smart cut), so clips keep their exact frames.
+        Clips are written as .mp4 with the codec of the stream video (h264 or mpeg4; other codecs are decoded and encoded with
+        @videoCodec). Not used with @multiView, @pairedChannels nor @crop
+        Possible values: True, False
+
+        @maxInflightMb: memory budget in MB of the decoded frames waiting to be encoded and written (and, with @pairedChannels,
+        waiting in the queues of the decoding threads). When it is full, decoding waits until frames are written. It is the budget
+        of the whole run: the processes of @workers and @videoWorkers get an equal share. 0 for no budget
+        Possible values: Number greater or equal to 0
+
+        @decodeBackend: how rgb and ir videos are decoded. "opencv" uses cv2.VideoCapture and resizes with OpenCV.
+        "ffmpeg" decodes through an ffmpeg pipe that scales and converts the frames inside the decoder, so they arrive at @size
+        Possible values: "opencv", "ffmpeg"
+
+        @decodeThreads: number of decoding and scaling threads of the "ffmpeg" backend. 0 to let ffmpeg choose
+        Possible values: Number greater or equal to 0
+
+        @tarShards: Flag to write images and videos in tar shards (WebDataset layout) in destinationPath/shards instead of
+        separate files. Each sample is stored with a .json of its label, stream, channel, mosaic frame range, subject and session
+        Possible values: True, False
+
+        @tarShardSize: maximum size of each tar shard in MB
+        Possible values: Number greater than 0
+
+        @multiView: Flag to export all the @streams together (only DMD). Each clip has the frames of face, body and hands
+        side by side (in the order of @streams) for the same mosaic frame, aligned with the frame shifts of the OpenLABEL.
+        Intervals are only exported if they exist in all the streams. Each stream video is decoded once for all of them.
+        Depth videos are not exported in this mode, only depth images and tensors
+        Possible values: True, False
+
+        @pairedChannels: Flag to export all the @channels of a stream together. The rgb, ir and depth videos are decoded
+        at the same time in separate threads and only the frames that exist in all of them are exported, so the
+        clips of every channel have the same frames (the last frame is dropped when the depth video misses it)
+        Possible values: True, False
+
+        @frameStride: export one of every @frameStride frames of each interval, for images and tensors. 1 to export all of them
+        Possible values: Number greater than 0
+
+        @framesPerInterval: number of frames exported from each interval (after @frameStride), for images and tensors. 0 for all
+        Possible values: Number greater or equal to 0
+
+        @maxFramesPerLabel: maximum number of frames exported of each label in each stream video, for images and tensors,
+        taken from all its intervals (after @frameStride and @framesPerInterval). 0 for no maximum
+        Possible values: Number greater or equal to 0
+
+        @frameSampling: how @framesPerInterval and @maxFramesPerLabel choose the frames: "uniform" takes them evenly spaced,
+        "random" takes them at random with @samplingSeed (the same frames in every channel). Frames that are not exported
+        are skipped with grab() (or dropped by ffmpeg), so they are not converted, resized nor encoded
+        Possible values: "uniform", "random"
+
+        @samplingSeed: seed of the "random" @frameSampling
+        Possible values: Any integer
+
+        @labelQuotas: maximum number of frames (or clips, with @quotaUnit) exported of each label in each stream video, as
+        a dict of {annotation: quota}, e.g. {"driver_actions/safe_drive": 2000}. Labels that are not in the dict have no quota.
+        Quotas choose whole intervals (or chunks of @intervalChunk) from the OpenLABEL when the export is planned, before
+        opening any video, with @frameSampling and @samplingSeed. The same intervals are exported in every stream and channel.
+        With a frame quota, the last chosen interval is shortened to fill the quota exactly (chunks are not shortened
+        with @ignoreSmall)
+        Possible values: Dict of annotation: Number greater than 0
+
+        @quotaUnit: what @labelQuotas and @balancing count: frames of the intervals (before @frameStride and @framesPerInterval)
+        or clips (intervals or chunks)
+        Possible values: "frames", "clips"
+
+        @balancing: quota given to every label from the sizes of all the labels of the session (after @labelQuotas):
+        "smallest" limits every label to the size of the smallest label with intervals and "median", to the median size.
+        "none" to only use @labelQuotas
+        Possible values: "none", "smallest", "median"
+
+        @frameCentric: Flag to export every frame of the @annotations only once, instead of once per annotation. Intervals of
+        all the annotations are joined and exported in a "frames" folder (and cut in @intervalChunk chunks), and the labels of
+        every level and how they were annotated, for each exported mosaic frame, are written in a label table per session in
+        destinationPath/labels/<group>_<subject>_<session>_<date>.csv
+        Possible values: True, False
+
+        @videoWorkers: number of processes exporting the rgb and ir clips of the same video. The intervals of a video are split
+        in contiguous frame ranges, at keyframes if the video is indexed, and each process decodes one range with its own capture.
+        The output is the same as with 1. Not used with tar shards nor inside the worker processes of @workers
+        Possible values: Number greater than 0
+
+        @resume: Flag to keep a manifest of the exported clips in destinationPath/manifest and skip the clips that are already
+        completely exported with the same intervals and settings. Outputs of clips of the requested labels, streams,
+        channels and materials that changed or were removed are deleted; clips of other labels, streams, channels and
+        materials are kept as they are
+        Possible values: True, False
+
+        @probeCache: Flag to keep the frame count, fps, resolution and codec of the stream videos, and the frame count
+        checked against the OpenLABEL, in a probe cache, so later exports check the videos without opening them again.
+        Entries are probed again when the size or modification time of the video changes
+        Possible values: True, False
+
+        @probeCachePath: Path of the probe cache file. If empty, it is destinationPath/dex_probe_cache.json. Exports to
+        different destination folders can share the cache with the same path
+        Possible values: "", "<path of a JSON file>"
         """
         # ----LOAD CONFIG FROM JSON----
         # Config dictionary path
@@ -126,7 +294,7 @@ class exportClass():
             if not isinstance(self.annotations,list):
                 self.annotations = [self.annotations]
                 
-        self.write = config_dict["write"]
+        self.write = config_dict["write"] and not self.planOnly
         if "size" in config_dict:
             self.size = config_dict["size"] #[224,224] #"original" # or (width, height) e.g.[224,224]
         else:
@@ -143,6 +311,125 @@ class exportClass():
             self.asc = config_dict["asc"]
         else:
             self.asc = True
+        if "encodeWorkers" in config_dict:
+            self.encodeWorkers = config_dict["encodeWorkers"]
+        else:
+            self.encodeWorkers = 4
+        if "encodeQueue" in config_dict:
+            self.encodeQueue = config_dict["encodeQueue"]
+        else:
+            self.encodeQueue = 64
+        if "decodeBackend" in config_dict:
+            self.decodeBackend = config_dict["decodeBackend"]
+        else:
+            self.decodeBackend = "opencv"
+        if "decodeThreads" in config_dict:
+            self.decodeThreads = config_dict["decodeThreads"]
+        else:
+            self.decodeThreads = 0
+        if "tarShards" in config_dict:
+            self.tarShards = config_dict["tarShards"]
+        else:
+            self.tarShards = False
+        if "tarShardSize" in config_dict:
+            self.tarShardSize = config_dict["tarShardSize"]
+        else:
+            self.tarShardSize = 1000
+        if "resume" in config_dict:
+            self.resume = config_dict["resume"]
+        else:
+            self.resume = False
+        if "probeCache" in config_dict:
+            self.probeCache = config_dict["probeCache"]
+        else:
+            self.probeCache = False
+        if "probeCachePath" in config_dict:
+            self.probeCachePath = config_dict["probeCachePath"]
+        else:
+            self.probeCachePath = ""
+        if "multiView" in config_dict:
+            self.multiView = config_dict["multiView"]
+        else:
+            self.multiView = False
+        if "videoWorkers" in config_dict:
+            self.videoWorkers = config_dict["videoWorkers"]
+        else:
+            self.videoWorkers = 1
+        if "maxInflightMb" in config_dict:
+            self.maxInflightMb = config_dict["maxInflightMb"]
+        else:
+            self.maxInflightMb = 0
+        if "frameCentric" in config_dict:
+            self.frameCentric = config_dict["frameCentric"]
+        else:
+            self.frameCentric = False
+        if "frameStride" in config_dict:
+            self.frameStride = config_dict["frameStride"]
+        else:
+            self.frameStride = 1
+        if "framesPerInterval" in config_dict:
+            self.framesPerInterval = config_dict["framesPerInterval"]
+        else:
+            self.framesPerInterval = 0
+        if "maxFramesPerLabel" in config_dict:
+            self.maxFramesPerLabel = config_dict["maxFramesPerLabel"]
+        else:
+            self.maxFramesPerLabel = 0
+        if "frameSampling" in config_dict:
+            self.frameSampling = config_dict["frameSampling"]
+        else:
+            self.frameSampling = "uniform"
+        if "samplingSeed" in config_dict:
+            self.samplingSeed = config_dict["samplingSeed"]
+        else:
+            self.samplingSeed = 0
+        if "labelQuotas" in config_dict:
+            self.labelQuotas = config_dict["labelQuotas"]
+        else:
+            self.labelQuotas = {}
+        if "quotaUnit" in config_dict:
+            self.quotaUnit = config_dict["quotaUnit"]
+        else:
+            self.quotaUnit = "frames"
+        if "balancing" in config_dict:
+            self.balancing = config_dict["balancing"]
+        else:
+            self.balancing = "none"
+        if self.quotaUnit not in ["frames", "clips"]:
+            raise RuntimeError("WARNING: quotaUnit option must be 'frames' or 'clips'")
+        if self.balancing not in ["none", "smallest", "median"]:
+            raise RuntimeError("WARNING: balancing option must be 'none', 'smallest' or 'median'")
+        if any(quota <= 0 for quota in self.labelQuotas.values()):
+            raise RuntimeError("WARNING: labelQuotas must be greater than 0")
+        if self.frameSampling not in ["uniform", "random"]:
+            raise RuntimeError("WARNING: frameSampling option must be 'uniform' or 'random'")
+        if self.frameStride < 1:
+            raise RuntimeError("WARNING: frameStride option must be greater than 0")
+        if "videoCodec" in config_dict:
+            self.videoCodec = config_dict["videoCodec"]
+        else:
+            self.videoCodec = "xvid"
+        if self.videoCodec not in videoCodecs:
+            raise RuntimeError("WARNING: videoCodec must be one of " + ", ".join(videoCodecs))
+        if "crop" in config_dict:
+            self.crop = config_dict["crop"]
+        else:
+            self.crop = {}
+        for roi in self.crop.values():
+            if roi != "sidecar" and (not isinstance(roi, list) or len(roi) != 4):
+                raise RuntimeError("WARNING: crop ROIs must be [x, y, width, height] or 'sidecar'")
+        if "streamCopy" in config_dict:
+            self.streamCopy = config_dict["streamCopy"]
+        else:
+            self.streamCopy = False
+        if "workers" in config_dict:
+            self.workers = int(config_dict["workers"])
+        else:
+            self.workers = 1
+        if "pairedChannels" in config_dict:
+            self.pairedChannels = config_dict["pairedChannels"]
+        else:
+            self.pairedChannels = False
 
         #validations
         if not self.datasetDMD and (self.streams[0] != "general" or len(self.streams)> 1):
@@ -151,51 +438,473 @@ class exportClass():
         if not self.datasetDMD and len(self.channels)> 1:
             raise RuntimeError(
                 "WARNING: channles option for other datasets must be only 'rgb'")
+        if self.decodeBackend not in ["opencv", "ffmpeg"]:
+            raise RuntimeError(
+                "WARNING: decodeBackend option must be 'opencv' or 'ffmpeg'")
+        if self.multiView and (not self.datasetDMD or len(self.streams) < 2):
+            raise RuntimeError(
+                "WARNING: multiView option is only for DMD and needs more than one stream")
+        if self.multiView and self.pairedChannels:
+            raise RuntimeError(
+                "WARNING: multiView and pairedChannels options cannot be used together")
+        if self.multiView and "depth" in self.channels and any(self.isVideoMaterial(mat) for mat in self.material):
+            print("WARNING: depth videos are not exported in multiView mode, only depth images and tensors")
+        if self.probeCache:
+            if self.probeCachePath:
+                self.videoProbes = ProbeCache(self.probeCachePath)
+            else:
+                self.videoProbes = ProbeCache(Path(self.destinationPath) / probeCacheName)
         #exec
         self.exportMaterial()
 
     def exportMaterial(self):
+        # Plan every interval first, grouped by the stream video it is read from, so each video is opened
+        # and decoded only once no matter how many annotations and materials are requested
+        self.exportPlan = self.planExport()
+        if self.videoProbes is not None:
+            self.videoProbes.save()
+        if self.write:
+            if self.frameCentric:
+                self.writeLabelTable()
+            exportPlan = self.exportPlan
+            if self.resume:
+                self.manifest = ExportManifest(self.destinationPath + "/manifest/" + self.getExportPrefix() + ".json",
+                                               self.vcdFile, self.getExportSettings())
+                exportPlan = self.getPendingPlan(self.exportPlan)
+            tarClips = [clip for videoPlan in exportPlan for clip in videoPlan["clips"] if self.isTarClip(clip)]
+            if len(tarClips) > 0:
+                # Shards of this OpenLABEL: <group>_<subject>_<session>_<date>-000000.tar ...
+                self.tarWriter = TarShardWriter(self.destinationPath + "/shards", self.getExportPrefix(), self.tarShardSize * 1024 * 1024)
+            self.memoryBudget = MemoryBudget(self.getMemoryBudgetBytes(), self.stats)
+            if self.encodeWorkers > 0:
+                self.writerPool = WriterPool(self.encodeWorkers, self.encodeQueue, self.memoryBudget)
+            try:
+                for videoPlan in exportPlan:
+                    self.stats.startVideo(self.getStatsVideoName(videoPlan))
+                    with self.stats.timer("time"):
+                        self.exportVideoPlan(videoPlan)
+                    if self.manifest is not None:
+                        # Clips are complete when their images and videos left the queues. Tar clips, when the shards are closed
+                        self.waitVideoWriters()
+                        if self.writerPool is not None:
+                            self.writerPool.wait()
+                        self.manifest.markDone([clip for clip in videoPlan["clips"] if not self.isTarClip(clip)])
+                        self.manifest.save()
+            finally:
+                # Wait for the videos and images still in the queues
+                self.waitVideoWriters()
+                if self.writerPool is not None:
+                    self.writerPool.close()
+                    self.writerPool = None
+                if self.tarWriter is not None:
+                    self.tarWriter.close()
+                    self.tarWriter = None
+            if self.manifest is not None and len(tarClips) > 0:
+                self.manifest.markDone(tarClips)
+                self.manifest.save()
+            # Seek costs measured while exporting
+            if self.videoProbes is not None:
+                self.videoProbes.save()
+
+    # Function to get the bytes of the memory budget of this export: its share of @self.maxInflightMb when
+    # it runs in one of the @self.workers processes of parallel_export.py
+    def getMemoryBudgetBytes(self):
+        budgetBytes = int(self.maxInflightMb * 1024 * 1024)
+        if multiprocessing.current_process().daemon:
+            budgetBytes = budgetBytes // max(1, self.workers)
+        return budgetBytes
+
+    # Function to get the prefix of the files of this OpenLABEL that are not inside the label folders:
+    # <group>_<subject>_<session>_<date>
+    def getExportPrefix(self):
+        return "_".join(self.info[:3]) + "_" + self.dateDayHour.replace(":",";")
+
+    # Function to get the settings that change the exported clips, saved in the manifest
+    def getExportSettings(self):
+        return {"size": self.size, "intervalChunk": self.intervalChunk, "ignoreSmall": self.ignoreSmall,
+                "asc": self.asc, "decodeBackend": self.decodeBackend, "tarShards": self.tarShards,
+                "videoCodec": self.videoCodec, "streamCopy": self.streamCopy, "crop": self.crop}
+
+    # Function to know if @clip is written in the tar shards
+    def isTarClip(self, clip):
+        return self.tarShards and not self.isTensorMaterial(clip["material"])
+
+    # Function to get the video plans of @exportPlan with only the clips that are not exported yet, according to
+    # @self.manifest. Outputs of clips that changed or are not in the plan anymore are removed.
+    # Tensor and tar shards are written as a whole, so if one of their clips is pending all of them are exported again
+    def getPendingPlan(self, exportPlan):
+        if self.manifest.previousHash is not None and self.manifest.previousHash != self.manifest.hash:
+            print("OpenLABEL changed since the last export, only the clips that changed will be exported")
+        clips = [clip for videoPlan in exportPlan for clip in videoPlan["clips"]]
+        staleRecords = self.manifest.getStaleRecords(clips)
+        for record in staleRecords:
+            for path in self.getClipOutputs(record["material"], record["name"], record["channel"],
+                                            record["mosaicStart"], record["frames"], record["shard"], record.get("selected")):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.manifest.forget(staleRecords)
+
+        pending = set()
+        for clip in clips:
+            outputs = self.getClipOutputs(clip["material"], clip["name"], clip["channel"], clip["mosaicStart"],
+                                          clip["end"] - clip["start"] + 1, clip.get("shard"), self.getSelectedMosaicFrames(clip))
+            if not self.manifest.isDone(clip) or not all(self.outputExists(path) for path in outputs):
+                pending.add(self.manifest.getClipKey(clip))
+        pendingShards = set(clip["shard"] for clip in clips
+                            if self.isTensorMaterial(clip["material"]) and self.manifest.getClipKey(clip) in pending)
+        redoTar = any(self.isTarClip(clip) and self.manifest.getClipKey(clip) in pending for clip in clips) or \
+            any(self.tarShards and not self.isTensorMaterial(record["material"]) for record in staleRecords)
+        if redoTar:
+            # The tar shards of the OpenLABEL are written again with the clips of this plan only
+            otherTar = [record for record in self.manifest.getOtherRecords(clips) if not self.isTensorMaterial(record["material"])]
+            if len(otherTar) > 0:
+                print("WARNING: the tar shards are written again, %d clips of labels, streams or channels that are not "
+                      "requested now are no longer in them" % len(otherTar))
+                self.manifest.forget(otherTar)
+        pendingPlan = []
+        for videoPlan in exportPlan:
+            pendingClips = [clip for clip in videoPlan["clips"] if self.manifest.getClipKey(clip) in pending or
+                            (self.isTensorMaterial(clip["material"]) and clip["shard"] in pendingShards) or
+                            (self.isTarClip(clip) and redoTar)]
+            pendingPlan.append(dict(videoPlan, clips=pendingClips))
+        skipped = len(clips) - sum(len(videoPlan["clips"]) for videoPlan in pendingPlan)
+        if skipped > 0:
+            print("Skipping %d clips already exported" % skipped)
+        return pendingPlan
+
+    # Function to get the paths of the outputs of a clip. Clips in tar shards have no files of their own,
+    # so their output is the first shard of this OpenLABEL
+    # @selected: mosaic frames of the images of the clip when only some of its @frames are exported, None for all of them
+    def getClipOutputs(self, material, name, channel, mosaicStart, frames, shard=None, selected=None):
+        if self.isTensorMaterial(material):
+            return [shard + ".npy", shard + "_index.npy"]
+        if self.tarShards:
+            return [self.destinationPath + "/shards/" + self.getExportPrefix() + "-000000.tar"]
+        if self.isImageMaterial(material):
+            extension = ".tif" if channel == "depth" else ".jpg"
+            if selected is None:
+                selected = range(mosaicStart, mosaicStart + frames)
+            return [name + "_" + str(frame) + extension for frame in selected]
+        return [name + self.getVideoExtension(channel)]
+
+    # Function to know if the video clips of @channel are cut with stream copy (writeStreamCopyClip) instead of decoded
+    def isStreamCopy(self, channel):
+        return (self.streamCopy and self.size == "original" and channel != "depth" and not self.multiView
+                and not self.pairedChannels and len(self.crop) == 0)
+
+    # Function to get the extension of the video clips of @channel
+    def getVideoExtension(self, channel):
+        return ".mp4" if self.isStreamCopy(channel) else ".avi"
+
+    # Function to know if the file @path exists, listing its folder only once
+    def outputExists(self, path):
+        folder, fileName = os.path.split(path)
+        if folder not in self.outputListing:
+            self.outputListing[folder] = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+        return fileName in self.outputListing[folder]
+
+    # Function to check if @annotation exists in OpenLABEL
+    def isValidAnnotation(self, annotation):
+        if isinstance(annotation, str):
+            # if annotation is string, check with self.vcd_handler if it is in OpenLABEL
+            return self.vcd_handler.is_action_type_get_uid(annotation)[0] or self.vcd_handler.is_object_type_get_uid(annotation)[0]
+        elif isinstance(annotation, int):
+            # if annotation is int, is an id and has to be less then self.actionList length
+            return annotation < len(self.actionList)
+        else:
+            raise RuntimeError(
+                "WARNING: Annotation argument must be string or int")
+
+    # Function to know if @material is one of the names used for images
+    def isImageMaterial(self, material):
+        return material == "image" or material == "images" or material == "img" or material == "imgs"
+
+    # Function to know if @material is one of the names used for tensor shards
+    def isTensorMaterial(self, material):
+        return material == "tensor" or material == "tensors" or material == "npy"
+
+    # Function to know if @material is exported as videos
+    def isVideoMaterial(self, material):
+        return not self.isImageMaterial(material) and not self.isTensorMaterial(material)
+
+    # Function to collect all the intervals to export, without reading any video frame.
+    # Returns a list of video plans, one per channel and stream video:
+    # {"channel", "stream", "path", "frameNum", "clips"}
+    # @clips: list of dicts, one per interval and material to export from that video:
+    # {"annotation", "channel", "stream", "material", "id", "start", "end", "mosaicStart", "name"}
+    # Tensor clips also have "shard": name of the shard of their label, session and stream
+    def planExport(self):
+        annotations = []
         for annotation in self.annotations:
+            if self.isValidAnnotation(annotation):
+                annotations.append(annotation)
+            else:
+                print("WARNING: annotation %s is not in this OpenLABEL." % str(annotation))
+        if self.frameCentric:
+            # The frames of all the annotations are planned together as the "frames" label
+            self.frameCentricAnnotations = annotations
+            annotations = [frameCentricLabel]
+
+        exportPlan = []
+        if self.pairedChannels:
+            for stream in self.streams:
+                exportPlan.append(self.planPairedChannels(stream, annotations))
+            return self.sampleFrames(self.applyQuotas(exportPlan))
+        for channel in self.channels:
+            if self.multiView:
+                exportPlan.append(self.planMultiView(channel, annotations))
+                continue
+            for stream in self.streams:
+                print("\n\n-- Getting data of %s channel --" % (channel))
+                # Check and load valid video
+                streamVideoPath = str(self.getStreamVideo(channel, stream))
+                videoPlan = {"channel": channel, "stream": stream, "path": streamVideoPath,
+                             "frameNum": self.frameNum, "clips": []}
+                for annotation in annotations:
+                    videoPlan["clips"] += self.planClips(channel, stream, annotation)
+                exportPlan.append(videoPlan)
+        return self.sampleFrames(self.applyQuotas(exportPlan))
+
+    # Function to choose the intervals of each label of @exportPlan that are exported with @self.labelQuotas and
+    # @self.balancing. Intervals are chosen by their id, from all the streams and channels, so every stream video
+    # exports the same ones. Clips of intervals that are not chosen are removed. Returns @exportPlan
+    def applyQuotas(self, exportPlan):
+        if len(self.labelQuotas) == 0 and self.balancing == "none":
+            return exportPlan
+        # Mosaic frames of each interval of each label: {annotation: {interval id: frames}}
+        labelIntervals = {}
+        for videoPlan in exportPlan:
+            for clip in videoPlan["clips"]:
+                intervals = labelIntervals.setdefault(clip["annotation"], {})
+                intervals[clip["id"]] = max(intervals.get(clip["id"], 0), clip["end"] - clip["start"] + 1)
+        sizes = {annotation: self.getQuotaSize(intervals) for annotation, intervals in labelIntervals.items()}
+        quotas = {annotation: min(size, self.labelQuotas.get(annotation, size)) for annotation, size in sizes.items()}
+        if self.balancing != "none" and len(quotas) > 0:
+            if self.balancing == "smallest":
+                balance = min(quotas.values())
+            else:
+                balance = sorted(quotas.values())[len(quotas) // 2]
+            quotas = {annotation: min(quota, balance) for annotation, quota in quotas.items()}
+
+        chosen = {}
+        for annotation, intervals in labelIntervals.items():
+            chosen[annotation] = self.chooseIntervals(intervals, quotas[annotation], annotation)
+            print("Quota of %s: %d of %d %s" % (annotation, self.getQuotaSize(chosen[annotation]), sizes[annotation],
+                                                self.quotaUnit))
+        for videoPlan in exportPlan:
+            clips = []
+            for clip in videoPlan["clips"]:
+                frames = chosen[clip["annotation"]].get(clip["id"])
+                if frames is not None:
+                    clip["end"] = min(clip["end"], clip["start"] + frames - 1)
+                    clips.append(clip)
+            videoPlan["clips"] = clips
+        return exportPlan
+
+    # Function to get the frames or clips (@self.quotaUnit) of @intervals, a dict of {interval id: frames}
+    def getQuotaSize(self, intervals):
+        if self.quotaUnit == "clips":
+            return len(intervals)
+        return sum(intervals.values())
+
+    # Function to choose the intervals of @annotation that fill @quota, with @self.frameSampling
+    # @intervals: dict of {interval id: frames} of the intervals of @annotation
+    # Returns a dict of {interval id: frames exported} of the chosen intervals
+    def chooseIntervals(self, intervals, quota, annotation):
+        if self.getQuotaSize(intervals) <= quota:
+            return dict(intervals)
+        ids = sorted(intervals)
+        if self.frameSampling == "random":
+            order = list(ids)
+            random.Random("%s/quota/%s" % (self.samplingSeed, annotation)).shuffle(order)
+        else:
+            # Fewest evenly spaced intervals that fill the quota
+            for count in range(1, len(ids) + 1):
+                order = self.chooseFrames(ids, count, annotation)
+                if self.getQuotaSize({intervalId: intervals[intervalId] for intervalId in order}) >= quota:
+                    break
+        chosen = {}
+        for intervalId in order:
+            left = quota - self.getQuotaSize(chosen)
+            if left <= 0:
+                break
+            if self.quotaUnit == "frames" and intervals[intervalId] > left:
+                # With ignoreSmall, chunks are not shortened, smaller ones can still fit
+                if self.intervalChunk > 1 and self.ignoreSmall:
+                    continue
+                chosen[intervalId] = left
+                break
+            chosen[intervalId] = intervals[intervalId]
+        return chosen
+
+    # Function to know if only some frames of the image and tensor clips are exported
+    def isFrameSampling(self):
+        return self.frameStride > 1 or self.framesPerInterval > 0 or self.maxFramesPerLabel > 0
+
+    # Function to choose the frames exported of the image and tensor clips of @exportPlan, with @self.frameStride,
+    # @self.framesPerInterval and @self.maxFramesPerLabel. Each of those clips gets "selected": sorted list of the
+    # stream frames to export; clips without frames are removed. Returns @exportPlan
+    def sampleFrames(self, exportPlan):
+        if not self.isFrameSampling():
+            return exportPlan
+        for videoPlan in exportPlan:
+            labelClips = {}
+            for clip in videoPlan["clips"]:
+                if self.isVideoMaterial(clip["material"]):
+                    continue
+                frames = list(range(clip["start"], clip["end"] + 1, self.frameStride))
+                # Random choices depend on the label, stream and interval, so every channel gets the same frames
+                clip["selected"] = self.chooseFrames(frames, self.framesPerInterval,
+                                                     "%s/%s/%s" % (clip["annotation"], clip["stream"], clip["id"]))
+                labelClips.setdefault((clip["annotation"], clip["channel"], clip["material"]), []).append(clip)
+            if self.maxFramesPerLabel > 0:
+                for (annotation, channel, material), clips in labelClips.items():
+                    frames = [(clip["id"], frame) for clip in clips for frame in clip["selected"]]
+                    chosen = set(self.chooseFrames(frames, self.maxFramesPerLabel,
+                                                   "%s/%s" % (annotation, videoPlan["stream"])))
+                    for clip in clips:
+                        clip["selected"] = [frame for frame in clip["selected"] if (clip["id"], frame) in chosen]
+            videoPlan["clips"] = [clip for clip in videoPlan["clips"] if len(clip.get("selected", [None])) > 0]
+        return exportPlan
+
+    # Function to choose @count of the sorted @frames with @self.frameSampling, all of them if @count is 0
+    # @key: added to @self.samplingSeed to seed the random choice
+    def chooseFrames(self, frames, count, key):
+        if count <= 0 or count >= len(frames):
+            return frames
+        if self.frameSampling == "random":
+            rng = random.Random("%s/%s" % (self.samplingSeed, key))
+            return sorted(rng.sample(frames, count))
+        # Evenly spaced, centered in @frames
+        return [frames[int((i + 0.5) * len(frames) / count)] for i in range(count)]
+
+    # Function to plan the clips of all the @annotations in all the streams of @channel together, for multiView mode
+    # The video plan has the "paths" and "frameNums" of every stream, in the order of @self.streams
+    def planMultiView(self, channel, annotations):
+        print("\n\n-- Getting data of %s channel --" % (channel))
+        paths = []
+        frameNums = []
+        for stream in self.streams:
+            paths.append(str(self.getStreamVideo(channel, stream)))
+            frameNums.append(self.frameNum)
+        # Intervals are cut with the shortest stream
+        self.frameNum = min(frameNums)
+        stream = "-".join(self.streams)
+        videoPlan = {"channel": channel, "stream": stream, "paths": paths, "frameNums": frameNums,
+                     "frameNum": self.frameNum, "clips": []}
+        for annotation in annotations:
+            videoPlan["clips"] += self.planClips(channel, stream, annotation)
+        return videoPlan
+
+    # Function to plan the clips of all the @annotations in all the channels of @stream together, for pairedChannels mode
+    # Intervals are computed once for all the channels. The video plan has the "channels", "paths" and "frameNums"
+    # of every channel, in the order of @self.channels
+    def planPairedChannels(self, stream, annotations):
+        paths = []
+        frameNums = []
+        for channel in self.channels:
+            print("\n\n-- Getting data of %s channel --" % (channel))
+            paths.append(str(self.getStreamVideo(channel, stream)))
+            frameNums.append(self.frameNum)
+        # Depth videos can miss the last frame: only frames that exist in all the channels are exported
+        self.frameNum = min(frameNums)
+        videoPlan = {"channel": "-".join(self.channels), "channels": list(self.channels), "stream": stream,
+                     "paths": paths, "frameNums": frameNums, "frameNum": self.frameNum, "clips": []}
+        for annotation in annotations:
+            intervals = self.getIntervals(annotation)
             for channel in self.channels:
-                for stream in self.streams:
-                    for mat in self.material:
-                        validAnnotation = False
-                        # Check if annotation exists in OpenLABEL
-                        if isinstance(annotation, str):
-                            # if annotation is string, check with self.vcd_handler if it is in OpenLABEL
-                            if self.vcd_handler.is_action_type_get_uid(annotation)[0] or self.vcd_handler.is_object_type_get_uid(annotation)[0]:
-                                validAnnotation = True
-                        elif isinstance(annotation, int):
-                            # if annotation is int, is an id and has to be less then self.actionList length
-                            if annotation < len(self.actionList):
-                                validAnnotation = True
-                        else:
-                            raise RuntimeError(
-                                "WARNING: Annotation argument must be string or int")
-                        if validAnnotation:
-                            print("\n\n-- Getting data of %s channel --" % (channel))
-                            intervals = self.getIntervals(mat, channel, stream, annotation)
-                        else:
-                            print("WARNING: annotation %s is not in this OpenLABEL." % str(annotation))
+                videoPlan["clips"] += self.planClips(channel, stream, annotation, intervals)
+        for clip in videoPlan["clips"]:
+            clip["end"] = min(clip["end"], self.frameNum - 1)
+        videoPlan["clips"] = [clip for clip in videoPlan["clips"] if clip["end"] >= clip["start"]]
+        return videoPlan
 
-    # Function to get intervals of @annotation from OpenLABEL and if @write, exports the @material of @stream indicated to @self.destinationPath
-    def getIntervals(self, material, channel, stream, annotation):
+    # Function to get intervals of @annotation from OpenLABEL and turn them into clips of every material for @stream
+    # If @write, creates the destination folder of the clips
+    # @fullIntervalsAsList: intervals of @annotation if they were already computed with getIntervals()
+    def planClips(self, channel, stream, annotation, fullIntervalsAsList=None):
         #get name of action if uid is fiven
         if isinstance(annotation, int):
             annotation = self.actionList[annotation]
 
-        print("\n\n-- Creating %s of action: %s --" % (material, str(annotation)))
+        print("\n\n-- Creating %s of action: %s --" % (", ".join(self.material), str(annotation)))
+        if fullIntervalsAsList is None:
+            fullIntervalsAsList = self.getIntervals(annotation)
 
-        # Check and load valid video
-        streamVideoPath = str(self.getStreamVideo(channel, stream))
-        capVideo = cv2.VideoCapture(streamVideoPath)
-        
-        #Validation to check if given new size is smaller than original
-        if(self.size!="original"):
-            if (capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)<self.size[1] or capVideo.get(cv2.CAP_PROP_FRAME_WIDTH)<self.size[0]):
-                raise RuntimeError(
-                    "WARNING: the new size should be smaller than original")    
-        
+        """If annotation string is the action type from OpenLABEL, it will create a folder 
+        for each label inside their level folder because of the "/" in the name.
+        If annotation is a number, then a folder will be created for each label with its uid as name """
+        if self.datasetDMD:
+            # create folder per annotation and per session
+            dirName = Path(self.destinationPath +"/dmd_"+channel+ "/"+self.info[2] + "/" + str(annotation))
+        else:
+            dirName = Path(self.destinationPath+ "/" +str(annotation))
+        # With tar shards, only tensor shards are written in the folders
+        makeDir = not self.tarShards or any(self.isTensorMaterial(mat) for mat in self.material)
+        if self.write and makeDir and not dirName.exists():
+            os.makedirs(str(dirName), exist_ok=True)
+            print("Directory", dirName.name, "created")
+
+        clips = []
+        for count, interval in enumerate(fullIntervalsAsList):
+            # Descendant chunks are stored from last to first frame
+            mosaicStartFrame, mosaicEndFrame = min(interval), max(interval)
+            if annotation == frameCentricLabel:
+                # Joined intervals can cover the whole session: only the frames that exist in the stream are exported
+                for viewStream in (self.streams if self.multiView else [stream]):
+                    firstFrame, lastFrame = self.getStreamMosaicRange(viewStream)
+                    mosaicStartFrame, mosaicEndFrame = max(mosaicStartFrame, firstFrame), min(mosaicEndFrame, lastFrame)
+                if mosaicStartFrame > mosaicEndFrame:
+                    continue
+
+            if self.multiView:
+                # Clips of all the streams keep the mosaic frame numbers, each stream is aligned when it is read
+                valid = all(self.checkFrameInStream(viewStream, mosaicStartFrame, mosaicEndFrame)[0] for viewStream in self.streams)
+                startFrame, endFrame = mosaicStartFrame, mosaicEndFrame
+            else:
+                # Check if frames are avalabile in stream. Find corresponding frames in stream, rigth now is mosaic frame
+                valid, startFrame, endFrame = self.checkFrameInStream(
+                    stream, mosaicStartFrame, mosaicEndFrame)
+
+            if valid:
+                # Name with stream, date, subject and interval id to not overwrite
+                shardName = str(dirName) + "/" + stream + "_" + \
+                    self.dateDayHour.replace(":",";") + "_"+self.info[1]
+                fileName = shardName + "_"+str(count)
+                for mat in self.material:
+                    if self.multiView and channel == "depth" and self.isVideoMaterial(mat):
+                        continue
+                    clip = {"annotation": str(annotation), "channel": channel, "stream": stream, "material": mat, "id": count,
+                            "start": startFrame, "end": endFrame,
+                            "mosaicStart": mosaicStartFrame, "name": fileName}
+                    if self.isTensorMaterial(mat):
+                        clip["shard"] = shardName
+                    clips.append(clip)
+            else:
+                print(
+                    "WARNING: Skipped interval %i, because some of its frames do not exist in stream %s" %(count,stream))
+        return clips
+
+    # Function to get the list of frame intervals of @annotation from OpenLABEL, cut in chunks if @self.intervalChunk
+    def getIntervals(self, annotation):
+        #get name of action if uid is fiven
+        if isinstance(annotation, int):
+            annotation = self.actionList[annotation]
+        if annotation == frameCentricLabel:
+            # Every frame in the intervals of any of the annotations, once
+            fullIntervalsAsList = self.mergeIntervals([interval for frameAnnotation in self.frameCentricAnnotations
+                                                       for interval in self.getAnnotationIntervals(frameAnnotation)])
+        else:
+            fullIntervalsAsList = self.getAnnotationIntervals(annotation)
+        # if intervals must be cutted, cut
+        if self.intervalChunk > 1:
+            fullIntervalsAsList = self.cutIntervals(fullIntervalsAsList)
+        return fullIntervalsAsList
+
+    # Function to get the intervals of @annotation from the OpenLABEL, as a list of [start, end] mosaic frames
+    def getAnnotationIntervals(self, annotation):
+        if isinstance(annotation, int):
+            annotation = self.actionList[annotation]
         # Check if annotation is an object or an action
         if "object" in annotation:
             # get object intervals from OpenLABEL
@@ -204,58 +913,635 @@ class exportClass():
             # get action intervals from OpenLABEL
             fullIntervals = self.vcd_handler.get_frames_intervals_of_action(annotation)
         # make lists from dictionaries
-        fullIntervalsAsList = self.dictToList(fullIntervals)
-        # if intervals must be cutted, cut
-        if self.intervalChunk > 1:
-            fullIntervalsAsList = self.cutIntervals(fullIntervalsAsList)
+        return self.dictToList(fullIntervals)
 
-        if self.write:
-            print("Writing...")
-            """If annotation string is the action type from OpenLABEL, it will create a folder 
-            for each label inside their level folder because of the "/" in the name.
-            If annotation is a number, then a folder will be created for each label with its uid as name """
-
-            if self.datasetDMD:
-                # create folder per annotation and per session
-                dirName = Path(self.destinationPath +"/dmd_"+channel+ "/"+self.info[2] + "/" + str(annotation))
-            else:
-                dirName = Path(self.destinationPath+ "/" +str(annotation))
-            if not dirName.exists():
-                os.makedirs(str(dirName), exist_ok=True)
-                print("Directory", dirName.name, "created")
-            
-            #@depthVideoArray: numpy array with all frames of video containing depth information
-            depthVideoArray = []
-            if channel == "depth" and (material == "image" or material == "images" ):
-                depthVideoArray = self.getDepthVideoArray(streamVideoPath, capVideo)
+    # Function to write the label table of the frames exported in frameCentric mode: one row per mosaic frame of the
+    # clips of @self.exportPlan, with the labels of every level in that frame and how they were annotated.
+    # A level with several labels in the same frame (e.g. objects_in_scene) has them separated by "|"
+    def writeLabelTable(self):
+        frames = sorted(set(clip["mosaicStart"] + frame - clip["start"] for videoPlan in self.exportPlan
+                            for clip in videoPlan["clips"] for frame in getClipFrames(clip)))
+        # Objects are "objects_in_scene/<object>" like in @self.actionList
+        frameLabels = {frame: {} for frame in frames}
+        for frame, labels in self.vcd_handler.get_frames_labels(frames).items():
+            for label, annotated in labels.items():
+                if label in self.objectList:
+                    if "driver" in label:
+                        # The driver object is not a label
+                        continue
+                    label = "objects_in_scene/" + label
+                frameLabels[frame][label] = annotated
+        levels = []
+        for label in self.actionList:
+            level = self.getLabelLevel(label)
+            if level not in levels:
+                levels.append(level)
+        columns = ["frame"] + [column for level in levels for column in [level, level + "_annotated"]]
+        tablePath = Path(self.destinationPath + "/labels/" + self.getExportPrefix() + ".csv")
+        os.makedirs(str(tablePath.parent), exist_ok=True)
+        with open(str(tablePath), "w", newline="") as tableFile:
+            writer = csv.DictWriter(tableFile, fieldnames=columns)
+            writer.writeheader()
+            for frame in frames:
+                row = {"frame": frame}
+                for level in levels:
+                    labels = sorted(label for label in frameLabels[frame] if self.getLabelLevel(label) == level)
+                    row[level] = "|".join(label.split("/")[-1] for label in labels)
+                    row[level + "_annotated"] = "|".join(frameLabels[frame][label] for label in labels)
+                writer.writerow(row)
+        print("Label table of %d frames written in %s" % (len(frames), tablePath))
 
-            for count, interval in enumerate(fullIntervalsAsList):
+    # Function to get the level of @label ("driver_actions/safe_drive" is in "driver_actions")
+    def getLabelLevel(self, label):
+        return label.split("/")[0] if "/" in label else "labels"
 
-                # Check if frames are avalabile in stream. Find corresponding frames in stream, rigth now is mosaic frame
-                valid, startFrame, endFrame = self.checkFrameInStream(
-                    stream, interval[0], interval[1])
-
-                mosaicStartFrame = interval[0]
-
-                if valid:
-                    print('Exporting interval %d \r' % count, end="")
-                    # Name with stream, date, subject and interval id to not overwrite
-                    fileName = str(dirName) + "/" + stream + "_" + \
-                        self.dateDayHour.replace(":",";") + "_"+self.info[1] + "_"+str(count)
-                    if material == "image" or material == "images" or material == "img" or material == "imgs":
-                        if channel == "depth":
-                            self.depthFrameIntervalToImages(startFrame, endFrame, mosaicStartFrame, depthVideoArray, capVideo, fileName)
-                        else:
-                            self.frameIntervalToImages(startFrame, endFrame, mosaicStartFrame, capVideo, fileName)
+    # Function to export all the clips of a video plan made by planExport()
+    # The video is opened once and every clip of every annotation and material is taken from that single pass
+    def exportVideoPlan(self, videoPlan):
+        clips = videoPlan["clips"]
+        if len(clips) == 0:
+            return
+        if self.multiView:
+            self.exportMultiViewPlan(videoPlan)
+            return
+        if self.pairedChannels:
+            self.exportPairedPlan(videoPlan)
+            return
+        channel = videoPlan["channel"]
+        streamVideoPath = videoPlan["path"]
+        self.frameNum = videoPlan["frameNum"]
+        print("\n\n-- Writing %d clips from %s %s stream --" % (len(clips), channel, videoPlan["stream"]))
+
+        with self.stats.timer("open"):
+            capVideo = cv2.VideoCapture(streamVideoPath)
+        self.checkVideoSize(capVideo, streamVideoPath)
+        self.channelCrops = {channel: self.videoCrops.get(streamVideoPath)}
+
+        self.openTensorShards(clips, capVideo, channel)
+        try:
+            if channel == "depth":
+                frameClips = [clip for clip in clips if self.isImageMaterial(clip["material"]) or self.isTensorMaterial(clip["material"])]
+                if len(frameClips) > 0:
+                    self.depthClipsToImages(frameClips, streamVideoPath, capVideo)
+                videoClips = [clip for clip in clips if clip not in frameClips]
+                if len(videoClips) > 0:
+                    print("Cutting %d depth videos" % len(videoClips))
+                    if self.tarWriter is not None:
+                        self.depthClipsToTar(videoClips, streamVideoPath)
                     else:
-                        if channel == "depth":
-                            self.depthFrameIntervalToVideo(startFrame, endFrame, streamVideoPath, fileName)
-                        else:
-                            self.frameIntervalToVideo(startFrame, endFrame, capVideo, fileName)
+                        self.cutDepthVideos(streamVideoPath, videoClips)
+            else:
+                # Seek with the keyframes of the video index if the video was indexed (video_index.py)
+                with self.stats.timer("open"):
+                    videoIndex = loadIndex(streamVideoPath)
+                keyframes = videoIndex["keyframes"] if videoIndex else None
+                if self.isStreamCopy(channel):
+                    copyClips = [clip for clip in clips if self.isVideoMaterial(clip["material"])]
+                    if len(copyClips) > 0 and self.streamCopyClips(copyClips, streamVideoPath, videoIndex):
+                        clips = [clip for clip in clips if clip not in copyClips]
+                # Daemon processes (workers of parallel_export.py) cannot start processes
+                if len(clips) > 0 and self.videoWorkers > 1 and self.tarWriter is None and not multiprocessing.current_process().daemon:
+                    # The workers use the seek costs measured here instead of measuring them in each process
+                    if len(self.getClipRanges(clips)) > 1:
+                        self.getSeekPolicy(capVideo, streamVideoPath, keyframes)
+                    self.decodeClipsParallel(clips, streamVideoPath, channel, keyframes)
+                elif len(clips) > 0 and self.decodeBackend == "ffmpeg":
+                    self.pipeDecodeClips(clips, streamVideoPath, capVideo)
+                elif len(clips) > 0:
+                    self.decodeClips(clips, capVideo, keyframes, self.videoCrops.get(streamVideoPath), streamVideoPath)
+        finally:
+            for shard in self.tensorShards.values():
+                shard.close()
+            self.tensorShards = {}
+            self.channelCrops = {}
+        capVideo.release()
+
+    # Function to export the clips of a multiView video plan made by planMultiView()
+    # All the stream videos are opened together and read in lockstep: the frames of the same mosaic frame are put
+    # side by side and given to the clips, so each stream is decoded once
+    def exportMultiViewPlan(self, videoPlan):
+        clips = videoPlan["clips"]
+        channel = videoPlan["channel"]
+        self.frameNum = videoPlan["frameNum"]
+        print("\n\n-- Writing %d clips from %s %s streams --" % (len(clips), channel, videoPlan["stream"]))
+
+        with self.stats.timer("open"):
+            captures = [cv2.VideoCapture(path) for path in videoPlan["paths"]]
+        streamFrames = []
+        try:
+            sizes = set()
+            for path, capVideo in zip(videoPlan["paths"], captures):
+                self.checkVideoSize(capVideo, path)
+                crop = self.videoCrops.get(path)
+                if crop is not None:
+                    sizes.add(tuple(crop.getSize()))
                 else:
-                    print(
-                        "WARNING: Skipped interval %i, because some of its frames do not exist in stream %s" %(count,stream))
-        return fullIntervalsAsList
+                    sizes.add((capVideo.get(cv2.CAP_PROP_FRAME_WIDTH), capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            if self.size == "original" and len(sizes) > 1:
+                raise RuntimeError(
+                    "WARNING: multiView with size 'original' needs stream videos (or crops) of the same size")
+            self.channelCrops = {channel: self.videoCrops.get(videoPlan["paths"][0])}
+
+            # Stream frame = mosaic frame + offset, with the frame shifts of the OpenLABEL
+            mosaicRanges = self.getClipRanges(clips)
+            offsets = []
+            for stream, path, capVideo in zip(self.streams, videoPlan["paths"], captures):
+                valid, startFrame, endFrame = self.checkFrameInStream(stream, clips[0]["start"], clips[0]["end"])
+                offset = startFrame - clips[0]["start"]
+                offsets.append(offset)
+                streamFrames.append(self.readStreamFrames(channel, path, capVideo,
+                                                          [[start + offset, end + offset] for start, end in mosaicRanges]))
+
+            self.viewCount = len(captures)
+            self.openTensorShards(clips, captures[0], channel)
+            self.dispatchFrames(clips, self.lockstepFrames(streamFrames, offsets), captures[0],
+                                ".tif" if channel == "depth" else ".jpg")
+        finally:
+            for frames in streamFrames:
+                frames.close()
+            for shard in self.tensorShards.values():
+                shard.close()
+            self.tensorShards = {}
+            self.channelCrops = {}
+            self.viewCount = 1
+            for capVideo in captures:
+                capVideo.release()
+
+    # Function to export the clips of a pairedChannels video plan made by planPairedChannels()
+    # The videos of all the channels are decoded at the same time, each in its own thread, and the frames
+    # of the same frame number are given together to the clips of every channel
+    def exportPairedPlan(self, videoPlan):
+        clips = videoPlan["clips"]
+        self.frameNum = videoPlan["frameNum"]
+        print("\n\n-- Writing %d clips from %s channels of %s stream --" % (len(clips), videoPlan["channel"], videoPlan["stream"]))
+
+        captures = {}
+        readers = []
+        try:
+            for channel, path in zip(videoPlan["channels"], videoPlan["paths"]):
+                with self.stats.timer("open"):
+                    captures[channel] = cv2.VideoCapture(path)
+                self.checkVideoSize(captures[channel], path)
+                self.channelCrops[channel] = self.videoCrops.get(path)
+
+            # 16 bit depth videos are cut by ffmpeg, not from the decoded frames
+            depthVideoClips = [clip for clip in clips if clip["channel"] == "depth" and self.isVideoMaterial(clip["material"])]
+            if len(depthVideoClips) > 0:
+                print("Cutting %d depth videos" % len(depthVideoClips))
+                depthPath = videoPlan["paths"][videoPlan["channels"].index("depth")]
+                if self.tarWriter is not None:
+                    self.depthClipsToTar(depthVideoClips, depthPath)
+                else:
+                    self.cutDepthVideos(depthPath, depthVideoClips)
+            frameClips = [clip for clip in clips if clip not in depthVideoClips]
+            if len(frameClips) == 0:
+                return
+
+            ranges = self.getClipRanges(frameClips)
+            for channel, path in zip(videoPlan["channels"], videoPlan["paths"]):
+                readers.append(ThreadedReader(self.readStreamFrames(channel, path, captures[channel], ranges),
+                                              budget=self.memoryBudget))
+                self.openTensorShards([clip for clip in frameClips if clip["channel"] == channel], captures[channel], channel)
+            pairFrames = self.lockstepFrames([reader.frames() for reader in readers], [0] * len(readers),
+                                             lambda images: dict(zip(videoPlan["channels"], images)))
+            self.dispatchFrames(frameClips, pairFrames, None, captures=captures)
+        finally:
+            for reader in readers:
+                reader.close()
+            for shard in self.tensorShards.values():
+                shard.close()
+            self.tensorShards = {}
+            self.channelCrops = {}
+            for capVideo in captures.values():
+                capVideo.release()
+
+    # Function to check that @self.size is smaller than the video @capVideo and its crop ROIs are inside its frames
+    def checkVideoSize(self, capVideo, streamVideoPath):
+        width = int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        #Validation to check if given new size is smaller than original
+        if(self.size!="original"):
+            if (height<self.size[1] or width<self.size[0]):
+                raise RuntimeError(
+                    "WARNING: the new size should be smaller than original")
+        if self.videoCrops.get(streamVideoPath) is not None:
+            self.videoCrops[streamVideoPath].check(width, height)
+
+    # Generator of (frame number, image) of @ranges of the stream video @streamVideoPath, with the reader of @channel
+    def readStreamFrames(self, channel, streamVideoPath, capVideo, ranges):
+        width = int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        crop = self.videoCrops.get(streamVideoPath)
+        if channel == "depth":
+            reader = DepthReader(streamVideoPath, width, height, ranges, self.size, crop=crop)
+        elif self.decodeBackend == "ffmpeg":
+            reader = FfmpegReader(streamVideoPath, width, height, ranges, self.size, threads=self.decodeThreads, crop=crop)
+        else:
+            # Seek with the keyframes of the video index if the video was indexed (video_index.py)
+            with self.stats.timer("open"):
+                videoIndex = loadIndex(streamVideoPath)
+            yield from self.readFrames(capVideo, ranges, videoIndex["keyframes"] if videoIndex else None, crop, streamVideoPath)
+            return
+        try:
+            yield from self.timedFrames(reader.frames())
+        finally:
+            reader.close()
+
+    # Generator of (mosaic frame number, image) with the images of all the @streamFrames side by side
+    # @streamFrames: generators of (stream frame number, image) of each stream
+    # @offsets: stream frame number minus mosaic frame number of each stream
+    # @join: function to join the list of images of a frame, side by side if None
+    # If a frame of a stream could not be read, that mosaic frame is skipped in all the streams
+    def lockstepFrames(self, streamFrames, offsets, join=None):
+        current = [next(frames, None) for frames in streamFrames]
+        while all(item is not None for item in current):
+            mosaicFrames = [item[0] - offset for item, offset in zip(current, offsets)]
+            latest = max(mosaicFrames)
+            if min(mosaicFrames) == latest:
+                images = [item[1] for item in current]
+                yield latest, np.hstack(images) if join is None else join(images)
+                current = [next(frames, None) for frames in streamFrames]
+            else:
+                # Advance the streams that are behind
+                current = [item if mosaicFrame == latest else next(frames, None)
+                           for item, mosaicFrame, frames in zip(current, mosaicFrames, streamFrames)]
+
+    # Function to get the [width, height] of the exported frames of @channel: @self.size, the size of its crop or
+    # the size of @capVideo, times @self.viewCount streams side by side
+    def getOutputSize(self, capVideo, channel=None):
+        if self.size == "original" and self.channelCrops.get(channel) is not None:
+            width, height = self.channelCrops[channel].getSize()
+        elif self.size == "original":
+            width = int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        else:
+            width = self.size[0]
+            height = self.size[1]
+        return [width * self.viewCount, height]
+
+    # Function to create the tensor shards of the tensor @clips of a video, one per label, in @self.tensorShards
+    # Depth shards are uint16 with 1 channel, rgb and ir shards are uint8 BGR images
+    # @mode: "w+" to create the shards, "r+" to open the shards created for the same @clips
+    def openTensorShards(self, clips, capVideo, channel, mode="w+"):
+        width, height = self.getOutputSize(capVideo, channel)
+        shardClips = {}
+        for clip in clips:
+            if self.isTensorMaterial(clip["material"]):
+                shardClips.setdefault(clip["shard"], []).append(clip)
+        for shardName, tensorClips in shardClips.items():
+            if channel == "depth":
+                self.tensorShards[shardName] = TensorShard(shardName, tensorClips, height, width, 1, np.uint16, mode)
+            else:
+                self.tensorShards[shardName] = TensorShard(shardName, tensorClips, height, width, 3, mode=mode)
+
+    # Function to read @capVideo once in frame order and give each frame to all the @clips that contain it
+    # Overlapping and consecutive intervals are merged in ranges, so the video is only sought at the start of each range
+    # @keyframes: keyframes of the video index, None if the video is not indexed
+    # @crop: CropRoi of the video, None to not crop it
+    # @videoPath: path of the stream video of @capVideo, to measure its seek costs only once
+    def decodeClips(self, clips, capVideo, keyframes=None, crop=None, videoPath=None):
+        ranges = self.getClipRanges(clips)
+        self.dispatchFrames(clips, self.readFrames(capVideo, ranges, keyframes, crop, videoPath), capVideo)
+
+    # Generator of (frame number, image) of every frame of @ranges in @capVideo, cropped with @crop and resized to @self.size
+    # Between ranges, the video is sought or decoded forward, whatever is faster for that gap in this video
+    def readFrames(self, capVideo, ranges, keyframes=None, crop=None, videoPath=None):
+        if len(ranges) > 1:
+            seekPolicy = self.getSeekPolicy(capVideo, videoPath, keyframes)
+        else:
+            seekPolicy = SeekPolicy(keyframes)
+        # @position: frame that capVideo will read next, tracked here instead of asking capVideo. None if unknown
+        position = None
+        for rangeStart, rangeEnd in ranges:
+            with self.stats.timer("seek"):
+                position = seekPolicy.seek(capVideo, position, rangeStart)
+            for frame in range(rangeStart, rangeEnd + 1):
+                with self.stats.timer("decode"):
+                    success, image = capVideo.read()
+                if not success:
+                    print("WARNING: could not read frame %d, clips from frame %d to %d are incomplete" % (frame, rangeStart, rangeEnd))
+                    position = None
+                    break
+                self.stats.add("framesDecoded", 1, self.stats.video)
+                position = frame + 1
+                if crop is not None:
+                    with self.stats.timer("resize"):
+                        image = crop.apply(frame, image)
+                        if self.size == "original":
+                            image = np.ascontiguousarray(image)
+                if self.size != "original":
+                    with self.stats.timer("resize"):
+                        image = cv2.resize(image, self.size, interpolation=cv2.INTER_LANCZOS4)
+                yield frame, image
+
+    # Function to get the SeekPolicy of @capVideo, the stream video @videoPath (None if unknown)
+    # Its costs are measured once per video and kept in @self.seekCosts and in the probe cache. The capture is left at
+    # an unknown position if they are measured
+    def getSeekPolicy(self, capVideo, videoPath=None, keyframes=None):
+        seekPolicy = SeekPolicy(keyframes)
+        costs = self.seekCosts.get(str(videoPath)) if videoPath is not None else None
+        if costs is None and videoPath is not None and self.videoProbes is not None:
+            probe = self.videoProbes.get(videoPath)
+            costs = probe.get("seekCosts") if probe is not None else None
+        if costs is None:
+            with self.stats.timer("seek"):
+                seekPolicy.calibrate(capVideo, self.frameNum)
+            costs = [seekPolicy.grabCost, seekPolicy.seekCost]
+            if videoPath is not None and self.videoProbes is not None:
+                self.videoProbes.setSeekCosts(videoPath, seekPolicy.grabCost, seekPolicy.seekCost)
+        if videoPath is not None:
+            self.seekCosts[str(videoPath)] = costs
+            self.stats.setSeekPolicy(Path(videoPath).name, costs[0], costs[1])
+        seekPolicy.grabCost, seekPolicy.seekCost = costs
+        return seekPolicy
+
+    # Generator of the (frame number, image) of @frames of a pipe reader, adding the time waiting for each frame
+    # to the "decode" stage. Frames of pipe readers are decoded and resized by ffmpeg
+    def timedFrames(self, frames):
+        while True:
+            with self.stats.timer("decode"):
+                item = next(frames, None)
+            if item is None:
+                return
+            self.stats.add("framesDecoded", 1, self.stats.video)
+            yield item
+
+    # Function to write the (frame number, image) pairs of @frames in all the @clips that contain them
+    # Each clip writer is opened with its first frame and closed after its last one
+    # @extension: extension of the images of image clips
+    # @captures: dict of the videos of each channel in pairedChannels mode. Then images of @frames are dicts
+    # of images by channel, each clip gets the image of its channel and @capVideo and @extension are not used
+    def dispatchFrames(self, clips, frames, capVideo, extension=".jpg", captures=None):
+        # Clips start with their first exported frame, which is not "start" if only some frames are exported
+        clips = sorted(clips, key=lambda clip: (getClipFrames(clip)[0], clip["end"]))
+        nextClip = 0
+        # @active: list of [clip, writer, set of its exported frames (None for all)] being written
+        active = []
+        for frame, image in frames:
+            # Close clips cut short by frames that could not be read and skip the ones that could not start
+            for clip, writer, selected in active:
+                if clip["end"] < frame:
+                    writer.close()
+            active = [[clip, writer, selected] for clip, writer, selected in active if clip["end"] >= frame]
+            while nextClip < len(clips) and getClipFrames(clips[nextClip])[0] < frame:
+                nextClip += 1
+            while nextClip < len(clips) and getClipFrames(clips[nextClip])[0] == frame:
+                print('Exporting interval %d \r' % clips[nextClip]["id"], end="")
+                if captures is None:
+                    writer = self.openClipWriter(clips[nextClip], capVideo, extension)
+                else:
+                    channel = clips[nextClip]["channel"]
+                    writer = self.openClipWriter(clips[nextClip], captures[channel], ".tif" if channel == "depth" else ".jpg")
+                selected = set(clips[nextClip]["selected"]) if "selected" in clips[nextClip] else None
+                active.append([clips[nextClip], writer, selected])
+                nextClip += 1
+            for clip, writer, selected in active:
+                if selected is not None:
+                    # Frames of other clips are not written in this one
+                    if frame not in selected:
+                        continue
+                    writer.setFrame(clip["mosaicStart"] + frame - clip["start"])
+                writer.write(image if captures is None else image[clip["channel"]])
+        for clip, writer, selected in active:
+            writer.close()
+
+    # Function to export rgb or ir @clips of @streamVideoPath with @self.videoWorkers processes
+    # Clips are split in groups of contiguous frame ranges and each process exports one group with its own capture
+    def decodeClipsParallel(self, clips, streamVideoPath, channel, keyframes=None):
+        groupClips = self.getWorkerGroups(clips, keyframes)
+        print("Exporting video in %d parts" % len(groupClips))
+        # Tensor shards are created here and written by the workers, each in the rows of its clips
+        tensorClips = [clip for clip in clips if self.isTensorMaterial(clip["material"])]
+        for shard in self.tensorShards.values():
+            shard.close()
+        self.tensorShards = {}
+        worker = self.getWorkerCopy()
+        # Each process gets an equal share of the memory budget
+        budgetBytes = self.memoryBudget.limitBytes // len(groupClips) if self.memoryBudget is not None else 0
+        tasks = [(worker, streamVideoPath, channel, group, tensorClips, keyframes, budgetBytes) for group in groupClips]
+        with multiprocessing.Pool(processes=len(tasks)) as pool:
+            for report in pool.starmap(exportClipsWorker, tasks):
+                self.stats.merge(report)
+
+    # Function to split @clips in up to @self.videoWorkers groups of complete clips, one per worker process
+    # Groups are split between the spans of the clips, not between the frame ranges they decode: with
+    # @self.frameStride or @self.framesPerInterval each selected frame is a range and a clip would be split between groups
+    def getWorkerGroups(self, clips, keyframes=None):
+        groups = self.splitRanges(self.getClipSpans(clips), self.videoWorkers, keyframes)
+        return [[clip for clip in clips if start <= getClipFrames(clip)[0] <= end] for start, end in groups]
+
+    # Function to get the sorted [first frame, last frame] spans of @clips. Overlapping clips are joined in one span,
+    # consecutive ones are not, so the video can be split between them
+    def getClipSpans(self, clips):
+        spans = []
+        for start, end in sorted([getClipFrames(clip)[0], getClipFrames(clip)[-1]] for clip in clips):
+            if len(spans) > 0 and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        return spans
+
+    # Function to split the sorted, non-overlapping @ranges in up to @parts groups with a similar number of frames
+    # Groups are only split between ranges that do not share a keyframe (GOP), if @keyframes are known
+    # Returns the [first frame, last frame] of each group
+    def splitRanges(self, ranges, parts, keyframes=None):
+        totalFrames = sum(end - start + 1 for start, end in ranges)
+        groups = []
+        frames = 0
+        for i, (start, end) in enumerate(ranges):
+            newGroup = len(groups) == 0 or (len(groups) < parts and frames >= totalFrames * len(groups) / parts and
+                                            (keyframes is None or getKeyframeBefore(keyframes, start) > ranges[i - 1][1]))
+            if newGroup:
+                groups.append([start, end])
+            else:
+                groups[-1][1] = end
+            frames += end - start + 1
+        return groups
+
+    # Function to get a copy of this exportClass that can be sent to worker processes: without the OpenLABEL handler,
+    # writers nor manifest
+    def getWorkerCopy(self):
+        worker = copy.copy(self)
+        worker.vcd_handler = None
+        worker.exportPlan = []
+        worker.writerPool = None
+        worker.videoWriters = []
+        worker.memoryBudget = None
+        worker.tarWriter = None
+        worker.manifest = None
+        worker.tensorShards = {}
+        worker.outputListing = {}
+        worker.stats = None
+        worker.videoProbes = None
+        return worker
+
+    # Function to export rgb or ir @clips with the "ffmpeg" decode backend: frames come from an ffmpeg pipe already at @self.size
+    def pipeDecodeClips(self, clips, streamVideoPath, capVideo):
+        ranges = self.getClipRanges(clips)
+        reader = FfmpegReader(streamVideoPath, int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                              int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)), ranges, self.size, threads=self.decodeThreads,
+                              crop=self.videoCrops.get(streamVideoPath))
+        try:
+            self.dispatchFrames(clips, self.timedFrames(reader.frames()), capVideo)
+        finally:
+            reader.close()
+
+    # Function to export the depth @clips as images, reading only their frames from the depth video @streamVideoPath
+    def depthClipsToImages(self, clips, streamVideoPath, capVideo):
+        ranges = self.getClipRanges(clips)
+        depthReader = DepthReader(streamVideoPath, int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                  int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)), ranges, self.size,
+                                  crop=self.videoCrops.get(streamVideoPath))
+        try:
+            self.dispatchFrames(clips, self.timedFrames(depthReader.frames()), capVideo, ".tif")
+        finally:
+            depthReader.close()
+
+    # Function to cut the depth video @clips in temporary files and move them to the tar shards
+    def depthClipsToTar(self, clips, streamVideoPath):
+        tempClips = []
+        for clip in clips:
+            videoFile, path = tempfile.mkstemp(suffix=".avi", dir=self.tarWriter.directory)
+            os.close(videoFile)
+            tempClips.append(dict(clip, name=path[:-len(".avi")]))
+        try:
+            self.cutDepthVideos(streamVideoPath, tempClips)
+            with self.stats.timer("write"):
+                for clip, tempClip in zip(clips, tempClips):
+                    self.tarWriter.moveFile(self.getSampleKey(clip), tempClip["name"] + ".avi", self.getClipMetadata(clip))
+        finally:
+            for tempClip in tempClips:
+                if os.path.exists(tempClip["name"] + ".avi"):
+                    os.remove(tempClip["name"] + ".avi")
+
+    # Function to cut the video @clips of @streamVideoPath without decoding them, with writeStreamCopyClip(). They are cut
+    # in the threads of @self.writerPool, if there is one
+    # @videoIndex: index of the video, built now if it is None (it is not saved)
+    # Returns False if the codec of the video cannot be stream copied
+    def streamCopyClips(self, clips, streamVideoPath, videoIndex=None):
+        video = probeStreamCopy(streamVideoPath)
+        if video is None:
+            print("WARNING: the codec of", Path(streamVideoPath).name, "cannot be stream copied, its clips are decoded")
+            return False
+        if videoIndex is None:
+            with self.stats.timer("open"):
+                videoIndex = buildIndex(streamVideoPath)
+        print("Cutting %d videos with stream copy" % len(clips))
+        for clip in clips:
+            stats = self.stats.context(clip["annotation"])
+            if self.writerPool is not None:
+                self.writerPool.submit(self.streamCopyClip, clip, streamVideoPath, video, videoIndex, stats)
+            else:
+                self.streamCopyClip(clip, streamVideoPath, video, videoIndex, stats)
+        return True
+
+    # Function to cut @clip from @streamVideoPath with writeStreamCopyClip(), in its .mp4 or in the tar shards
+    def streamCopyClip(self, clip, streamVideoPath, video, videoIndex, stats):
+        if self.tarWriter is None:
+            writeStreamCopyClip(streamVideoPath, clip["name"] + ".mp4", clip["start"], clip["end"], video,
+                                videoIndex["keyframes"], videoIndex["frames"], stats)
+            return
+        videoFile, path = tempfile.mkstemp(suffix=".mp4", dir=self.tarWriter.directory)
+        os.close(videoFile)
+        try:
+            writeStreamCopyClip(streamVideoPath, path, clip["start"], clip["end"], video,
+                                videoIndex["keyframes"], videoIndex["frames"], stats)
+            with stats.timer("write"):
+                self.tarWriter.moveFile(self.getSampleKey(clip), path, self.getClipMetadata(clip))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Function to cut the depth video @clips of @streamVideoPath with ffmpeg, adding its time and the bytes of each clip to the stats
+    def cutDepthVideos(self, streamVideoPath, clips):
+        with self.stats.timer("ffmpeg"):
+            writeDepthVideoClips(streamVideoPath, clips, self.size, crop=self.videoCrops.get(streamVideoPath))
+        for clip in clips:
+            if os.path.exists(clip["name"] + ".avi"):
+                self.stats.add("bytesWritten", os.path.getsize(clip["name"] + ".avi"), self.stats.video, clip["annotation"])
+            self.stats.add("framesWritten", clip["end"] - clip["start"] + 1, self.stats.video, clip["annotation"])
+
+    # Function to get the name of the video of @videoPlan in the stats: file names of its stream videos
+    def getStatsVideoName(self, videoPlan):
+        paths = videoPlan["paths"] if "paths" in videoPlan else [videoPlan["path"]]
+        return "+".join(Path(path).name for path in paths)
+
+    # Function to get the key of @clip in the tar shards: its file name relative to @self.destinationPath
+    def getSampleKey(self, clip):
+        return Path(os.path.relpath(clip["name"], self.destinationPath)).as_posix()
+
+    # Function to get the metadata stored with the samples of @clip in the tar shards
+    def getClipMetadata(self, clip):
+        return {"label": clip["annotation"], "stream": clip["stream"], "channel": clip["channel"],
+                "group": self.info[0], "subject": self.info[1], "session": self.info[2], "date": self.dateDayHour,
+                "interval": clip["id"], "mosaicStart": clip["mosaicStart"],
+                "mosaicEnd": clip["mosaicStart"] + clip["end"] - clip["start"]}
+
+    # Function to create the writer of @clip material: images, tensor shard or video
+    # If @self.tarWriter, images and videos are written in the tar shards
+    def openClipWriter(self, clip, capVideo, extension=".jpg"):
+        stats = self.stats.context(clip["annotation"])
+        if self.isTensorMaterial(clip["material"]):
+            return self.tensorShards[clip["shard"]].openClip(clip, stats)
+        if self.isImageMaterial(clip["material"]):
+            if self.tarWriter is not None:
+                return TarImageWriter(self.tarWriter, self.getSampleKey(clip), clip["mosaicStart"],
+                                      self.getClipMetadata(clip), extension, pool=self.writerPool, stats=stats)
+            return ImageWriter(clip["name"], clip["mosaicStart"], extension, pool=self.writerPool, stats=stats)
+        # Clips of the frameInterval* functions have no channel: they are not cropped
+        width, height = self.getOutputSize(capVideo, clip.get("channel"))
+        fps = self.getFrameRate(capVideo)
+        if self.tarWriter is not None:
+            writer = TarVideoWriter(self.tarWriter, self.getSampleKey(clip), self.getClipMetadata(clip), width, height,
+                                    fps, stats, self.videoCodec)
+        else:
+            writer = VideoWriter(clip["name"], width, height, fps, stats, self.videoCodec)
+        if self.encodeWorkers > 0:
+            # The video is encoded in its own thread while the next frames are decoded
+            writer = ThreadedVideoWriter(writer, self.encodeQueue, self.memoryBudget)
+            self.videoWriters.append(writer)
+        return writer
+
+    # Function to get the frame rate of the stream video of @capVideo, 29.76 if it is unknown
+    def getFrameRate(self, capVideo):
+        fps = capVideo.get(cv2.CAP_PROP_FPS)
+        return fps if fps > 0 else 29.76
+
+    # Function to wait until the videos being encoded by ThreadedVideoWriter are written
+    # Writers not closed yet (when the export stopped with an error) are closed with the frames they have
+    def waitVideoWriters(self):
+        videoWriters = self.videoWriters
+        self.videoWriters = []
+        for writer in videoWriters:
+            writer.close()
+        for writer in videoWriters:
+            writer.wait()
+
+    # Function to get the mosaic frames of the frames of @clip chosen by sampleFrames(), None if all are exported
+    def getSelectedMosaicFrames(self, clip):
+        if "selected" not in clip:
+            return None
+        return [clip["mosaicStart"] + frame - clip["start"] for frame in clip["selected"]]
+
+    # Function to get the sorted, merged [start, end] ranges of the frames to read of @clips
+    def getClipRanges(self, clips):
+        intervals = []
+        for clip in clips:
+            if "selected" in clip:
+                intervals += [[frame, frame] for frame in clip["selected"]]
+            else:
+                intervals.append([clip["start"], clip["end"]])
+        return self.mergeIntervals(intervals)
+
+    # Function to merge overlapping or consecutive [start, end] @intervals. Returns them sorted
+    def mergeIntervals(self, intervals):
+        merged = []
+        for start, end in sorted(intervals):
+            if len(merged) > 0 and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
 
     # Function to get invervals as dictionaries and return them as a python list
     def dictToList(self,intervalsDict):
@@ -330,48 +1616,20 @@ class exportClass():
     # @capVideo: is video loaded in opencv, not path
     # @name of file with no extension
     def frameIntervalToVideo(self, frameStart, frameEnd, capVideo, name):
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        if self.size =="original":
-            width = int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        else:
-            width = self.size[0]
-            height = self.size[1]
-        intervalVideo = cv2.VideoWriter(name + ".avi", fourcc, 29.76, (width, height))
-        success = True
-        capVideo.set(cv2.CAP_PROP_POS_FRAMES, frameStart)
-        while success and capVideo.get(cv2.CAP_PROP_POS_FRAMES) <= frameEnd:
-            success, image = capVideo.read()
-            if self.size != "original":
-                image = cv2.resize(image, self.size, interpolation=cv2.INTER_LANCZOS4)
-            intervalVideo.write(image)
-        intervalVideo.release()
+        clip = {"annotation": "", "material": "video", "id": 0, "start": frameStart, "end": frameEnd,
+                "mosaicStart": frameStart, "name": name}
+        self.decodeClips([clip], capVideo)
+        self.waitVideoWriters()
 
     # Function to create a sub video called @name.avi from @frameStart to @frameEnd of stream video @streamVideoPath from DEPTH channel.
-    # Uses ffmpeg-python to properly cut the video
-    # Cut must be made with time, not with frame number. That is why it is frameNumber/frameRate
+    # Uses ffmpeg-python to properly cut the video by frame number
     # saves video in @self.destinationPath
     # @streamVideoPath: is the depth video path, not video
     # @name of file with no extension
     def depthFrameIntervalToVideo(self, frameStart, frameEnd, streamVideoPath, name):
-        
-        if self.size!="original":
-            vid = (
-                ffmpeg.input(streamVideoPath)
-                .trim(start=int(frameStart/29.76), end=int(frameEnd/29.76))
-                .setpts('PTS-STARTPTS')
-                .filter_('scale', w=self.size[0], h=self.size[1], sws_flags="neighbor")
-                .output(name+".avi", vcodec='ffv1', pix_fmt='gray16le', crf=0)
-                .run()
-            )
-        else:
-            vid = (
-                ffmpeg.input(streamVideoPath)
-                .trim(start=int(frameStart/29.76), end=int(frameEnd/29.76))
-                .setpts('PTS-STARTPTS')
-                .output(name+".avi", vcodec='ffv1', pix_fmt='gray16le', crf=0)
-                .run()
-            )
+        clip = {"annotation": "", "material": "video", "id": 0, "start": frameStart, "end": frameEnd,
+                "mosaicStart": frameStart, "name": name}
+        self.cutDepthVideos(streamVideoPath, [clip])
 
     # Function to get images from @frameStart to @frameEnd of stream video @capVideo
     # saves in @self.destinationPath
@@ -379,70 +1637,28 @@ class exportClass():
     # @capVideo: is video loaded in opencv, not path
     # @name of images with no extension
     def frameIntervalToImages(self,frameStart, frameEnd, mosaicFrameStart, capVideo, name):
-        frameCount = mosaicFrameStart
-        success = True
-        capVideo.set(cv2.CAP_PROP_POS_FRAMES, frameStart)
-        while success and capVideo.get(cv2.CAP_PROP_POS_FRAMES) <= frameEnd:
-            success, image = capVideo.read()
-            if not success:
-                break
-            if self.size != "original":
-                image = cv2.resize(image, self.size, interpolation=cv2.INTER_LANCZOS4)
+        clip = {"annotation": "", "material": "image", "id": 0, "start": frameStart, "end": frameEnd,
+                "mosaicStart": mosaicFrameStart, "name": name}
+        self.decodeClips([clip], capVideo)
 
-            cv2.imwrite(name+"_"+str(frameCount)+".jpg", image)
-            frameCount += 1
-
-    # Function to get images from @frameStart to @frameEnd of stream DEPTH info array @depthVideoArray
+    # Function to get images from @frameStart to @frameEnd of DEPTH stream video @streamVideoPath
     # saves in @self.destinationPath
     # @mosaicFrameStart is the initial frame number of the mosaic, this is to name the image with the frame number of the mosaic 
     # instead of the individual video and help synchronization afterwards
+    # @capVideo: is the depth video loaded in opencv, to get its size
     # @name of images with no extension
-    def depthFrameIntervalToImages(self, frameStart, frameEnd, mosaicFrameStart, depthVideoArray, capVideo, name):
-        frameCount = mosaicFrameStart
-        for i in range(frameStart,frameEnd+1):
-            if i < self.frameNum:
-                cv2.imwrite(name+"_"+str(frameCount)+".tif",depthVideoArray[i])
-            else:
-                #write a black image
-                if self.size != "original":
-                    cv2.imwrite(name+"_"+str(frameCount)+".tif",np.zeros((self.size[1],self.size[0]),dtype=np.uint16))
-                cv2.imwrite(name+"_"+str(frameCount)+".tif",np.zeros((int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-                                                                         int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))),dtype=np.uint16))
-            frameCount +=1
-
-    # Function to get depth information of all frames from depth video in a unit16 array. Array should be [self.frameNum, heigth, width]
-    # Uses ffmpeg-python to properly extract info from video in gray16le pixelformat
-    def getDepthVideoArray(self, streamVideoPath, capVideo):
-        if self.size!="original":
-            out, _ = (
-            ffmpeg
-            .input(streamVideoPath)
-            .filter_('scale', width=self.size[0], height=self.size[1], sws_flags="neighbor")
-            .output('pipe:', format='rawvideo', pix_fmt='gray16le')
-            .run(capture_stdout=True)
-            )
-            array_imgs = (
-                np
-                .frombuffer(out, np.uint16)
-                .reshape([-1, self.size[1], self.size[0]])
-            )
-        else:
-            out, _ = (
-            ffmpeg
-            .input(streamVideoPath)
-            .output('pipe:', format='rawvideo', pix_fmt='gray16le')
-            .run(capture_stdout=True)
-            )
-            array_imgs = (
-                np
-                .frombuffer(out, np.uint16)
-                .reshape([-1, int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH))])
-            )
-        return array_imgs
+    def depthFrameIntervalToImages(self, frameStart, frameEnd, mosaicFrameStart, streamVideoPath, capVideo, name):
+        clip = {"annotation": "", "material": "image", "id": 0, "start": frameStart, "end": frameEnd,
+                "mosaicStart": mosaicFrameStart, "name": name}
+        self.depthClipsToImages([clip], streamVideoPath, capVideo)
 
     # Function to get uri of the @videoStream video from OpenLABEL and check if video frame count matches with OpenLABEL.
     # Returns @videoPath: path of @videoStream in OpenLABEL
     def getStreamVideo(self,videoChannel,videoStream):
+        # Videos already checked by this export are not checked again
+        if (videoChannel, videoStream) in self.streamVideos:
+            videoPath, self.frameNum = self.streamVideos[(videoChannel, videoStream)]
+            return videoPath
         # load Uri and frame count
         # uri e.g.: gA/1/s1/gA_1_s1_2019-03-08T09;31;15+01;00_rgb_face.mp4
         if self.datasetDMD:
@@ -498,25 +1714,98 @@ class exportClass():
                     
                 videoPath = Path(videoPath)
 
-        # Check video frame count and OpenLABEL's frame count
-        if videoPath.exists():
-            cap = cv2.VideoCapture(str(videoPath))
-            length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            if length != self.frameNum:
+        # When only planning, videos are not opened: the frame count is the one of the probe cache, the video index or
+        # the OpenLABEL
+        if self.planOnly:
+            videoFrames = None
+            checkedFrames = None
+            probe = None
+            if videoPath.exists():
+                probe = self.videoProbes.get(videoPath) if self.videoProbes is not None else None
+                videoIndex = loadIndex(videoPath) if probe is None else None
+                if probe is not None:
+                    videoFrames = probe["frames"]
+                    checkedFrames = self.videoProbes.getChecked(videoPath, self.frameNum)
+                elif videoIndex is not None:
+                    videoFrames = videoIndex["frames"]
+            else:
+                print("WARNING: video %s not found, planning with the frame count of the OpenLABEL" % videoPath)
+            openlabelFrames = self.frameNum
+            if checkedFrames is not None:
+                self.frameNum = checkedFrames
+            elif videoFrames is not None and videoFrames != self.frameNum:
                 #Some depth videos are missing 1 frame
                 if videoChannel == "depth":
                     self.frameNum = self.frameNum - 1
                 else:
-                    raise RuntimeWarning(
-                        "OpenLABEL's and real video frame count don't match. OpenLABEL: %s video: %s",(self.frameNum,length))
+                    print("WARNING: OpenLABEL's and real video frame count don't match. OpenLABEL: %s video: %s" % (self.frameNum, videoFrames))
+                    probe = None
+            if probe is not None and checkedFrames is None:
+                self.videoProbes.setChecked(videoPath, openlabelFrames, self.frameNum)
+            self.streamVideos[(videoChannel, videoStream)] = [videoPath, self.frameNum]
+            self.videoCrops[str(videoPath)] = self.getVideoCrop(videoStream, videoPath)
+            return videoPath
+
+        # Check video frame count and OpenLABEL's frame count
+        if videoPath.exists():
+            openlabelFrames = self.frameNum
+            # The frame count checked by an earlier export is taken from the probe cache
+            checkedFrames = self.videoProbes.getChecked(videoPath, openlabelFrames) if self.videoProbes is not None else None
+            if checkedFrames is not None:
+                self.frameNum = checkedFrames
             else:
+                # Take the real frame count from the probe cache, or from the video index if the video was indexed
+                with self.stats.timer("open"):
+                    if self.videoProbes is not None:
+                        length = self.videoProbes.getProbe(videoPath)["frames"]
+                    else:
+                        videoIndex = loadIndex(videoPath)
+                        length = videoIndex["frames"] if videoIndex is not None else probeVideo(videoPath)["frames"]
+                if length != self.frameNum:
+                    #Some depth videos are missing 1 frame
+                    if videoChannel == "depth":
+                        self.frameNum = self.frameNum - 1
+                    else:
+                        raise RuntimeWarning(
+                            "OpenLABEL's and real video frame count don't match. OpenLABEL: %s video: %s",(self.frameNum,length))
+                if self.videoProbes is not None:
+                    self.videoProbes.setChecked(videoPath, openlabelFrames, self.frameNum)
+            if self.frameNum == openlabelFrames:
                 print(videoChannel, videoStream, "stream loaded:", videoPath.name)
         else:
             raise RuntimeError(
                 videoPath, "video not found. Video Uri in OpenLABEL is wrong or video does not exist")
 
+        self.streamVideos[(videoChannel, videoStream)] = [videoPath, self.frameNum]
+        self.videoCrops[str(videoPath)] = self.getVideoCrop(videoStream, videoPath)
         return videoPath
 
+    # Function to get the CropRoi of the video @videoPath of @stream with @self.crop, None if it is not cropped
+    def getVideoCrop(self, stream, videoPath):
+        roi = self.crop.get("/".join(self.info[:3]) + "/" + stream, self.crop.get(stream))
+        if roi is None:
+            return None
+        crop = loadCropRoi(roi, videoPath)
+        if self.size == "original" and crop.getSize() is None:
+            raise RuntimeError("WARNING: crop ROIs of %s have different sizes, set a size to export them" % videoPath.name)
+        return crop
+
+    # Function to get the [first, last] mosaic frames that exist in @stream, with the frame shifts of the OpenLABEL
+    def getStreamMosaicRange(self, stream):
+        if not self.datasetDMD:
+            return 0, self.frameNum - 1
+        lengths = dict(zip(["face", "body", "hands"], self.vcd_handler.get_frame_numbers()))
+        # Stream frame = mosaic frame + offset
+        if self.shift_bf >= 0 and self.shift_hf >= 0:
+            offsets = {"face": 0, "body": -self.shift_bf, "hands": -self.shift_hf}
+        elif self.shift_bf <= 0 and self.shift_hb >= 0:
+            offsets = {"face": self.shift_bf, "body": 0, "hands": -self.shift_hb}
+        elif self.shift_hb <= 0 and self.shift_hf <= 0:
+            offsets = {"face": self.shift_hf, "body": self.shift_hb, "hands": 0}
+        else:
+            raise RuntimeError("Error: Unknown order")
+        return max(0, -offsets[stream]), lengths[stream] - 1 - offsets[stream]
+
     #Function to check if the mosaic-count frame is available in stream requested. Then calculate corresponding frame position in stream-count
     def checkFrameInStream(self, stream, frameStart, frameEnd):
 
@@ -580,4 +1869,33 @@ class exportClass():
 
     # Function to transform int keys to integer if possible
     def keys_to_int(self,x):
-        return {int(k) if self.is_string_int(k) else k: v for k, v in x}
\ No newline at end of file
+        return {int(k) if self.is_string_int(k) else k: v for k, v in x}
+
+
+# Function run by the worker processes of exportClass.decodeClipsParallel(): exports the rgb or ir @clips of
+# @streamVideoPath with @export, a copy of the exportClass made by getWorkerCopy()
+# @tensorClips: all the tensor clips of the video, to open the tensor shards created by the main process
+# @budgetBytes: memory budget of the process
+# Returns the stats report of the worker, to be merged in the stats of the main process
+def exportClipsWorker(export, streamVideoPath, channel, clips, tensorClips, keyframes, budgetBytes=0):
+    export.stats = ExportStats()
+    export.stats.startVideo(Path(streamVideoPath).name)
+    export.memoryBudget = MemoryBudget(budgetBytes, export.stats)
+    if export.encodeWorkers > 0:
+        export.writerPool = WriterPool(export.encodeWorkers, export.encodeQueue, export.memoryBudget)
+    with export.stats.timer("open"):
+        capVideo = cv2.VideoCapture(streamVideoPath)
+    try:
+        export.openTensorShards(tensorClips, capVideo, channel, "r+")
+        if export.decodeBackend == "ffmpeg":
+            export.pipeDecodeClips(clips, streamVideoPath, capVideo)
+        else:
+            export.decodeClips(clips, capVideo, keyframes, export.videoCrops.get(streamVideoPath), streamVideoPath)
+    finally:
+        for shard in export.tensorShards.values():
+            shard.close()
+        export.waitVideoWriters()
+        if export.writerPool is not None:
+            export.writerPool.close()
+        capVideo.release()
+    return export.stats.getReport()
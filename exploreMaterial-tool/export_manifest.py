@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+# Manifest of the clips of an OpenLABEL exported by exportClass (accessDMDAnn.py), so a new export
+# of the same OpenLABEL to the same destination skips the clips that are already complete.
+# It is saved as json: {"openlabel": path, "hash": sha1 of the OpenLABEL file, "settings": {...}, "clips": {key: record}}
+# Each clip record has the signature of the clip: its intervals, stream, channel, material and the export
+# @settings (size, chunk settings...). A clip is only skipped if its signature did not change.
+# Clips are added to the manifest after all their frames are written, so clips written partially are redone.
+
+
+# Function to get the sha1 of the file @path
+def getFileHash(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as hashedFile:
+        for block in iter(lambda: hashedFile.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ExportManifest():
+
+    def __init__(self, path, openlabelPath, settings):
+        self.path = path
+        self.openlabel = str(openlabelPath)
+        self.hash = getFileHash(openlabelPath)
+        self.settings = settings
+        # @self.previousHash: hash of the OpenLABEL in the last export, None if it was not exported before
+        self.previousHash = None
+        self.clips = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as manifestFile:
+                    manifest = json.load(manifestFile)
+                self.previousHash = manifest["hash"]
+                self.clips = manifest["clips"]
+            except (ValueError, KeyError):
+                print("WARNING: manifest %s could not be read, all the clips will be exported" % path)
+
+    # Function to get the key of @clip in the manifest
+    def getClipKey(self, clip):
+        return clip["material"] + ":" + clip["name"]
+
+    # Function to get the signature of @clip: the sha1 of everything that changes its outputs
+    def getSignature(self, clip):
+        signed = {"clip": {key: clip[key] for key in ["annotation", "channel", "stream", "material", "id",
+                                                      "start", "end", "mosaicStart", "name"]},
+                  "settings": self.settings}
+        if "selected" in clip:
+            signed["selected"] = clip["selected"]
+        return hashlib.sha1(json.dumps(signed, sort_keys=True).encode()).hexdigest()
+
+    # Function to know if @clip was exported with the same signature
+    def isDone(self, clip):
+        record = self.clips.get(self.getClipKey(clip))
+        return record is not None and record["signature"] == self.getSignature(clip)
+
+    # Function to get the label, stream, channel and material of @record, None for records of older manifests without them
+    def getRecordGroup(self, record):
+        if "annotation" not in record or "stream" not in record:
+            return None
+        return (record["annotation"], record["stream"], record["channel"], record["material"])
+
+    # Function to get the records of clips exported before that are not in @clips with the same signature, of the
+    # labels, streams, channels and materials of @clips: their outputs are out of date. Records of the ones that are
+    # not in @clips are not stale, they were just not requested in this export
+    def getStaleRecords(self, clips):
+        current = set(self.getClipKey(clip) for clip in clips if self.isDone(clip))
+        groups = set((clip["annotation"], clip["stream"], clip["channel"], clip["material"]) for clip in clips)
+        return [record for key, record in self.clips.items()
+                if key not in current and self.getRecordGroup(record) in groups]
+
+    # Function to get the records of labels, streams, channels or materials that are not in @clips
+    def getOtherRecords(self, clips):
+        groups = set((clip["annotation"], clip["stream"], clip["channel"], clip["material"]) for clip in clips)
+        return [record for record in self.clips.values() if self.getRecordGroup(record) not in groups]
+
+    # Function to remove @clips from the manifest
+    def forget(self, records):
+        for record in records:
+            self.clips.pop(record["material"] + ":" + record["name"], None)
+
+    # Function to add @clips to the manifest as complete
+    def markDone(self, clips):
+        for clip in clips:
+            self.clips[self.getClipKey(clip)] = {
+                "signature": self.getSignature(clip), "material": clip["material"], "name": clip["name"],
+                "annotation": clip["annotation"], "stream": clip["stream"],
+                "channel": clip["channel"], "mosaicStart": clip["mosaicStart"],
+                "frames": clip["end"] - clip["start"] + 1, "shard": clip.get("shard"),
+                # Mosaic frames of the exported frames, if only some of them are exported
+                "selected": ([clip["mosaicStart"] + frame - clip["start"] for frame in clip["selected"]]
+                             if "selected" in clip else None)}
+
+    # Function to save the manifest, replacing the previous one only when it is completely written
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        manifest = {"openlabel": self.openlabel, "hash": self.hash, "settings": self.settings, "clips": self.clips}
+        with open(self.path + ".tmp", "w") as manifestFile:
+            json.dump(manifest, manifestFile)
+        os.replace(self.path + ".tmp", self.path)
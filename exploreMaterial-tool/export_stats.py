@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Timers and counters of the stages of an export made by exportClass (accessDMDAnn.py), to know if an export
+# is limited by opening videos, seeking, decoding, resizing, encoding, writing to disk or ffmpeg subprocesses.
+# They are added per video (channel/stream), per label and for the whole export.
+# Stages made by several threads at the same time (e.g. encode and write in the WriterPool) add the time of every thread,
+# so they can be bigger than the elapsed time.
+
+# Stage timers, in seconds. "time" is the elapsed time exporting each video and "backpressure",
+# the time stages waited for the memory budget (MemoryBudget of export_writers.py)
+stages = ["open", "seek", "decode", "resize", "encode", "write", "ffmpeg", "backpressure", "time"]
+counters = ["framesDecoded", "framesWritten", "bytesWritten"]
+# High-water marks of the export: bytes of frames in flight and frames in the writer and reader queues
+peaks = ["inflightBytes", "writerQueue", "readerQueue"]
+
+
+def newStageStats():
+    stats = {stage: 0.0 for stage in stages}
+    stats.update({counter: 0 for counter in counters})
+    return stats
+
+
+# Function to add the timers and counters of @source to @target
+def addStageStats(target, source):
+    for name in stages + counters:
+        target[name] += source.get(name, 0)
+
+
+# Function to get a copy of @stats with frames/s and bytes/s over @seconds
+def withRates(stats, seconds):
+    stats = dict(stats)
+    stats["framesPerSecond"] = stats["framesWritten"] / seconds if seconds > 0 else 0
+    stats["bytesPerSecond"] = stats["bytesWritten"] / seconds if seconds > 0 else 0
+    return stats
+
+
+class ExportStats():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.total = newStageStats()
+        self.videos = {}
+        self.labels = {}
+        self.peaks = {name: 0 for name in peaks}
+        # @self.seekPolicies: ms to decode a frame with grab() and of a seek, measured by the SeekPolicy
+        # (video_index.py) of each stream video
+        self.seekPolicies = {}
+        # @self.video: video being exported, "<channel>/<stream>"
+        self.video = None
+
+    # Function to start adding the stats of the main thread to @video
+    def startVideo(self, video):
+        self.video = video
+        with self.lock:
+            self.videos.setdefault(video, newStageStats())
+
+    # Function to add @value to the timer or counter @name, of the run, @video and @label
+    def add(self, name, value, video=None, label=None):
+        with self.lock:
+            self.total[name] += value
+            if video is not None:
+                self.videos.setdefault(video, newStageStats())[name] += value
+            if label is not None:
+                self.labels.setdefault(label, newStageStats())[name] += value
+
+    # Function to raise the high-water mark @name to @value
+    def peak(self, name, value):
+        with self.lock:
+            self.peaks[name] = max(self.peaks[name], value)
+
+    # Function to keep the costs in seconds of the SeekPolicy of the stream video @video
+    def setSeekPolicy(self, video, grabCost, seekCost):
+        with self.lock:
+            self.seekPolicies[video] = {"grabMs": grabCost * 1000, "seekMs": seekCost * 1000}
+
+    # Context manager that adds the time it takes to the timer @stage of the current video
+    @contextmanager
+    def timer(self, stage, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, self.video, label)
+
+    # Function to get the stats of @label in the current video, to be used by the writers of its clips,
+    # which can run in other threads while the next video is decoded
+    def context(self, label):
+        return StatsContext(self, self.video, label)
+
+    # Function to add the stats of a report of getReport() (e.g. from a worker process)
+    def merge(self, report):
+        with self.lock:
+            addStageStats(self.total, report["total"])
+            for name, value in report.get("peaks", {}).items():
+                self.peaks[name] = max(self.peaks[name], value)
+            self.seekPolicies.update(report.get("seekPolicies", {}))
+            for video, stats in report["videos"].items():
+                addStageStats(self.videos.setdefault(video, newStageStats()), stats)
+            for label, stats in report["labels"].items():
+                addStageStats(self.labels.setdefault(label, newStageStats()), stats)
+
+    # Function to get a dict with all the stats. Frames/s and bytes/s of videos are over their "time"
+    # and the ones of the run and labels, over the elapsed time of the run
+    def getReport(self):
+        elapsed = time.time() - self.start
+        with self.lock:
+            return {"elapsed": elapsed,
+                    "total": withRates(self.total, elapsed),
+                    "peaks": dict(self.peaks),
+                    "seekPolicies": dict(self.seekPolicies),
+                    "videos": {video: withRates(stats, stats["time"]) for video, stats in self.videos.items()},
+                    "labels": {label: withRates(stats, elapsed) for label, stats in self.labels.items()}}
+
+
+# Stats of a label in a video, given to the writers of its clips. With @stats None, nothing is added
+class StatsContext():
+
+    def __init__(self, stats, video, label):
+        self.stats = stats
+        self.video = video
+        self.label = label
+
+    def add(self, name, value):
+        if self.stats is not None:
+            self.stats.add(name, value, self.video, self.label)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+noStats = StatsContext(None, None, None)
+
+
+# Function to get the path of the report of a run exported to @destinationPath: export_report_<date and hour>.json
+def getReportPath(destinationPath):
+    return os.path.join(destinationPath, "export_report_" + time.strftime("%Y-%m-%d-%H;%M;%S") + ".json")
+
+
+# Function to write the JSON report of a run with the stats reports of each exported OpenLABEL
+# @reports: dict of {OpenLABEL path: report of ExportStats.getReport()}
+# @elapsed: elapsed time of the run
+def writeRunReport(reports, path, elapsed):
+    run = ExportStats()
+    for report in reports.values():
+        run.merge(report)
+    runReport = run.getReport()
+    runReport["elapsed"] = elapsed
+    runReport["total"] = withRates(run.total, elapsed)
+    runReport["labels"] = {label: withRates(stats, elapsed) for label, stats in run.labels.items()}
+    runReport["openlabels"] = reports
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as reportFile:
+        json.dump(runReport, reportFile, indent=1)
+    print("Export report written in", path)
+    total = runReport["total"]
+    print("Stages (s): " + ", ".join("%s %.1f" % (stage, total[stage]) for stage in stages if stage != "time"))
+    print("%d frames written, %.1f frames/s, %.1f MB/s" % (total["framesWritten"], total["framesPerSecond"],
+                                                           total["bytesPerSecond"] / 1e6))
+    print("Peak of frames in flight: %.1f MB" % (runReport["peaks"]["inflightBytes"] / 1e6))
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+import glob
+import io
+import json
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import cv2
+import ffmpeg
+import numpy as np
+from export_stats import noStats
+from video_index import getKeyframeBefore, getSmartCutSegments
+
+# Writers used by exportClass (accessDMDAnn.py) to save the frames of an exported interval.
+# A writer is opened when the first frame of its interval is decoded, receives every frame
+# of the interval with write() and is closed with close() after the last one.
+# Writers add their encode and write times, frames and bytes to @stats, a StatsContext of export_stats.py
+
+
+# Function to get the stream frames of @clip that are exported: the "selected" ones if only some of them are
+# exported (exportClass.sampleFrames()), or all from "start" to "end"
+def getClipFrames(clip):
+    return clip["selected"] if "selected" in clip else range(clip["start"], clip["end"] + 1)
+
+
+# Function to write @image in @path, raising an error if OpenCV could not encode it
+def writeImage(path, image, stats=noStats):
+    with stats.timer("encode"):
+        success, data = cv2.imencode(os.path.splitext(path)[1], image)
+    if not success:
+        raise RuntimeError("WARNING: image %s could not be written" % path)
+    with stats.timer("write"):
+        with open(path, "wb") as imageFile:
+            imageFile.write(data)
+    stats.add("framesWritten", 1)
+    stats.add("bytesWritten", len(data))
+
+
+# Memory budget of the frames in flight between the stages of an export (decoded frames waiting in the queues
+# of readers and writers). A stage that wants to queue a frame takes its bytes with acquire() and the stage that
+# consumes it gives them back with release(). When the budget is full, acquire() waits (backpressure), so a slow
+# disk slows down decoding instead of growing the queues.
+# @limitBytes: maximum bytes in flight, 0 for no limit (the peak is still measured)
+# @stats: ExportStats (export_stats.py) where the peaks and the time waiting for the budget are added
+class MemoryBudget():
+
+    def __init__(self, limitBytes=0, stats=None):
+        self.limitBytes = limitBytes
+        self.stats = stats
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+    # Function to take @nbytes from the budget, waiting while it is full and @canWait() is True.
+    # Stages only wait while they have frames in flight that will be released, otherwise they could wait forever
+    # for frames held by a stage that is waiting for them. A frame bigger than the budget is let through alone
+    def acquire(self, nbytes, canWait=lambda: True):
+        start = time.perf_counter()
+        waited = False
+        with self.condition:
+            while self.limitBytes > 0 and self.inflight > 0 and self.inflight + nbytes > self.limitBytes and canWait():
+                waited = True
+                self.condition.wait(timeout=0.1)
+            self.inflight += nbytes
+            inflight = self.inflight
+        if self.stats is not None:
+            if waited:
+                self.stats.add("backpressure", time.perf_counter() - start, self.stats.video)
+            self.stats.peak("inflightBytes", inflight)
+
+    def release(self, nbytes):
+        with self.condition:
+            self.inflight -= nbytes
+            self.condition.notify_all()
+
+    # Function to add the @length of the queue @name to its high-water mark
+    def peak(self, name, length):
+        if self.stats is not None:
+            self.stats.peak(name, length)
+
+
+# Function to get the bytes of the images in @args
+def getArrayBytes(args):
+    return sum(arg.nbytes for arg in args if isinstance(arg, np.ndarray))
+
+
+# Pool of threads that encode and write images while the decoding thread reads the next frames.
+# OpenCV releases the GIL while encoding, so the threads overlap with decoding and resizing.
+# @workers: number of writing threads
+# @queueDepth: maximum number of images waiting in the queue. When it is full, submit() waits for a free place
+# @budget: MemoryBudget of the export. Images in the queue or being written count in it, None for no budget
+class WriterPool():
+
+    def __init__(self, workers, queueDepth, budget=None):
+        self.queue = queue.Queue(maxsize=queueDepth)
+        self.budget = budget
+        self.errors = []
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue the call @function(*args) to be run by one of the threads
+    def submit(self, function, *args):
+        nbytes = getArrayBytes(args)
+        if self.budget is not None:
+            # Wait only while there are images of this pool that will release their bytes
+            self.budget.acquire(nbytes, lambda: self.queue.unfinished_tasks > 0)
+        self.queue.put((function, args, nbytes))
+        if self.budget is not None:
+            self.budget.peak("writerQueue", self.queue.qsize())
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            function, args, nbytes = task
+            try:
+                function(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                if self.budget is not None:
+                    self.budget.release(nbytes)
+                self.queue.task_done()
+
+    # Wait until every queued image is written, without stopping the threads
+    def wait(self):
+        self.queue.join()
+        if len(self.errors) > 0:
+            raise RuntimeError("WARNING: %d images could not be written. First error: %s" % (len(self.errors), self.errors[0]))
+
+    # Wait until every queued image is written and stop the threads
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if len(self.errors) > 0:
+            raise RuntimeError("WARNING: %d images could not be written. First error: %s" % (len(self.errors), self.errors[0]))
+
+
+# Writes each frame of an interval as an image called @name_<mosaic frame number>.jpg
+# @mosaicFrameStart is the initial frame number of the mosaic, to name the images with the mosaic frame number
+# @pool: WriterPool to encode and write the images, None to write them in the calling thread
+class ImageWriter():
+
+    def __init__(self, name, mosaicFrameStart, extension=".jpg", pool=None, stats=noStats):
+        self.name = name
+        self.frameCount = mosaicFrameStart
+        self.extension = extension
+        self.pool = pool
+        self.stats = stats
+
+    # Set the mosaic frame number of the next image, when frames of the interval are skipped
+    def setFrame(self, mosaicFrame):
+        self.frameCount = mosaicFrame
+
+    def write(self, image):
+        path = self.name + "_" + str(self.frameCount) + self.extension
+        if self.pool is not None:
+            self.pool.submit(writeImage, path, image, self.stats)
+        else:
+            writeImage(path, image, self.stats)
+        self.frameCount += 1
+
+    def close(self):
+        pass
+
+
+# Codecs of the exported videos, by name: FourCC of OpenCV. "mjpg" is intra-only and "ffv1" and "hfyu" are
+# lossless and intra-only, so any frame can be decoded without the previous ones
+videoCodecs = {"xvid": "XVID", "mjpg": "MJPG", "ffv1": "FFV1", "hfyu": "HFYU"}
+
+
+# Writes the frames of an interval as a video called @name.avi
+# @fps: frame rate of the video, the one of the stream video it comes from
+# @codec: name of the codec in videoCodecs
+class VideoWriter():
+
+    def __init__(self, name, width, height, fps=29.76, stats=noStats, codec="xvid"):
+        fourcc = cv2.VideoWriter_fourcc(*videoCodecs[codec])
+        self.path = name + ".avi"
+        self.stats = stats
+        self.video = cv2.VideoWriter(self.path, fourcc, fps, (width, height))
+        if not self.video.isOpened():
+            raise RuntimeError("WARNING: video %s could not be opened with codec %s" % (self.path, codec))
+
+    def write(self, image):
+        # OpenCV encodes and writes the frame in the same call
+        with self.stats.timer("encode"):
+            self.video.write(image)
+        self.stats.add("framesWritten", 1)
+
+    def close(self):
+        with self.stats.timer("write"):
+            self.video.release()
+        if os.path.exists(self.path):
+            self.stats.add("bytesWritten", os.path.getsize(self.path))
+
+
+# Writer stage that encodes the frames of a video writer (VideoWriter or TarVideoWriter) in its own thread,
+# so encoding a long clip overlaps with decoding the next frames and intervals. Frames are given through a queue
+# of @queueSize frames; when it is full, write() waits. close() returns at once: the thread closes @writer
+# after the last frame, and wait() waits for it and raises its errors.
+# @budget: MemoryBudget where the frames in the queue count, None for no budget
+class ThreadedVideoWriter():
+
+    def __init__(self, writer, queueSize=64, budget=None):
+        self.writer = writer
+        self.budget = budget
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def write(self, image):
+        if self.budget is not None:
+            # Wait only while this writer has frames to encode, which will release their bytes
+            self.budget.acquire(image.nbytes, lambda: not self.queue.empty())
+        self.queue.put(image)
+        if self.budget is not None:
+            self.budget.peak("writerQueue", self.queue.qsize())
+
+    def _work(self):
+        while True:
+            image = self.queue.get()
+            if image is None:
+                break
+            try:
+                if self.error is None:
+                    self.writer.write(image)
+            except Exception as e:
+                self.error = e
+            finally:
+                if self.budget is not None:
+                    self.budget.release(image.nbytes)
+        try:
+            if self.error is None:
+                self.writer.close()
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+
+    # Wait until the video is completely written
+    def wait(self):
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("WARNING: video could not be written: %s" % self.error)
+
+
+# Size-bounded tar shards in WebDataset layout: every sample is a group of consecutive members with the same
+# key and different extensions, e.g. <key>.jpg and <key>.json with its metadata.
+# Shards are called @directory/@prefix-000000.tar, @prefix-000001.tar... and a new one is started when
+# the next sample does not fit in @maxBytes (a sample bigger than @maxBytes gets a shard for itself).
+# Samples can be written from several threads.
+class TarShardWriter():
+
+    def __init__(self, directory, prefix, maxBytes):
+        self.directory = directory
+        self.prefix = prefix
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.shardCount = 0
+        self.samples = 0
+        self.tar = None
+        os.makedirs(directory, exist_ok=True)
+        # Remove the shards of a previous export with the same prefix, they are written again
+        for oldShard in glob.glob(os.path.join(glob.escape(directory), glob.escape(prefix) + "-*.tar")):
+            os.remove(oldShard)
+        self.openShard()
+
+    def openShard(self):
+        path = os.path.join(self.directory, "%s-%06d.tar" % (self.prefix, self.shardCount))
+        self.tar = tarfile.open(path, "w")
+        self.shardCount += 1
+        self.samples = 0
+
+    # Write the sample @key with @members: dict of {extension: bytes}
+    def writeSample(self, key, members):
+        with self.lock:
+            infos = []
+            sampleBytes = 0
+            for extension, data in members.items():
+                info = tarfile.TarInfo(key + "." + extension)
+                info.size = len(data)
+                info.mtime = time.time()
+                infos.append((info, data))
+                # Header (bigger for long names) and data rounded up to 512 bytes blocks
+                sampleBytes += len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)) + (len(data) + 511) // 512 * 512
+            # Closing a shard adds two 512 bytes blocks and pads it to a multiple of tarfile.RECORDSIZE
+            shardBytes = -(-(self.tar.offset + sampleBytes + 1024) // tarfile.RECORDSIZE) * tarfile.RECORDSIZE
+            if self.samples > 0 and shardBytes > self.maxBytes:
+                self.tar.close()
+                self.openShard()
+            for info, data in infos:
+                self.tar.addfile(info, io.BytesIO(data))
+            self.samples += 1
+
+    # Write the file in @path as the sample @key, with the @metadata dict as json, and remove the file
+    def moveFile(self, key, path, metadata):
+        with open(path, "rb") as sampleFile:
+            data = sampleFile.read()
+        self.writeSample(key, {os.path.splitext(path)[1][1:]: data, "json": json.dumps(metadata).encode()})
+        os.remove(path)
+
+    def close(self):
+        with self.lock:
+            self.tar.close()
+
+
+# Function to encode @image with @extension and write it in the tar shards @shards as the sample @key
+def writeTarImage(shards, key, extension, image, metadata, stats=noStats):
+    with stats.timer("encode"):
+        success, data = cv2.imencode(extension, image)
+    if not success:
+        raise RuntimeError("WARNING: image %s could not be encoded" % key)
+    with stats.timer("write"):
+        shards.writeSample(key, {extension[1:]: data.tobytes(), "json": json.dumps(metadata).encode()})
+    stats.add("framesWritten", 1)
+    stats.add("bytesWritten", len(data))
+
+
+# Writes each frame of an interval as a sample @key_<mosaic frame number> of the tar shards @shards
+# @metadata: dict saved with every image, its "mosaicStart" and "mosaicEnd" are set to the frame of the image
+# @pool: WriterPool to encode and write the images, None to write them in the calling thread
+class TarImageWriter():
+
+    def __init__(self, shards, key, mosaicFrameStart, metadata, extension=".jpg", pool=None, stats=noStats):
+        self.shards = shards
+        self.key = key
+        self.frameCount = mosaicFrameStart
+        self.metadata = metadata
+        self.extension = extension
+        self.pool = pool
+        self.stats = stats
+
+    # Set the mosaic frame number of the next image, when frames of the interval are skipped
+    def setFrame(self, mosaicFrame):
+        self.frameCount = mosaicFrame
+
+    def write(self, image):
+        metadata = dict(self.metadata, mosaicStart=self.frameCount, mosaicEnd=self.frameCount)
+        key = self.key + "_" + str(self.frameCount)
+        if self.pool is not None:
+            self.pool.submit(writeTarImage, self.shards, key, self.extension, image, metadata, self.stats)
+        else:
+            writeTarImage(self.shards, key, self.extension, image, metadata, self.stats)
+        self.frameCount += 1
+
+    def close(self):
+        pass
+
+
+# Writes the frames of an interval as a video, in a temporary file next to the shards,
+# and moves it to the tar shards @shards as the sample @key when it is closed
+class TarVideoWriter():
+
+    def __init__(self, shards, key, metadata, width, height, fps=29.76, stats=noStats, codec="xvid"):
+        self.shards = shards
+        self.key = key
+        self.metadata = metadata
+        self.stats = stats
+        videoFile, self.path = tempfile.mkstemp(suffix=".avi", dir=shards.directory)
+        os.close(videoFile)
+        self.video = VideoWriter(self.path[:-len(".avi")], width, height, fps, stats, codec)
+
+    def write(self, image):
+        self.video.write(image)
+
+    def close(self):
+        self.video.close()
+        with self.stats.timer("write"):
+            self.shards.moveFile(self.key, self.path, self.metadata)
+
+
+# Memory-mapped shard with all the frames of the tensor @clips of one label, session, channel and stream.
+# Frames are stored in @name.npy as a uint8 (or uint16 for depth) array of N x H x W x C, clip after clip in the
+# order of @clips, and @name_index.npy has one row per frame: [mosaic frame number, interval id].
+# Rows of frames that could not be read keep -1 in the index.
+# Both files are standard .npy files, so they can be opened with np.load(path, mmap_mode="r") and sliced without copies.
+# @clips: list of clip dicts with "id", "start" and "end"
+# @height, @width, @channels: size of the frames
+# @mode: "w+" to create the shard, "r+" to write in a shard created before with the same @clips (e.g. from another process)
+class TensorShard():
+
+    def __init__(self, name, clips, height, width, channels, dtype=np.uint8, mode="w+"):
+        self.name = name
+        # @offsets: first row of each interval id in the shard
+        self.offsets = {}
+        frameCount = 0
+        for clip in clips:
+            self.offsets[clip["id"]] = frameCount
+            frameCount += len(getClipFrames(clip))
+        if mode == "r+":
+            self.data = np.load(name + ".npy", mmap_mode="r+")
+            self.index = np.load(name + "_index.npy", mmap_mode="r+")
+        else:
+            self.data = np.lib.format.open_memmap(name + ".npy", mode="w+", dtype=dtype,
+                                                  shape=(frameCount, height, width, channels))
+            self.index = np.lib.format.open_memmap(name + "_index.npy", mode="w+", dtype=np.int64, shape=(frameCount, 2))
+            self.index[:] = -1
+
+    # Returns the writer of the frames of @clip
+    def openClip(self, clip, stats=noStats):
+        return TensorClipWriter(self, self.offsets[clip["id"]], clip["mosaicStart"], clip["id"], stats)
+
+    def close(self):
+        self.data.flush()
+        self.index.flush()
+        del self.data
+        del self.index
+
+
+# Writes the frames of an interval in its rows of a TensorShard
+class TensorClipWriter():
+
+    def __init__(self, shard, offset, mosaicFrameStart, intervalId, stats=noStats):
+        self.shard = shard
+        self.row = offset
+        self.frameCount = mosaicFrameStart
+        self.intervalId = intervalId
+        self.stats = stats
+
+    # Set the mosaic frame number of the next frame, when frames of the interval are skipped
+    def setFrame(self, mosaicFrame):
+        self.frameCount = mosaicFrame
+
+    def write(self, image):
+        with self.stats.timer("write"):
+            self.shard.data[self.row] = image.reshape(self.shard.data.shape[1:])
+            self.shard.index[self.row] = [self.frameCount, self.intervalId]
+        self.stats.add("framesWritten", 1)
+        self.stats.add("bytesWritten", image.nbytes)
+        self.row += 1
+        self.frameCount += 1
+
+    def close(self):
+        pass
+
+
+# Function to cut all the depth @clips of the depth video @streamVideoPath as 16 bit FFV1 videos called <clip name>.avi
+# Clips are cut by frame number with the trim filter of ffmpeg, so they are frame accurate.
+# All the clips of a batch are written by one ffmpeg process that decodes the video once and splits it to one output per clip.
+# @clips: list of clip dicts with "start", "end" and "name"
+# @size: "original" or [width, height] of the output videos
+# @maxOutputs: maximum number of clips written by one ffmpeg process
+# @crop: CropRoi (video_readers.py) of the video, None to not crop it. Each clip is cropped with the ROI of its first frame
+def writeDepthVideoClips(streamVideoPath, clips, size="original", maxOutputs=64, crop=None):
+    clips = sorted(clips, key=lambda clip: clip["start"])
+    for first in range(0, len(clips), maxOutputs):
+        batch = clips[first:first + maxOutputs]
+        split = ffmpeg.input(str(streamVideoPath)).filter_multi_output('split', len(batch))
+        outputs = []
+        for i, clip in enumerate(batch):
+            stream = split.stream(i).trim(start_frame=clip["start"], end_frame=clip["end"] + 1).setpts('PTS-STARTPTS')
+            if crop is not None:
+                x, y, width, height = crop.get(clip["start"])
+                stream = stream.filter_('crop', w=width, h=height, x=x, y=y, exact=1)
+            if size != "original":
+                stream = stream.filter_('scale', w=size[0], h=size[1], sws_flags="neighbor")
+            outputs.append(stream.output(clip["name"] + ".avi", vcodec='ffv1', pix_fmt='gray16le', vsync='passthrough'))
+        (
+            ffmpeg.merge_outputs(*outputs)
+            .global_args('-loglevel', 'error')
+            .overwrite_output()
+            .run()
+        )
+
+
+# Encoders used to re-encode the partial GOPs at the edges of stream copied clips, by codec of the stream video.
+# Stream videos with other codecs cannot be stream copied
+streamCopyEncoders = {"h264": {"vcodec": "libx264", "crf": 16, "preset": "superfast"},
+                      "mpeg4": {"vcodec": "mpeg4", "q:v": 2}}
+
+
+# Function to get what writeStreamCopyClip() needs to know of @streamVideoPath: its codec, frame rate and pixel format
+# Returns None if its codec is not in streamCopyEncoders
+def probeStreamCopy(streamVideoPath):
+    stream = [stream for stream in ffmpeg.probe(str(streamVideoPath))["streams"] if stream["codec_type"] == "video"][0]
+    if stream["codec_name"] not in streamCopyEncoders:
+        return None
+    numerator, denominator = stream["r_frame_rate"].split("/")
+    return {"codec": stream["codec_name"], "fps": int(numerator) / int(denominator), "pixFmt": stream["pix_fmt"]}
+
+
+# Function to write the frames @start to @end of @streamVideoPath in @path (.mp4) without decoding the whole GOPs
+# between them: they are copied as they are, and only the partial GOPs at the edges are decoded and re-encoded
+# (smart cut), so the clip is frame accurate. Segments are written in a temporary folder as mkv and joined with the
+# concat demuxer of ffmpeg.
+# @video: dict of probeStreamCopy() of the stream video
+# @keyframes, @frameCount: keyframes and number of frames of the video index
+def writeStreamCopyClip(streamVideoPath, path, start, end, video, keyframes, frameCount, stats=noStats):
+    segmentsPath = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with stats.timer("ffmpeg"):
+            segmentPaths = []
+            for first, last, copy in getSmartCutSegments(start, end, keyframes, frameCount):
+                segmentPath = os.path.join(segmentsPath, "%d.mkv" % len(segmentPaths))
+                # Seek half a frame after the keyframe, so ffmpeg starts at that keyframe
+                keyframe = first if copy else getKeyframeBefore(keyframes, first)
+                seek = (keyframe + 0.5) / video["fps"] if keyframe > 0 else 0
+                outputArgs = {"an": None}
+                if video["codec"] != "h264":
+                    # Headers of each segment inside its stream: the concat demuxer only keeps the ones of the first
+                    # segment (for h264, it does it by itself)
+                    outputArgs["bsf:v"] = "dump_extra"
+                if copy:
+                    output = ffmpeg.input(str(streamVideoPath), ss=seek).output(
+                        segmentPath, vcodec="copy", **{"frames:v": last - first + 1}, **outputArgs)
+                else:
+                    # Every frame from the keyframe reaches the filter, which keeps the ones of the segment
+                    stream = (ffmpeg.input(str(streamVideoPath), ss=seek, noaccurate_seek=None)
+                              .trim(start_frame=first - keyframe, end_frame=last - keyframe + 1)
+                              .setpts('PTS-STARTPTS'))
+                    output = stream.output(segmentPath, pix_fmt=video["pixFmt"],
+                                           **streamCopyEncoders[video["codec"]], **outputArgs)
+                output.global_args('-loglevel', 'error').overwrite_output().run()
+                segmentPaths.append(segmentPath)
+            listPath = os.path.join(segmentsPath, "segments.txt")
+            with open(listPath, "w") as listFile:
+                listFile.writelines("file '%s'\n" % os.path.basename(segmentPath) for segmentPath in segmentPaths)
+            (
+                ffmpeg.input(listPath, f="concat", safe=0)
+                .output(path, c="copy")
+                .global_args('-loglevel', 'error')
+                .overwrite_output()
+                .run()
+            )
+    finally:
+        shutil.rmtree(segmentsPath, ignore_errors=True)
+    stats.add("framesWritten", end - start + 1)
+    stats.add("bytesWritten", os.path.getsize(path))
+
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import traceback
+from multiprocessing import Pool
+from pathlib import Path
+
+from accessDMDAnn import exportClass
+from export_stats import writeRunReport, getReportPath
+
+# Functions to export several DMD OpenLABEL files, one after another or with a pool of worker processes.
+# Each OpenLABEL is exported by its own exportClass, so a file that fails does not stop the rest of the run.
+# Run it through python script DExTool.py
+
+
+# Function to read the number of worker processes from @configPath ("workers" key, 1 by default)
+def getWorkers(configPath="config_DEx.json"):
+    with open(configPath) as config_file:
+        config_dict = json.load(config_file)
+    workers = int(config_dict.get("workers", 1))
+    if workers < 1:
+        raise RuntimeError("WARNING: workers must be a number greater than 0")
+    return workers
+
+
+# Function run by each worker: exports the OpenLABEL @annotation of the DMD to @destinationPath
+# Returns a dict with the result: {"annotation", "clips", "time", "error", "stats"}
+# @stats: report of the stage timers and counters of the export (export_stats.py), None if it failed
+def exportAnnotation(annotation, destinationPath):
+    start = time.time()
+    result = {"annotation": annotation, "clips": 0, "time": 0, "error": None, "stats": None}
+    try:
+        dmd_folder = Path(annotation).parents[3]
+        export = exportClass(annotation, str(dmd_folder), destinationPath)
+        result["clips"] = sum(len(videoPlan["clips"]) for videoPlan in export.exportPlan)
+        result["stats"] = export.stats.getReport()
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["time"] = time.time() - start
+    return result
+
+
+def _exportAnnotationTask(task):
+    return exportAnnotation(*task)
+
+
+# Function to export all the OpenLABEL files in @annotationPaths to @destinationPath
+# @workers: number of processes exporting files at the same time. With 1, files are exported in this process
+# Writes the report of the stage timers and counters of the run in @destinationPath
+# Returns the list of results of exportAnnotation()
+def exportAnnotations(annotationPaths, destinationPath, workers=1):
+    start = time.time()
+    tasks = [(annotation, destinationPath) for annotation in annotationPaths]
+    results = []
+    if workers > 1 and len(tasks) > 1:
+        print("Exporting %d OpenLABEL files with %d workers" % (len(tasks), workers))
+        with Pool(processes=min(workers, len(tasks))) as pool:
+            for result in pool.imap_unordered(_exportAnnotationTask, tasks):
+                results.append(result)
+                printProgress(result, len(results), len(tasks))
+    else:
+        for task in tasks:
+            print(task[0])
+            result = exportAnnotation(*task)
+            results.append(result)
+            printProgress(result, len(results), len(tasks))
+    printSummary(results)
+    reports = {result["annotation"]: result["stats"] for result in results if result["stats"] is not None}
+    writeRunReport(reports, getReportPath(destinationPath), time.time() - start)
+    return results
+
+
+def printProgress(result, done, total):
+    state = "FAILED" if result["error"] else "%d clips" % result["clips"]
+    print("[%d/%d] %s: %s (%.1f s)" % (done, total, Path(result["annotation"]).name, state, result["time"]))
+
+
+# Function to print how many files were exported and the errors of the ones that failed
+def printSummary(results):
+    failed = [result for result in results if result["error"]]
+    print("\n-- Export summary --")
+    print("OpenLABEL files exported:", len(results) - len(failed), "of", len(results))
+    print("Clips exported:", sum(result["clips"] for result in results))
+    if len(failed) > 0:
+        print("WARNING: %d OpenLABEL files failed:" % len(failed))
+        for result in failed:
+            print("\n" + result["annotation"])
+            print(result["error"])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import sys
+import traceback
+from pathlib import Path
+
+from accessDMDAnn import exportClass
+from export_writers import getClipFrames
+
+# Functions to plan the export of DMD OpenLABEL files with the settings of config_DEx.json, without opening
+# any video: intervals are taken from the OpenLABEL, cut in chunks and checked in each stream like in an export.
+# The plan lists every clip with its stream frame range and the predicted frames and bytes of its output,
+# and sums them per label, to size storage and schedule exports before decoding.
+# Run it through python script DExTool.py or as: python plan_export.py <dmd folder> [plan name]
+
+# Size of the DMD videos, used when size is "original" because videos are not opened
+frameSize = [1280, 720]
+# Approximate bytes per pixel of each frame of the outputs (jpg, 16 bit LZW tif and ffv1 avi). Tensors are exact
+bytesPerPixel = {"image": 0.25, "depthImage": 1.2, "depthVideo": 0.8}
+# Approximate bytes per pixel of each frame of rgb and ir videos, by videoCodec
+videoBytesPerPixel = {"xvid": 0.03, "mjpg": 0.25, "ffv1": 1.5, "hfyu": 2.0}
+# Approximate bytes per pixel of each frame of stream copied videos (h264 of the DMD)
+streamCopyBytesPerPixel = 0.02
+# Bytes of a tar header and json metadata added to each sample in tar shards
+tarSampleBytes = 2048
+# Bytes of the header of a .npy file
+npyHeaderBytes = 128
+
+
+# Function to predict the bytes of the output of @clip, with frames of @width x @height
+def estimateClipBytes(export, clip, width, height):
+    frames = len(getClipFrames(clip))
+    depth = clip["channel"] == "depth"
+    if export.isTensorMaterial(clip["material"]):
+        # uint16 x 1 channel for depth, uint8 x 3 channels for rgb and ir, and 2 int64 per frame in the index
+        return frames * (width * height * (2 if depth else 3) + 16)
+    if export.isImageMaterial(clip["material"]):
+        clipBytes = frames * int(width * height * bytesPerPixel["depthImage" if depth else "image"])
+        samples = frames
+    else:
+        if depth:
+            pixelBytes = bytesPerPixel["depthVideo"]
+        elif export.isStreamCopy(clip["channel"]):
+            pixelBytes = streamCopyBytesPerPixel
+        else:
+            pixelBytes = videoBytesPerPixel[export.videoCodec]
+        clipBytes = frames * int(width * height * pixelBytes)
+        samples = 1
+    if export.tarShards:
+        clipBytes += samples * tarSampleBytes
+    return clipBytes
+
+
+# Function to get the [width, height] of the frames exported from @videoPlan: the size of the export, of the crop of
+# its stream video or of the DMD videos, times the streams side by side in multiView
+def getFrameSize(export, videoPlan):
+    if export.size != "original":
+        width, height = export.size
+    else:
+        crop = export.videoCrops.get(videoPlan["paths"][0] if "paths" in videoPlan else videoPlan["path"])
+        width, height = crop.getSize() if crop is not None else frameSize
+    if export.multiView:
+        # Streams side by side
+        width = width * len(export.streams)
+    return width, height
+
+
+# Function to plan the OpenLABEL @annotation of the DMD as if it was exported to @destinationPath
+# Returns the list of planned clips, as dicts with the columns of the plan
+def planAnnotation(annotation, destinationPath):
+    dmd_folder = Path(annotation).parents[3]
+    export = exportClass(annotation, str(dmd_folder), destinationPath, planOnly=True)
+    rows = []
+    shards = set()
+    for videoPlan in export.exportPlan:
+        width, height = getFrameSize(export, videoPlan)
+        for clip in videoPlan["clips"]:
+            frames = len(getClipFrames(clip))
+            clipBytes = estimateClipBytes(export, clip, width, height)
+            # The .npy headers are counted once per tensor shard
+            if export.isTensorMaterial(clip["material"]) and clip["shard"] not in shards:
+                shards.add(clip["shard"])
+                clipBytes += 2 * npyHeaderBytes
+            rows.append({"openlabel": annotation, "group": export.info[0], "subject": export.info[1],
+                         "session": export.info[2], "channel": clip["channel"], "stream": clip["stream"],
+                         "label": clip["annotation"], "material": clip["material"], "interval": clip["id"],
+                         "start": clip["start"], "end": clip["end"], "mosaicStart": clip["mosaicStart"],
+                         "mosaicEnd": clip["mosaicStart"] + clip["end"] - clip["start"], "frames": frames, "bytes": clipBytes,
+                         "name": clip["name"]})
+    return rows
+
+
+# Function to plan the export of all the OpenLABEL files in @annotationPaths
+# Writes the plan in @planName.json, with every clip and the totals per label, and every clip in @planName.csv
+# Returns the plan dict
+def planAnnotations(annotationPaths, planName, destinationPath="."):
+    clips = []
+    errors = []
+    for count, annotation in enumerate(annotationPaths):
+        print("[%d/%d] %s" % (count + 1, len(annotationPaths), annotation))
+        try:
+            clips += planAnnotation(annotation, destinationPath)
+        except Exception:
+            print("WARNING: %s could not be planned" % annotation)
+            errors.append({"openlabel": annotation, "error": traceback.format_exc()})
+
+    labels = {}
+    for clip in clips:
+        label = labels.setdefault(clip["label"], {"clips": 0, "frames": 0, "bytes": 0})
+        label["clips"] += 1
+        label["frames"] += clip["frames"]
+        label["bytes"] += clip["bytes"]
+    total = {"clips": len(clips), "frames": sum(clip["frames"] for clip in clips),
+             "bytes": sum(clip["bytes"] for clip in clips)}
+    plan = {"labels": labels, "total": total, "errors": errors, "clips": clips}
+
+    with open(planName + ".json", "w") as planFile:
+        json.dump(plan, planFile, indent=1)
+    with open(planName + ".csv", "w", newline="") as planFile:
+        columns = ["openlabel", "group", "subject", "session", "channel", "stream", "label", "material", "interval",
+                   "start", "end", "mosaicStart", "mosaicEnd", "frames", "bytes", "name"]
+        writer = csv.DictWriter(planFile, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(clips)
+
+    printPlanSummary(plan)
+    return plan
+
+
+# Function to print the predicted clips, frames and size of each label
+def printPlanSummary(plan):
+    print("\n-- Export plan --")
+    for label, totals in sorted(plan["labels"].items()):
+        print("%s: %d clips, %d frames, %.1f MB" % (label, totals["clips"], totals["frames"], totals["bytes"] / 1e6))
+    print("Total: %d clips, %d frames, %.1f GB" % (plan["total"]["clips"], plan["total"]["frames"], plan["total"]["bytes"] / 1e9))
+    if len(plan["errors"]) > 0:
+        print("WARNING: %d OpenLABEL files could not be planned, see the errors in the json plan" % len(plan["errors"]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python plan_export.py <dmd folder> [plan name]")
+    else:
+        # OpenLABEL files of every group, subject and session: dmd/g#/#/s#/*.json
+        annotationPaths = sorted(str(path) for path in Path(sys.argv[1]).glob("*/*/*/*.json"))
+        planAnnotations(annotationPaths, sys.argv[2] if len(sys.argv) > 2 else "export_plan")
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+toolPath = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(toolPath))
+sys.path.insert(0, str(toolPath.parent / "benchmark"))
+
+from accessDMDAnn import exportClass
+from make_fixture import makeFixture
+
+# frameCentric export of a synthetic DMD session (benchmark/make_fixture.py) where the face, body and hands
+# streams start at different mosaic frames (non-zero frame_shift). The joined intervals cover the whole session,
+# so every stream must export the mosaic frames it has, not skip the interval.
+
+settings = {"material": ["image"], "streams": ["face", "body", "hands"], "channels": ["rgb"],
+            "annotations": ["driver_actions/safe_drive", "driver_actions/radio"], "write": True, "size": [64, 48],
+            "intervalChunk": 0, "ignoreSmall": False, "asc": True, "frameCentric": True}
+
+
+@pytest.fixture(scope="module")
+def session(tmp_path_factory):
+    root = tmp_path_factory.mktemp("dmd")
+    vcdPath = makeFixture(root, frames=120, width=160, height=96, gop=30, seed=3)[0]
+    return root, vcdPath
+
+
+def export(tmp_path, monkeypatch, session, **options):
+    root, vcdPath = session
+    monkeypatch.chdir(tmp_path)
+    with open("config_DEx.json", "w") as configFile:
+        json.dump(dict(settings, **options), configFile)
+    destination = tmp_path / "export"
+    return exportClass(str(vcdPath), str(root), str(destination)), destination
+
+
+def test_fixture_has_shifts(session):
+    with open(str(session[1])) as vcdFile:
+        streams = json.load(vcdFile)["openlabel"]["streams"]
+    assert any(stream["stream_properties"]["sync"]["frame_shift"] != 0 for stream in streams.values())
+
+
+def test_every_stream_exports_its_frames(tmp_path, monkeypatch, session):
+    exporter, destination = export(tmp_path, monkeypatch, session)
+    for stream in settings["streams"]:
+        first, last = exporter.getStreamMosaicRange(stream)
+        images = sorted(int(path.stem.split("_")[-1]) for path in destination.rglob(stream + "_*.jpg"))
+        assert len(images) > 0
+        assert images == list(range(first, last + 1))
+
+    tables = list((destination / "labels").glob("*.csv"))
+    assert len(tables) == 1
+    with open(str(tables[0])) as tableFile:
+        rows = list(csv.DictReader(tableFile))
+    assert len(rows) > 0
+
+
+def test_multiview_exports_frames_of_all_streams(tmp_path, monkeypatch, session):
+    exporter, destination = export(tmp_path, monkeypatch, session, multiView=True)
+    ranges = [exporter.getStreamMosaicRange(stream) for stream in settings["streams"]]
+    first, last = max(start for start, _ in ranges), min(end for _, end in ranges)
+    images = sorted(int(path.stem.split("_")[-1]) for path in destination.rglob("*.jpg"))
+    assert images == list(range(first, last + 1))
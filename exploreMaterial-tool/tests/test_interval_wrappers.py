@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import sys
+from pathlib import Path
+
+import cv2
+import pytest
+
+toolPath = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(toolPath))
+sys.path.insert(0, str(toolPath.parent / "benchmark"))
+
+from accessDMDAnn import exportClass
+from make_fixture import makeFixture
+
+# The frameInterval* functions of exportClass cut a clip of a stream video without an export plan,
+# so their clips have no channel nor stream. They are called directly on a synthetic DMD session
+# (benchmark/make_fixture.py).
+
+settings = {"material": ["image"], "streams": ["body"], "channels": ["rgb"],
+            "annotations": ["driver_actions/safe_drive"], "write": False, "size": [64, 48],
+            "intervalChunk": 0, "ignoreSmall": False, "asc": True}
+
+
+@pytest.fixture(scope="module")
+def session(tmp_path_factory):
+    root = tmp_path_factory.mktemp("dmd")
+    vcdPath = makeFixture(root, frames=60, width=160, height=96, gop=30, seed=3)[0]
+    return root, vcdPath
+
+
+@pytest.fixture
+def exporter(tmp_path, monkeypatch, session):
+    root, vcdPath = session
+    monkeypatch.chdir(tmp_path)
+    with open("config_DEx.json", "w") as configFile:
+        json.dump(settings, configFile)
+    return exportClass(str(vcdPath), str(root), str(tmp_path / "export"))
+
+
+def test_frame_interval_to_video(tmp_path, exporter):
+    capVideo = cv2.VideoCapture(str(exporter.getStreamVideo("rgb", "body")))
+    try:
+        exporter.frameIntervalToVideo(5, 20, capVideo, str(tmp_path / "clip"))
+    finally:
+        capVideo.release()
+
+    clipVideo = cv2.VideoCapture(str(tmp_path / "clip.avi"))
+    try:
+        assert int(clipVideo.get(cv2.CAP_PROP_FRAME_COUNT)) == 16
+        assert int(clipVideo.get(cv2.CAP_PROP_FRAME_WIDTH)) == settings["size"][0]
+        assert int(clipVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)) == settings["size"][1]
+    finally:
+        clipVideo.release()
+
+
+def test_frame_interval_to_images(tmp_path, exporter):
+    (tmp_path / "images").mkdir()
+    capVideo = cv2.VideoCapture(str(exporter.getStreamVideo("rgb", "body")))
+    try:
+        exporter.frameIntervalToImages(5, 9, 105, capVideo, str(tmp_path / "images" / "body"))
+    finally:
+        capVideo.release()
+
+    images = sorted(path.name for path in (tmp_path / "images").glob("*.jpg"))
+    assert images == ["body_%d.jpg" % frame for frame in range(105, 110)]
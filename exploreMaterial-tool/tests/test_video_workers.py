@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+toolPath = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(toolPath))
+sys.path.insert(0, str(toolPath.parent / "benchmark"))
+
+from accessDMDAnn import exportClass
+from export_writers import getClipFrames
+from make_fixture import makeFixture
+from video_index import buildIndex
+
+# Split of the clips of a stream video between the @videoWorkers processes, on a synthetic DMD session
+# (benchmark/make_fixture.py). With @frameStride each selected frame is its own frame range, but every worker
+# must still get complete clips to export.
+
+settings = {"material": ["image"], "streams": ["body"], "channels": ["rgb"],
+            "annotations": ["driver_actions/safe_drive", "driver_actions/radio"], "write": False, "size": [64, 48],
+            "intervalChunk": 20, "ignoreSmall": False, "asc": True, "videoWorkers": 3, "frameStride": 4}
+
+
+@pytest.fixture(scope="module")
+def session(tmp_path_factory):
+    root = tmp_path_factory.mktemp("dmd")
+    vcdPath = makeFixture(root, frames=240, width=160, height=96, gop=10, seed=3)[0]
+    return root, vcdPath
+
+
+def plan(tmp_path, monkeypatch, session, **options):
+    root, vcdPath = session
+    monkeypatch.chdir(tmp_path)
+    with open("config_DEx.json", "w") as configFile:
+        json.dump(dict(settings, **options), configFile)
+    exporter = exportClass(str(vcdPath), str(root), str(tmp_path / "export"))
+    videoPlan = [videoPlan for videoPlan in exporter.exportPlan if len(videoPlan["clips"]) > 0][0]
+    return exporter, videoPlan
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_every_worker_gets_clips_with_stride(tmp_path, monkeypatch, session, indexed):
+    exporter, videoPlan = plan(tmp_path, monkeypatch, session)
+    clips = videoPlan["clips"]
+    assert all(len(clip["selected"]) > 1 for clip in clips)
+    keyframes = buildIndex(videoPlan["path"])["keyframes"] if indexed else None
+
+    groups = exporter.getWorkerGroups(clips, keyframes)
+    assert len(groups) == settings["videoWorkers"]
+    assert all(len(group) > 0 for group in groups)
+    # Each clip is exported by one worker, and the frames of the workers do not overlap
+    assert sorted(clip["id"] for group in groups for clip in group) == sorted(clip["id"] for clip in clips)
+    for group, nextGroup in zip(groups, groups[1:]):
+        assert max(getClipFrames(clip)[-1] for clip in group) < min(getClipFrames(clip)[0] for clip in nextGroup)
+
+
+def test_long_clip_does_not_leave_workers_idle(tmp_path, monkeypatch, session):
+    exporter, _ = plan(tmp_path, monkeypatch, session)
+    # A long clip and two short ones: most of the selected frames are in the long clip, so the groups must not be
+    # split inside it
+    clips = [{"id": clipId, "start": start, "end": end, "selected": list(range(start, end + 1, settings["frameStride"]))}
+             for clipId, (start, end) in enumerate([[0, 199], [210, 219], [225, 239]])]
+
+    groups = exporter.getWorkerGroups(clips)
+    assert [[clip["id"] for clip in group] for group in groups] == [[0], [1], [2]]
@@ -169,6 +169,31 @@ class VcdHandler():
                 action_type_list.append(self._vcd.get_action(str(uid)).get('type'))
         return action_type_list
 
+    # Function to get the labels of each frame of @frames and how they were annotated
+    # Returns {frame: {type: annotated}}: type is the "type" of the action or object and annotated, the "annotated"
+    # data of that frame (e.g. "manual", "interval" or "unchanged" from TaTo), "" if it has none
+    def get_frames_labels(self, frames):
+        labels = {frame: {} for frame in frames}
+        elements = [("action", uid, self._vcd.get_action(str(uid))) for uid in range(self.__num_actions)]
+        elements += [("object", uid, self._vcd.get_object(str(uid))) for uid in range(self.__num_objects)]
+        for kind, uid, element in elements:
+            for interval in element.get("frame_intervals", []):
+                for frame in range(interval["frame_start"], interval["frame_end"] + 1):
+                    if frame in labels:
+                        labels[frame][element["type"]] = self.get_frame_annotated(kind, uid, frame)
+        return labels
+
+    # Function to get the "annotated" data of the action or object (@kind) @uid in @frame, "" if it has none
+    def get_frame_annotated(self, kind, uid, frame):
+        frame_data = self._vcd.get_frame(frame)
+        if frame_data is None:
+            return ""
+        element = frame_data.get(kind + "s", {}).get(str(uid), {})
+        for data in element.get(kind + "_data", {}).get("text", []):
+            if data["name"] == "annotated":
+                return data["val"]
+        return ""
+
     # Return flag that indicate if OpenLABEL was loaded from file
     def fileLoaded(self):
         return self.__vcd_loaded
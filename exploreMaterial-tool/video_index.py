@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+# Keyframe (GOP) index of the DMD stream videos.
+# The index of a video is saved next to it as a sidecar file <video>.idx (JSON) with:
+# @frames: real number of frames of the video
+# @keyframes: frame numbers (in display order) of the keyframes
+# @packets: [pts, byte position] of the packet of each frame, in display order
+# @size, @mtime: of the video when it was indexed, to know if the index is out of date
+# Seeking with the index goes straight to the keyframe of the GOP of the frame and decodes forward only what is needed.
+
+# Build the indexes of all the videos in a folder with:
+# python video_index.py /path/to/dmd
+
+
+# Function to get the path of the index of @videoPath
+def getIndexPath(videoPath):
+    return Path(str(videoPath) + ".idx")
+
+
+# Function to read the packets of @videoPath with ffprobe and build its index dict
+def buildIndex(videoPath):
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts,dts,pos,flags", "-of", "json", str(videoPath)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    packets = json.loads(result.stdout.decode("utf-8")).get("packets", [])
+
+    # Packets come in decoding order, frames are numbered in display order
+    decoded = []
+    for count, packet in enumerate(packets):
+        pts = packet.get("pts", "N/A")
+        if pts == "N/A":
+            pts = packet.get("dts", "N/A")
+        pts = int(pts) if pts != "N/A" else count
+        pos = packet.get("pos", "N/A")
+        pos = int(pos) if pos != "N/A" else -1
+        decoded.append((pts, pos, "K" in packet.get("flags", "")))
+    decoded.sort(key=lambda packet: packet[0])
+
+    stat = os.stat(str(videoPath))
+    return {
+        "video": Path(videoPath).name,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "frames": len(decoded),
+        "keyframes": [frame for frame, packet in enumerate(decoded) if packet[2]],
+        "packets": [[packet[0], packet[1]] for packet in decoded],
+    }
+
+
+# Function to build and save the index of @videoPath. Returns the index
+def writeIndex(videoPath):
+    index = buildIndex(videoPath)
+    with open(str(getIndexPath(videoPath)), "w") as index_file:
+        json.dump(index, index_file)
+    return index
+
+
+# Function to load the index of @videoPath
+# Returns None if there is no index or the video changed after it was indexed
+def loadIndex(videoPath):
+    indexPath = getIndexPath(videoPath)
+    if not indexPath.exists():
+        return None
+    with open(str(indexPath)) as index_file:
+        index = json.load(index_file)
+    stat = os.stat(str(videoPath))
+    if index.get("size") != stat.st_size or index.get("mtime") != stat.st_mtime:
+        print("WARNING: index of", Path(videoPath).name, "is out of date, it will not be used")
+        return None
+    return index
+
+
+# Function to get the last keyframe of @keyframes at or before @frame
+def getKeyframeBefore(keyframes, frame):
+    i = bisect.bisect_right(keyframes, frame) - 1
+    return keyframes[i] if i >= 0 else 0
+
+
+# Function to split the frames @start to @end of a video of @frameCount frames in segments that can be
+# copied without re-encoding (whole GOPs, from a keyframe to the frame before the next one) and the partial GOPs
+# at the edges, which have to be re-encoded
+# Returns a list of [first frame, last frame, True if it can be copied]
+def getSmartCutSegments(start, end, keyframes, frameCount):
+    # The end of the video closes its last GOP
+    bounds = [frame for frame in keyframes + [frameCount] if start <= frame <= end + 1]
+    if len(bounds) < 2:
+        return [[start, end, False]]
+    segments = []
+    if start < bounds[0]:
+        segments.append([start, bounds[0] - 1, False])
+    segments.append([bounds[0], bounds[-1] - 1, True])
+    if bounds[-1] <= end:
+        segments.append([bounds[-1], end, False])
+    return segments
+
+
+# Function to move @capVideo so the next frame it reads is @target
+# @position: frame that @capVideo would read next, None if unknown
+# @keyframes: keyframes of the video index. Without them, capVideo.set() is used.
+# With them, the video is only sought when @position is not already between the keyframe of @target and @target;
+# then it is sought straight to that keyframe and decoded forward with grab() up to @target
+# Returns the new position (@target)
+def seekFrame(capVideo, position, target, keyframes=None):
+    if keyframes is None or len(keyframes) == 0:
+        if position != target:
+            capVideo.set(cv2.CAP_PROP_POS_FRAMES, target)
+        return target
+    keyframe = getKeyframeBefore(keyframes, target)
+    if position is None or position < keyframe or position > target:
+        capVideo.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        position = keyframe
+    while position < target:
+        if not capVideo.grab():
+            break
+        position += 1
+    return target
+
+
+# Policy to move a capture to the next frame to read, choosing for each gap the cheapest of seeking
+# or decoding forward with grab(). Close frames are faster to reach by decoding forward and far frames by seeking.
+# The cost of grab() and of a seek are measured on the video itself with calibrate().
+# @keyframes: keyframes of the video index, None if the video is not indexed
+class SeekPolicy():
+
+    def __init__(self, keyframes=None):
+        self.keyframes = keyframes if keyframes else None
+        # @grabCost: seconds to decode a frame with grab()
+        self.grabCost = None
+        # @seekCost: seconds of a seek. With keyframes, to a keyframe; without them, to any frame
+        self.seekCost = None
+        # Counters of the decisions taken
+        self.seeks = 0
+        self.grabbedFrames = 0
+
+    # Function to measure the costs on @capVideo with @grabs frames decoded forward and @seeks seeks
+    # spread over its @frameCount frames. The capture is left at an unknown position
+    def calibrate(self, capVideo, frameCount, grabs=30, seeks=3):
+        start = time.perf_counter()
+        grabbed = 0
+        for _ in range(grabs):
+            if not capVideo.grab():
+                break
+            grabbed += 1
+        self.grabCost = (time.perf_counter() - start) / max(grabbed, 1)
+
+        start = time.perf_counter()
+        for i in range(seeks):
+            target = int((i + 1) * frameCount / (seeks + 1))
+            if self.keyframes:
+                target = getKeyframeBefore(self.keyframes, target)
+            capVideo.set(cv2.CAP_PROP_POS_FRAMES, target)
+        self.seekCost = (time.perf_counter() - start) / seeks
+
+    # Function to estimate the seconds needed to get to frame @target by seeking
+    def getSeekCost(self, target):
+        if self.keyframes:
+            return self.seekCost + (target - getKeyframeBefore(self.keyframes, target)) * self.grabCost
+        return self.seekCost
+
+    # Function to move @capVideo from @position (None if unknown) so the next frame it reads is @target
+    # Returns the new position (@target), None if grab() failed before reaching it
+    def seek(self, capVideo, position, target):
+        if self.grabCost is None:
+            return seekFrame(capVideo, position, target, self.keyframes)
+        if position is not None and position <= target and (target - position) * self.grabCost <= self.getSeekCost(target):
+            # Decode forward without seeking
+            while position < target:
+                if not capVideo.grab():
+                    return None
+                position += 1
+                self.grabbedFrames += 1
+            return target
+        self.seeks += 1
+        return seekFrame(capVideo, None, target, self.keyframes)
+
+
+# Probe cache of the stream videos, saved by default in <destination folder>/dex_probe_cache.json (JSON) with an entry
+# per video path, so exports do not open every video again to check it. Each entry has:
+# @frames: real number of frames of the video (of its index if it is indexed), @indexed: if @frames is of the index
+# @fps, @width, @height: of the video, @codec: fourcc of the video codec
+# @size, @mtime: of the video when it was probed, to know if the entry is out of date
+# @checked: frame count exported for each OpenLABEL frame count the video was checked with (1 less for the depth
+# videos that are missing their last frame)
+# @seekCosts: seconds to decode a frame with grab() and of a seek, measured by SeekPolicy.calibrate()
+probeCacheName = "dex_probe_cache.json"
+
+
+# Function to open @videoPath and get its probe cache entry
+def probeVideo(videoPath):
+    index = loadIndex(videoPath)
+    capVideo = cv2.VideoCapture(str(videoPath))
+    try:
+        fourcc = int(capVideo.get(cv2.CAP_PROP_FOURCC))
+        probe = {
+            "frames": index["frames"] if index is not None else int(capVideo.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "indexed": index is not None,
+            "fps": capVideo.get(cv2.CAP_PROP_FPS),
+            "width": int(capVideo.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capVideo.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "codec": "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00"),
+        }
+    finally:
+        capVideo.release()
+    stat = os.stat(str(videoPath))
+    probe["size"] = stat.st_size
+    probe["mtime"] = stat.st_mtime
+    return probe
+
+
+class ProbeCache():
+
+    # @path: path of the JSON file of the cache
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = self.read()
+        # @self.changed: entries probed since the cache was read, written by save()
+        self.changed = {}
+
+    def read(self):
+        if not self.path.exists():
+            return {}
+        try:
+            with open(str(self.path)) as cache_file:
+                return json.load(cache_file)
+        except ValueError:
+            print("WARNING: probe cache", self.path, "is not valid, videos will be probed again")
+            return {}
+
+    # Function to get the entry of @videoPath, None if it is not in the cache or the video changed after it was probed
+    def get(self, videoPath):
+        entry = self.entries.get(str(Path(videoPath).resolve()))
+        if entry is None:
+            return None
+        stat = os.stat(str(videoPath))
+        if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime:
+            return None
+        # Frame counts of OpenCV are replaced by the one of the index when the video is indexed
+        if not entry.get("indexed") and getIndexPath(videoPath).exists():
+            return None
+        return entry
+
+    # Function to get the entry of @videoPath, probing the video if the cache does not have it
+    def getProbe(self, videoPath):
+        entry = self.get(videoPath)
+        if entry is None:
+            entry = probeVideo(videoPath)
+            key = str(Path(videoPath).resolve())
+            self.entries[key] = entry
+            self.changed[key] = entry
+        return entry
+
+    # Function to get the frame count exported from @videoPath when its OpenLABEL has @openlabelFrames frames,
+    # None if the video was not checked with that OpenLABEL frame count
+    def getChecked(self, videoPath, openlabelFrames):
+        entry = self.get(videoPath)
+        if entry is None:
+            return None
+        return entry.get("checked", {}).get(str(openlabelFrames))
+
+    # Function to keep in the entry of @videoPath the frame count @frames exported when its OpenLABEL has
+    # @openlabelFrames frames. Nothing is kept if the video is not in the cache
+    def setChecked(self, videoPath, openlabelFrames, frames):
+        key = str(Path(videoPath).resolve())
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry.setdefault("checked", {})[str(openlabelFrames)] = frames
+        self.changed[key] = entry
+
+    # Function to keep in the entry of @videoPath the @grabCost and @seekCost of its SeekPolicy.
+    # Nothing is kept if the video is not in the cache
+    def setSeekCosts(self, videoPath, grabCost, seekCost):
+        key = str(Path(videoPath).resolve())
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry["seekCosts"] = [grabCost, seekCost]
+        self.changed[key] = entry
+
+    # Function to write the new entries in the cache file, keeping the ones written by other exports since it was read
+    def save(self):
+        if len(self.changed) == 0:
+            return
+        entries = self.read()
+        entries.update(self.changed)
+        # Written in a temporary file and renamed, so exports running in parallel never read half a file
+        tempPath = Path(str(self.path) + ".%d.tmp" % os.getpid())
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tempPath), "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(str(tempPath), str(self.path))
+        except OSError:
+            print("WARNING: probe cache could not be written in", self.path)
+        self.entries = entries
+        self.changed = {}
+
+
+# Function to index every mp4 and avi video inside @folderPath (or the video @folderPath)
+# @overwrite: False to keep the indexes that are up to date
+def indexVideos(folderPath, overwrite=False):
+    folderPath = Path(folderPath)
+    if folderPath.is_file():
+        videoPaths = [folderPath]
+    else:
+        videoPaths = sorted(list(folderPath.rglob("*.mp4")) + list(folderPath.rglob("*.avi")))
+    for count, videoPath in enumerate(videoPaths):
+        if not overwrite and loadIndex(videoPath) is not None:
+            print("[%d/%d] %s: index up to date" % (count + 1, len(videoPaths), videoPath.name))
+            continue
+        index = writeIndex(videoPath)
+        print("[%d/%d] %s: %d frames, %d keyframes" % (count + 1, len(videoPaths), videoPath.name,
+                                                      index["frames"], len(index["keyframes"])))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python video_index.py <dmd folder or video> [--overwrite]")
+    else:
+        indexVideos(sys.argv[1], "--overwrite" in sys.argv)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import queue
+import threading
+from pathlib import Path
+
+import cv2
+import ffmpeg
+import numpy as np
+
+# Readers used by exportClass (accessDMDAnn.py) to get only the frames of the intervals to export.
+# Readers are generators of (frame number, image) in frame order.
+
+
+# Function to get the path of the per-frame crop ROIs of @videoPath
+def getRoiSidecarPath(videoPath):
+    return Path(str(videoPath) + ".roi.json")
+
+
+# Crop region of the frames of a stream video, in pixels of the video: [x, y, width, height]
+# @rois: dict of {stream frame: [x, y, width, height]}. Frames without ROI take the one of the closest frame
+# before them (the first ROI for the frames before it). With only one ROI, the crop is static
+class CropRoi():
+
+    def __init__(self, rois):
+        self.frames = sorted(rois)
+        self.rois = [[int(value) for value in rois[frame]] for frame in self.frames]
+        self.static = len(self.rois) == 1
+
+    # Function to get the [x, y, width, height] of @frame
+    def get(self, frame):
+        return self.rois[max(bisect.bisect_right(self.frames, frame) - 1, 0)]
+
+    # Function to get the [width, height] of the cropped frames, None if the ROIs do not have all the same size
+    def getSize(self):
+        sizes = set((roi[2], roi[3]) for roi in self.rois)
+        return list(sizes.pop()) if len(sizes) == 1 else None
+
+    # Function to get the pixels of @image (of stream frame @frame) inside its ROI
+    def apply(self, frame, image):
+        x, y, width, height = self.get(frame)
+        return image[y:y + height, x:x + width]
+
+    # Function to raise an error if any ROI is not inside frames of @width x @height
+    def check(self, width, height):
+        for x, y, roiWidth, roiHeight in self.rois:
+            if x < 0 or y < 0 or roiWidth <= 0 or roiHeight <= 0 or x + roiWidth > width or y + roiHeight > height:
+                raise RuntimeError("WARNING: crop ROI %s is not inside the %dx%d frames of the video" %
+                                   ([x, y, roiWidth, roiHeight], width, height))
+
+
+# Function to get the CropRoi of @videoPath from the crop option @roi of exportClass: [x, y, width, height], or
+# "sidecar" to read the ROIs of every frame from the sidecar file <video>.roi.json: {"<stream frame>": [x, y, width, height]}
+def loadCropRoi(roi, videoPath):
+    if roi != "sidecar":
+        return CropRoi({0: roi})
+    sidecarPath = getRoiSidecarPath(videoPath)
+    if not sidecarPath.exists():
+        raise RuntimeError("WARNING: crop ROIs of %s not found in %s" % (Path(videoPath).name, sidecarPath))
+    with open(str(sidecarPath)) as sidecar_file:
+        rois = json.load(sidecar_file)
+    if len(rois) == 0:
+        raise RuntimeError("WARNING: crop ROIs file %s is empty" % sidecarPath)
+    return CropRoi({int(frame): roi for frame, roi in rois.items()})
+
+
+# Reads the frames of @ranges from the video @path through a persistent ffmpeg pipe.
+# Frames are read in chunks of @chunkFrames, so memory does not depend on the length of the video.
+# ffmpeg drops the frames outside @ranges before scaling, so they are never converted nor sent through the pipe.
+# @width, @height: size of the frames of the video
+# @ranges: sorted list of [start, end] frame ranges to read, as returned by exportClass.mergeIntervals()
+# @size: "original" or [width, height] of the output frames, scaled by ffmpeg
+# @threads: number of decoding and filtering threads of ffmpeg, 0 to let ffmpeg choose
+# @crop: CropRoi of the frames, None to not crop them. Static crops are made by ffmpeg before scaling. ROIs that change
+# in every frame cannot be given to one ffmpeg filter: those frames come whole through the pipe and are cropped and
+# resized after it
+class PipeReader():
+
+    # Maximum number of ranges in the ffmpeg select expression, close ranges are joined above it
+    maxSelectRanges = 200
+    # Pixel format of the pipe and numpy type and number of channels of its frames
+    pixelFormat = "bgr24"
+    dtype = np.uint8
+    channels = 3
+    # Scaling algorithm of ffmpeg, and of OpenCV for frames cropped after the pipe
+    scaleFlags = "lanczos"
+    interpolation = cv2.INTER_LANCZOS4
+    # True to give black frames for the frames of @ranges after the end of the video
+    padMissing = False
+
+    def __init__(self, path, width, height, ranges, size="original", chunkFrames=16, threads=0, crop=None):
+        self.size = size
+        # @self.frameCrop: CropRoi applied to the frames after the pipe, None if ffmpeg crops them
+        self.frameCrop = crop if crop is not None and not crop.static else None
+        if self.frameCrop is not None:
+            size = "original"
+        elif crop is not None:
+            width, height = crop.getSize()
+        if size != "original":
+            width, height = size[0], size[1]
+        self.width = width
+        self.height = height
+        self.frameShape = [height, width] if self.channels == 1 else [height, width, self.channels]
+        self.frameBytes = width * height * self.channels * np.dtype(self.dtype).itemsize
+        self.chunkFrames = chunkFrames
+        self.ranges = ranges
+        self.selectRanges = self.joinRanges(ranges, self.maxSelectRanges)
+
+        if threads > 0:
+            stream = ffmpeg.input(str(path), threads=threads)
+        else:
+            stream = ffmpeg.input(str(path))
+        stream = stream.filter_('select', "+".join("between(n,%d,%d)" % (start, end) for start, end in self.selectRanges))
+        if crop is not None and self.frameCrop is None:
+            x, y, cropWidth, cropHeight = crop.get(0)
+            stream = stream.filter_('crop', w=cropWidth, h=cropHeight, x=x, y=y, exact=1)
+        if size != "original":
+            stream = stream.filter_('scale', width=width, height=height, sws_flags=self.scaleFlags)
+        globalArgs = ['-loglevel', 'error']
+        if threads > 0:
+            globalArgs += ['-filter_threads', str(threads)]
+        self.process = (
+            stream
+            .output('pipe:', format='rawvideo', pix_fmt=self.pixelFormat, vsync='passthrough')
+            .global_args(*globalArgs)
+            .run_async(pipe_stdout=True)
+        )
+
+    # Function to join the closest ranges of @ranges until there are no more than @maxRanges
+    def joinRanges(self, ranges, maxRanges):
+        joined = [list(r) for r in ranges]
+        while len(joined) > maxRanges:
+            gaps = [joined[i + 1][0] - joined[i][1] for i in range(len(joined) - 1)]
+            i = gaps.index(min(gaps))
+            joined[i:i + 2] = [[joined[i][0], joined[i + 1][1]]]
+        return joined
+
+    # Generator of the frames sent by ffmpeg, read in chunks
+    def rawFrames(self):
+        while True:
+            data = self.process.stdout.read(self.frameBytes * self.chunkFrames)
+            count = len(data) // self.frameBytes
+            if count == 0:
+                return
+            chunk = np.frombuffer(data, self.dtype, count * self.frameBytes // np.dtype(self.dtype).itemsize).reshape([count] + self.frameShape)
+            for frame in chunk:
+                yield frame
+            if count < self.chunkFrames:
+                return
+
+    # Generator of (frame number, image) of every frame in @self.ranges
+    def frames(self):
+        if self.frameCrop is None:
+            yield from self.pipeFrames()
+            return
+        for frameNumber, frame in self.pipeFrames():
+            frame = self.frameCrop.apply(frameNumber, frame)
+            if self.size != "original":
+                frame = cv2.resize(frame, tuple(self.size), interpolation=self.interpolation)
+            yield frameNumber, np.ascontiguousarray(frame)
+
+    # Generator of (frame number, image) of every frame in @self.ranges, as they come through the pipe
+    def pipeFrames(self):
+        raw = self.rawFrames()
+        wanted = iter(self.ranges)
+        start, end = next(wanted, (None, None))
+        for selectStart, selectEnd in self.selectRanges:
+            for frameNumber in range(selectStart, selectEnd + 1):
+                frame = next(raw, None)
+                if frame is None:
+                    if not self.padMissing:
+                        print("WARNING: video ended at frame %d, the remaining clips are incomplete" % frameNumber)
+                        return
+                    frame = np.zeros(self.frameShape, dtype=self.dtype)
+                while end is not None and frameNumber > end:
+                    start, end = next(wanted, (None, None))
+                if start is not None and start <= frameNumber:
+                    yield frameNumber, frame
+
+    def close(self):
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+
+# Reads rgb or ir frames as BGR images, like cv2.VideoCapture, but decoding, scaling and
+# pixel format conversion are made by ffmpeg (with multithreaded swscale), so the frames
+# arrive already at the export size.
+class FfmpegReader(PipeReader):
+    pass
+
+
+# Reads the 16 bit depth frames of a depth video.
+# Frames of @ranges after the end of the video (some depth videos miss the last frame) are given as black images.
+class DepthReader(PipeReader):
+    pixelFormat = "gray16le"
+    dtype = np.uint16
+    channels = 1
+    scaleFlags = "neighbor"
+    interpolation = cv2.INTER_NEAREST
+    padMissing = True
+
+
+# Reads the (frame number, image) generator @source in its own thread, so several videos are decoded at the same time.
+# The decoding thread can be @queueSize frames ahead of frames(). Errors of @source are raised by frames().
+# @budget: MemoryBudget (export_writers.py) where the frames in the queue count, None for no budget
+class ThreadedReader():
+
+    def __init__(self, source, queueSize=8, budget=None):
+        self.source = source
+        self.budget = budget
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    # Put @item in the queue, unless the reader is closed. Returns False if it was closed
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for item in self.source:
+                if self.budget is not None:
+                    # Wait only while frames() has frames of this reader to take, it may be waiting for this one
+                    self.budget.acquire(item[1].nbytes, lambda: not self.queue.empty() and not self.stopped.is_set())
+                if not self._put(("frame", item)):
+                    return
+                if self.budget is not None:
+                    self.budget.peak("readerQueue", self.queue.qsize())
+            self._put(("end", None))
+        except Exception as e:
+            self._put(("error", e))
+
+    # Generator of the frames read by the thread
+    def frames(self):
+        while True:
+            kind, item = self.queue.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise item
+            if self.budget is not None:
+                self.budget.release(item[1].nbytes)
+            yield item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.source.close()